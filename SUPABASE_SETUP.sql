@@ -109,8 +109,10 @@ CREATE TABLE IF NOT EXISTS training_samples (
     confidence_score FLOAT,
     quality_score FLOAT,
     status TEXT DEFAULT 'pending',
+    bbox JSONB, -- reviewer-drawn [x1, y1, x2, y2] in image pixels; only boxed samples are held out for evaluation
     created_at TIMESTAMP DEFAULT NOW()
 );
+ALTER TABLE training_samples ADD COLUMN IF NOT EXISTS bbox JSONB;
 
 -- 10. Create model_versions table (auto-learning)
 CREATE TABLE IF NOT EXISTS model_versions (
@@ -0,0 +1,471 @@
+"""
+Lost & Found AI Engine
+Single-pass inference core shared by every endpoint
+"""
+
+import os
+import time
+import threading
+import numpy as np
+from batching import MicroBatcher
+from metrics import span
+from result_cache import ResultCache, content_hash
+from perceptual_hash import dhash, phash
+from color_features import analyze_features
+from image_io import decode_image, crop_array, crop_jpeg
+from embeddings import fallback_embedding, FALLBACK_EMBEDDING_NAME
+from backends import create_backend
+from tiling import TILE_SIZE, TILE_DECODE_SIDE, MAX_TILES, should_tile, tile_windows, merge_tiles
+
+
+DEFAULT_MODEL_PATH = os.environ.get('AI_MODEL_PATH', 'yolov8m.pt')
+# 'ultralytics' (PyTorch) or 'onnx' (ONNX Runtime); .onnx weights always use onnx
+DEFAULT_BACKEND = os.environ.get('AI_BACKEND') or None
+
+# Lowest confidence any view asks for; the forward pass keeps everything above it
+MIN_CONFIDENCE = 0.25
+DETECT_CONFIDENCE = 0.3
+HYBRID_CONFIDENCE = 0.25
+
+# Outputs /analyze can return; DEFAULT_OUTPUTS when the caller does not choose
+ANALYZE_OUTPUTS = ('detections', 'features', 'secondary_tags', 'embedding', 'crops', 'detection_embeddings')
+DEFAULT_OUTPUTS = ('detections', 'features', 'secondary_tags', 'embedding')
+
+# Crops returned by /analyze: at most this many, each at most CROP_MAX_SIDE pixels
+MAX_CROPS = int(os.environ.get('AI_MAX_CROPS', 10))
+CROP_MAX_SIDE = int(os.environ.get('AI_CROP_MAX_SIDE', 256))
+
+# Per-detection embeddings: crops run through the model at this input size; smaller crops are skipped
+CROP_EMBED_SIZE = int(os.environ.get('AI_CROP_EMBED_SIZE', 224))
+MIN_CROP_SIDE = 8
+
+# Side of the synthetic frame used to warm up a freshly loaded model
+WARMUP_SIZE = 640
+
+# Bumped whenever the shape of a raw result changes, so cached entries are not reused
+RESULT_SCHEMA = 6
+
+# Category mapping for lost & found items
+CATEGORY_MAPPING = {
+    'person': 'other',
+    'backpack': 'bags',
+    'bag': 'bags',
+    'luggage': 'bags',
+    'purse': 'bags',
+    'wallet': 'accessories',
+    'phone': 'electronics',
+    'laptop': 'electronics',
+    'computer': 'electronics',
+    'tablet': 'electronics',
+    'headphones': 'electronics',
+    'camera': 'electronics',
+    'watch': 'jewelry',
+    'glasses': 'accessories',
+    'umbrella': 'accessories',
+    'book': 'books',
+    'bottle': 'other',
+    'cup': 'other',
+    'keys': 'keys',
+    'jacket': 'clothing',
+    'shirt': 'clothing',
+    'pants': 'clothing',
+    'dress': 'clothing',
+    'shoe': 'clothing',
+    'ball': 'sports_equipment',
+    'bat': 'sports_equipment',
+    'racket': 'sports_equipment',
+    'toy': 'toys',
+    'teddy bear': 'toys',
+    'document': 'documents',
+    'paper': 'documents',
+    'folder': 'documents'
+}
+
+# Valid categories
+VALID_CATEGORIES = [
+    'electronics', 'clothing', 'accessories', 'bags', 'books',
+    'keys', 'jewelry', 'sports_equipment', 'documents', 'toys',
+    'tools', 'furniture', 'other'
+]
+
+# Color mapping for categories
+CATEGORY_COLORS = {
+    'electronics': (255, 0, 0),
+    'clothing': (0, 255, 0),
+    'accessories': (0, 0, 255),
+    'bags': (255, 255, 0),
+    'books': (255, 0, 255),
+    'keys': (0, 255, 255),
+    'jewelry': (128, 0, 128),
+    'sports_equipment': (255, 165, 0),
+    'documents': (128, 128, 0),
+    'toys': (128, 0, 0),
+    'tools': (0, 128, 0),
+    'furniture': (0, 0, 128),
+    'other': (128, 128, 128)
+}
+
+# Detections returned when no model could be loaded
+FALLBACK_DETECTIONS = [
+    {'class': 'bag', 'category': 'bags', 'confidence': 0.75, 'bbox': [50, 50, 200, 200]},
+    {'class': 'electronics', 'category': 'electronics', 'confidence': 0.60, 'bbox': [100, 100, 180, 180]}
+]
+
+
+def preprocess_image(file_bytes):
+    """Convert uploaded file to image array (decoded near model resolution)"""
+    return decode_image(file_bytes)[0]
+
+
+def map_to_category(detected_class):
+    """Map detected object to lost & found category"""
+    detected_class = detected_class.lower()
+    return CATEGORY_MAPPING.get(detected_class, 'other')
+
+
+def secondary_tags_for(features, category):
+    """Derive semantic tags from colour features and the primary category"""
+    secondary_tags = []
+    if 'red' in features:
+        secondary_tags.append('red')
+    if 'blue' in features:
+        secondary_tags.append('blue')
+    if 'dark_color' in features:
+        secondary_tags.append('dark')
+    if 'vibrant' in features:
+        secondary_tags.append('colorful')
+
+    # Add importance indicators
+    if category in ['electronics', 'jewelry', 'keys']:
+        secondary_tags.append('valuable')
+    elif category in ['documents', 'books']:
+        secondary_tags.append('important')
+
+    return secondary_tags
+
+
+class AIEngine:
+    """Owns the detector and turns one image into one raw inference result"""
+
+    def __init__(self, model_path=DEFAULT_MODEL_PATH, load=True, backend=DEFAULT_BACKEND, cache=None):
+        self.model_path = model_path
+        self.backend_kind = backend
+        self.backend = None
+        self.names = {}
+        self.model_loaded = False
+        self.model_version = 'fallback'
+        self.embedding_model = FALLBACK_EMBEDDING_NAME
+
+        # 'loading' until load_model() finishes, then 'ready' or 'failed' (fallback detections)
+        self.state = 'loading'
+        self._ready = threading.Event()
+        self.timings = {'created_at': time.time(), 'load_seconds': None, 'warmup_seconds': None,
+                        'ready_at': None, 'first_inference_at': None}
+
+        # Concurrent requests are grouped into a single batched forward pass (one queue per input size)
+        self.batcher = MicroBatcher(self._run_batch, name='yolo')
+        self._batchers = {None: self.batcher}
+        self.cache = cache if cache is not None else ResultCache()
+        if load:
+            self.load_model()
+
+    def start_loading(self, warmup=False):
+        """Load (and optionally warm up) the model on a background thread"""
+        threading.Thread(target=self.load_model, args=(warmup,), name='model-loader', daemon=True).start()
+
+    def wait_until_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def load_model(self, warmup=False):
+        """Load YOLO weights, falling back to mock detections if unavailable"""
+        print("Loading YOLO model...")
+        started = time.perf_counter()
+        try:
+            self.backend = create_backend(self.model_path, self.backend_kind)
+            self.names = self.backend.names
+            self.embedding_model = self.backend.embedding_model or FALLBACK_EMBEDDING_NAME
+            self.model_loaded = True
+            self.model_version = self._version_of(self.model_path)
+            print(f"✓ YOLO model loaded successfully ({self.backend.kind} backend)")
+        except Exception as e:
+            print(f"⚠ YOLO model not available: {e}")
+            print("⚠ Running in fallback mode with mock detections")
+            self.model_loaded = False
+        self.timings['load_seconds'] = round(time.perf_counter() - started, 3)
+
+        if warmup:
+            self.warm_up()
+        self.state = 'ready' if self.model_loaded else 'failed'
+        self.timings['ready_at'] = time.time()
+        self._ready.set()
+
+    def close(self):
+        """Release the model (registry eviction); the engine must not be used afterwards"""
+        for batcher in self._batchers.values():
+            batcher.close()
+        self.backend = None
+        self.model_loaded = False
+
+    def warm_up(self):
+        """One inference on a synthetic frame so the first real request skips lazy initialisation"""
+        if not self.model_loaded:
+            return
+        started = time.perf_counter()
+        try:
+            self.batcher.submit(np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8))
+            self.timings['warmup_seconds'] = round(time.perf_counter() - started, 3)
+            print(f"✓ Model warmed up in {self.timings['warmup_seconds']}s")
+        except Exception as e:
+            print(f"⚠ Warm-up inference failed: {e}")
+
+    @staticmethod
+    def _version_of(model_path):
+        """Identify the weights so cached results never outlive a model swap"""
+        name = os.path.basename(model_path)
+        if os.path.exists(model_path):
+            stat = os.stat(model_path)
+            return f'{name}@{stat.st_size}-{int(stat.st_mtime)}'
+        return name
+
+    def batcher_for(self, imgsz=None):
+        """Batcher for a given inference resolution (None is the model's default)"""
+        batcher = self._batchers.get(imgsz)
+        if batcher is None:
+            batcher = self._batchers.setdefault(
+                imgsz, MicroBatcher(lambda images: self._run_batch(images, imgsz), name=f'yolo-{imgsz}'))
+        return batcher
+
+    def _run_batch(self, images, imgsz=None):
+        """Run one detector forward pass over a list of images"""
+        return self.backend.predict(images, MIN_CONFIDENCE, imgsz)
+
+    def analyze(self, img, with_features=True, scale=1.0, imgsz=None):
+        """Run detection (and optionally feature analysis) once for an image"""
+        return self.analyze_many([img], with_features, [scale], imgsz)[0]
+
+    def analyze_many(self, images, with_features=True, scales=None, imgsz=None):
+        """
+        Analyze several images; all of them are queued before waiting so they share batches.
+        scales maps each decoded image back to its original resolution (see decode_image).
+        Blocks while the model is still loading.
+        """
+        self._ready.wait()
+        if self.model_loaded:
+            batcher = self.batcher_for(imgsz)
+            futures = [batcher.submit_async(img) for img in images]
+            with span('detect'):  # queue wait plus the batched forward pass, as seen by this request
+                raws = [future.result() for future in futures]
+            for raw in raws:
+                raw['fallback'] = False
+            if self.timings['first_inference_at'] is None:
+                self.timings['first_inference_at'] = time.time()
+        else:
+            raws = [{'fallback': True} for _ in images]
+
+        for img, raw, scale in zip(images, raws, scales or [1.0] * len(images)):
+            raw['shape'] = img.shape[:2]
+            raw['scale'] = scale
+            raw['phash'] = phash(img)
+            with span('features'):
+                raw['features'] = analyze_features(img) if with_features else None
+            if raw.get('embedding') is None:
+                with span('embedding'):
+                    raw['embedding'] = fallback_embedding(img)
+                raw['embedding_model'] = FALLBACK_EMBEDDING_NAME
+            else:
+                raw['embedding_model'] = self.embedding_model
+        return raws
+
+    def analyze_tiled(self, img, with_features=True, scale=1.0, imgsz=None, max_tiles=MAX_TILES):
+        """
+        analyze() plus overlapping tiles for small objects. The tiles are queued before the
+        whole image, so all of them normally share one forward pass; boxes are merged by merge_tiles().
+        """
+        self._ready.wait()
+        windows = tile_windows(img.shape[:2], imgsz or TILE_SIZE, max_tiles=max_tiles) if self.model_loaded else []
+        if not windows:
+            return self.analyze(img, with_features, scale, imgsz)
+
+        batcher = self.batcher_for(imgsz)
+        futures = [batcher.submit_async(img[y0:y1, x0:x1]) for x0, y0, x1, y1 in windows]
+        raw = self.analyze(img, with_features, scale, imgsz)
+        raw.update(merge_tiles(raw, [future.result() for future in futures], windows))
+        raw['tiles'] = len(windows)
+        return raw
+
+    def analyze_upload(self, upload, with_features=True, imgsz=None, tiling='off', return_image=False):
+        """
+        Cached analyze() for an uploaded file (bytes or a seekable binary stream).
+        Identical uploads skip decoding and inference; streams are hashed and decoded in place.
+        tiling is 'off', 'auto' or 'on' (see tiling.py).
+        With return_image, returns (raw, (img, scale)); the image is decoded even on a cache hit.
+        """
+        self._ready.wait()  # the cache key depends on which model ends up loaded
+        version = f'{self.model_version}@{imgsz or "default"}+{tiling}#{RESULT_SCHEMA}'
+        key = self.cache.make_key(version, content_hash(upload))
+        cached = self.cache.get(key)
+        raw = cached
+        img, scale = None, 1.0
+        phash = None
+
+        if raw is None:
+            with span('decode'):
+                if tiling == 'off':
+                    img, scale = decode_image(upload)
+                else:
+                    img, scale = decode_image(upload, TILE_DECODE_SIDE)
+            if self.cache.use_phash:
+                phash = dhash(img)
+                raw = self.cache.get_by_phash(version, phash)
+                if raw is not None:
+                    raw = self._rescaled(raw, img, scale)
+            if raw is None and should_tile(tiling, max(img.shape[:2]) * scale, imgsz or TILE_SIZE):
+                raw = self.analyze_tiled(img, with_features, scale, imgsz)
+            elif raw is None:
+                raw = self.analyze(img, with_features, scale, imgsz)
+
+        if img is None and (return_image or (with_features and raw['features'] is None)):
+            with span('decode'):
+                img, scale = decode_image(upload)
+        add_features = with_features and raw['features'] is None
+        if add_features:
+            with span('features'):
+                raw['features'] = analyze_features(img)
+        if add_features or raw is not cached:
+            self.cache.put(key, raw, phash=phash, model_version=version)
+        return (raw, (img, scale)) if return_image else raw
+
+    @staticmethod
+    def _rescaled(raw, img, scale):
+        """Re-express a near-duplicate's result in this upload's decoded coordinates"""
+        rescaled = dict(raw, shape=img.shape[:2], scale=scale)
+        if not raw['fallback']:
+            rescaled['boxes'] = raw['boxes'] * np.float32(max(img.shape[:2]) / max(raw['shape']))
+        return rescaled
+
+    def detections(self, raw, threshold):
+        """Serialize detections above threshold, sorted by confidence"""
+        if raw['fallback']:
+            return [dict(d) for d in FALLBACK_DETECTIONS if d['confidence'] > threshold]
+
+        keep = np.flatnonzero(raw['scores'] > threshold)
+        keep = keep[np.argsort(-raw['scores'][keep], kind='stable')]
+        # Boxes come from the decoded image; report them in original pixel coordinates
+        boxes = np.rint(raw['boxes'][keep] * raw['scale']).astype(np.int32).tolist()
+        scores = np.round(raw['scores'][keep].astype(np.float64), 2).tolist()
+
+        detections = []
+        for cls, conf, bbox in zip(raw['class_ids'][keep].tolist(), scores, boxes):
+            class_name = self.names[cls]
+            detections.append({
+                'class': class_name,
+                'category': map_to_category(class_name),
+                'confidence': conf,
+                'bbox': bbox
+            })
+        return detections
+
+    def detect_view(self, raw):
+        """Response body for /detect"""
+        detections = self.detections(raw, DETECT_CONFIDENCE)
+        return {
+            'detections': detections,
+            'status': 'SUCCESS' if detections else 'LOW_CONFIDENCE',
+            'count': len(detections),
+            'tiles': raw.get('tiles', 0)
+        }
+
+    def hybrid_view(self, raw):
+        """Response body for /analyze-hybrid"""
+        detections = self.detections(raw, HYBRID_CONFIDENCE)
+        best_category = detections[0]['category'] if detections else 'other'
+        best_confidence = self._best_confidence(raw, HYBRID_CONFIDENCE)
+        features = raw['features'] or []
+
+        return {
+            'detections': detections,
+            'category': best_category,
+            'features': features,
+            'secondary_tags': secondary_tags_for(features, best_category),
+            'status': 'SUCCESS' if detections else 'LOW_CONFIDENCE',
+            'confidence': best_confidence
+        }
+
+    def analyze_view(self, raw, outputs, image=None):
+        """
+        Response body for /analyze with only the requested outputs.
+        Embeddings stay float32 arrays for the caller to serialize. Crops (JPEG bytes aligned
+        with detections) and detection embeddings need image, the (img, scale) pair from analyze_upload().
+        """
+        detections = self.detections(raw, HYBRID_CONFIDENCE)
+        category = detections[0]['category'] if detections else 'other'
+        body = {
+            'category': category,
+            'confidence': self._best_confidence(raw, HYBRID_CONFIDENCE),
+            'status': 'SUCCESS' if detections else 'LOW_CONFIDENCE',
+            'count': len(detections),
+            'tiles': raw.get('tiles', 0)
+        }
+        if 'detections' in outputs:
+            body['detections'] = detections
+        if 'features' in outputs:
+            body['features'] = raw['features'] or []
+        if 'secondary_tags' in outputs:
+            body['secondary_tags'] = secondary_tags_for(raw['features'] or [], category)
+        if 'embedding' in outputs:
+            body['embedding'] = np.asarray(raw['embedding'], dtype=np.float32)
+            body['embedding_model'] = raw['embedding_model']
+        if 'detection_embeddings' in outputs:
+            # Implies detections: each one carries its own vector
+            body['detections'] = self.with_embeddings(detections, image)
+        if 'crops' in outputs:
+            img, scale = image
+            # Detection boxes are in original pixels; the decoded image is smaller by scale
+            body['crops'] = [crop_jpeg(img, [v / scale for v in d['bbox']], CROP_MAX_SIDE)
+                             for d in detections[:MAX_CROPS]]
+        return body
+
+    def detection_embeddings(self, detections, image):
+        """
+        (embedding, embedding_model) per detection, from its box cut out of the decoded image.
+        All crops are queued together so they share forward passes; detections past MAX_CROPS
+        or smaller than MIN_CROP_SIDE get (None, None).
+        """
+        img, scale = image
+        crops, slots = [], []
+        for i, detection in enumerate(detections[:MAX_CROPS]):
+            # Detection boxes are in original pixels; the decoded image is smaller by scale
+            crop = crop_array(img, [v / scale for v in detection['bbox']])
+            if crop is not None and min(crop.shape[:2]) >= MIN_CROP_SIDE:
+                crops.append(np.ascontiguousarray(crop))
+                slots.append(i)
+
+        results = [(None, None)] * len(detections)
+        if crops:
+            for i, raw in zip(slots, self.analyze_many(crops, with_features=False, imgsz=CROP_EMBED_SIZE)):
+                results[i] = (raw['embedding'], raw['embedding_model'])
+        return results
+
+    def with_embeddings(self, detections, image):
+        """Copies of detections, each with its crop's embedding and embedding_model"""
+        return [dict(d, embedding=embedding, embedding_model=model)
+                for d, (embedding, model) in zip(detections, self.detection_embeddings(detections, image))]
+
+    @staticmethod
+    def _best_confidence(raw, threshold):
+        if raw['fallback']:
+            return max((d['confidence'] for d in FALLBACK_DETECTIONS if d['confidence'] > threshold), default=0)
+        scores = raw['scores'][raw['scores'] > threshold]
+        return float(scores.max()) if scores.size else 0
+
+    def detect_objects(self, image_path):
+        """Analyze an image file on disk (used by the debug scripts)"""
+        with open(image_path, 'rb') as f:
+            raw = self.analyze_upload(f)
+
+        result = self.hybrid_view(raw)
+        for det in result['detections']:
+            det['class_name'] = det['class']
+        result['primary_category'] = result['category']
+        result['feature_status'] = 'OK' if result['features'] else 'EMPTY'
+        return result
@@ -0,0 +1,220 @@
+"""
+Detector inference backends
+Each backend turns a list of RGB arrays into raw results: boxes (xyxy), scores and class ids.
+ultralytics runs the .pt weights in PyTorch; onnx runs an exported graph under ONNX Runtime.
+"""
+
+import os
+import ast
+import time
+import numpy as np
+import cv2
+import metrics
+from embeddings import BackboneTap
+
+
+# Backend used when the weights file does not imply one (.onnx -> onnx)
+DEFAULT_BACKEND = os.environ.get('AI_BACKEND', 'ultralytics')
+
+# Execution providers tried in order, e.g. "OpenVINOExecutionProvider,CPUExecutionProvider"
+ONNX_PROVIDERS = os.environ.get('AI_ONNX_PROVIDERS', 'CPUExecutionProvider').split(',')
+
+# Same post-processing defaults as ultralytics predict()
+NMS_IOU = 0.7
+MAX_DETECTIONS = 300
+LETTERBOX_COLOR = 114
+
+
+class UltralyticsBackend:
+    """Eager PyTorch through ultralytics.YOLO; pools backbone features for embeddings"""
+
+    kind = 'ultralytics'
+
+    def __init__(self, weights_path):
+        from ultralytics import YOLO
+        self.model = YOLO(weights_path)
+        self.names = self.model.names
+        self.backbone = None
+        self.embedding_model = None
+        try:
+            self.backbone = BackboneTap(self.model)
+            self.embedding_model = self.backbone.name
+        except Exception as e:
+            print(f"⚠ Backbone embeddings not available: {e}")
+
+    def predict(self, images, conf, imgsz=None):
+        options = {'imgsz': imgsz} if imgsz else {}
+        # ultralytics takes numpy input as BGR (cv2 order); image_io decodes to RGB
+        results = self.model([np.ascontiguousarray(img[..., ::-1]) for img in images], conf=conf, verbose=False, **options)
+        raws = [self._to_raw(result) for result in results]
+        for result in results:
+            # Per-image milliseconds of this batch, measured by ultralytics
+            for stage, ms in (getattr(result, 'speed', None) or {}).items():
+                if ms is not None:
+                    metrics.record(f'yolo_{stage}', ms / 1000.0)
+        if self.backbone is not None:
+            for raw, embedding in zip(raws, self.backbone.take(len(images))):
+                raw['embedding'] = embedding
+        return raws
+
+    @staticmethod
+    def _to_raw(result):
+        """Move all boxes of one result off the device in a single transfer"""
+        boxes = result.boxes
+        return {
+            'boxes': boxes.xyxy.cpu().numpy().astype(np.float32),
+            'scores': boxes.conf.cpu().numpy().astype(np.float32),
+            'class_ids': boxes.cls.cpu().numpy().astype(np.int32)
+        }
+
+
+def letterbox(img, size):
+    """Resize keeping aspect ratio and pad to size x size; returns (image, ratio, (pad_x, pad_y))"""
+    h, w = img.shape[:2]
+    ratio = min(size / h, size / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+    top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+    img = cv2.copyMakeBorder(img, top, size - new_h - top, left, size - new_w - left,
+                             cv2.BORDER_CONSTANT, value=(LETTERBOX_COLOR,) * 3)
+    return img, ratio, (left, top)
+
+
+def to_input_tensor(images, size):
+    """Letterbox a list of RGB arrays into one NCHW float32 batch"""
+    batch = np.empty((len(images), 3, size, size), dtype=np.float32)
+    geometry = []
+    for i, img in enumerate(images):
+        boxed, ratio, pad = letterbox(img, size)
+        batch[i] = boxed.transpose(2, 0, 1)
+        geometry.append((ratio, pad, img.shape[:2]))
+    batch *= 1.0 / 255
+    return batch, geometry
+
+
+def nms(boxes, scores, iou_threshold, metric='iou'):
+    """
+    Greedy non-maximum suppression; returns kept indices by descending score.
+    metric='ios' divides by the smaller box instead of the union, so a fragment
+    of an object (e.g. cut by a tile edge) is suppressed by the whole object.
+    """
+    order = np.argsort(-scores, kind='stable')
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        x1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        y1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        x2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        y2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        if metric == 'ios':
+            iou = inter / np.maximum(np.minimum(areas[i], areas[rest]), 1e-9)
+        else:
+            iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def decode_predictions(output, conf, iou_threshold=NMS_IOU, max_det=MAX_DETECTIONS):
+    """
+    YOLOv8 head output (4 + classes, anchors) for one image -> (boxes xyxy, scores, class_ids)
+    in letterboxed pixels; class-aware NMS like ultralytics (boxes offset per class).
+    """
+    pred = output.T
+    class_scores = pred[:, 4:]
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(pred)), class_ids]
+    keep = scores > conf
+    pred, scores, class_ids = pred[keep], scores[keep], class_ids[keep]
+
+    cx, cy, w, h = pred[:, 0], pred[:, 1], pred[:, 2], pred[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    if len(boxes) == 0:
+        return boxes.astype(np.float32), scores.astype(np.float32), class_ids.astype(np.int32)
+
+    offsets = class_ids[:, None].astype(np.float32) * 7680
+    kept = nms(boxes + offsets, scores, iou_threshold)[:max_det]
+    return boxes[kept].astype(np.float32), scores[kept].astype(np.float32), class_ids[kept].astype(np.int32)
+
+
+class OnnxBackend:
+    """
+    Exported YOLOv8 graph under ONNX Runtime (FP32 or INT8, see scripts/export_onnx.py).
+    Pre/post-processing mirror ultralytics, so detection dicts match the PyTorch backend.
+    """
+
+    kind = 'onnx'
+
+    def __init__(self, onnx_path):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = os.environ.get('AI_INTRA_OP_THREADS')
+        if threads:
+            options.intra_op_num_threads = int(threads)
+        available = ort.get_available_providers()
+        providers = [p for p in ONNX_PROVIDERS if p in available] or ['CPUExecutionProvider']
+
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+        shape = self.session.get_inputs()[0].shape
+        self.imgsz = shape[-1] if isinstance(shape[-1], int) else int(ast.literal_eval(metadata.get('imgsz', '[640]'))[-1])
+        # dynamic=True exports accept any input size; static ones only their export size
+        self.dynamic_size = not isinstance(shape[-1], int)
+        # Exported with dynamic=False the graph only accepts its export batch size
+        self.fixed_batch = shape[0] if isinstance(shape[0], int) else None
+        self.embedding_model = None
+
+    def predict(self, images, conf, imgsz=None):
+        size = imgsz if imgsz and self.dynamic_size else self.imgsz
+        started = time.perf_counter()
+        batch, geometry = to_input_tensor(images, size)
+        preprocessed = time.perf_counter()
+        if self.fixed_batch:
+            # Pad a short last chunk with copies of its last image; their outputs are dropped
+            missing = -len(batch) % self.fixed_batch
+            if missing:
+                batch = np.concatenate([batch, np.repeat(batch[-1:], missing, axis=0)])
+            outputs = np.concatenate([self.session.run(None, {self.input_name: batch[i:i + self.fixed_batch]})[0]
+                                      for i in range(0, len(batch), self.fixed_batch)])[:len(images)]
+        else:
+            outputs = self.session.run(None, {self.input_name: batch})[0]
+        inferred = time.perf_counter()
+
+        raws = []
+        for output, (ratio, (pad_x, pad_y), (h, w)) in zip(outputs, geometry):
+            boxes, scores, class_ids = decode_predictions(output, conf)
+            # Undo the letterbox and clip to the image, as ultralytics scale_boxes() does
+            boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - pad_x) / ratio, 0, w)
+            boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - pad_y) / ratio, 0, h)
+            raws.append({'boxes': boxes, 'scores': scores, 'class_ids': class_ids})
+
+        # Per image, like ultralytics result.speed, so both backends report the same stages
+        n = len(images)
+        for stage, seconds in (('preprocess', preprocessed - started), ('inference', inferred - preprocessed),
+                               ('postprocess', time.perf_counter() - inferred)):
+            for _ in range(n):
+                metrics.record(f'yolo_{stage}', seconds / n)
+        return raws
+
+
+BACKENDS = {
+    'ultralytics': UltralyticsBackend,
+    'onnx': OnnxBackend
+}
+
+
+def create_backend(weights_path, kind=None):
+    """Instantiate the backend for a weights file (.onnx files always use ONNX Runtime)"""
+    if kind is None:
+        kind = 'onnx' if weights_path.endswith('.onnx') else DEFAULT_BACKEND
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{kind}' (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[kind](weights_path)
@@ -0,0 +1,412 @@
+"""
+Asynchronous batch ingestion
+Bulk backfills run as resumable jobs: bounded decode pipeline -> batched inference -> NDJSON results
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import shutil
+import zipfile
+import threading
+from image_io import MAX_UPLOAD_BYTES, decode_image, check_upload_size, ImageRejected
+from perceptual_hash import phash, HammingIndex
+from duplicate_index import DUPLICATE_DISTANCE, hash_hex
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process job locking
+    fcntl = None
+
+
+JOBS_DIR = os.environ.get('AI_BATCH_JOBS_DIR', 'batch_jobs')
+# Directory manifests must point inside this root (a shared volume)
+SHARED_ROOT = os.environ.get('AI_BATCH_SHARED_ROOT')
+DECODE_WORKERS = int(os.environ.get('AI_BATCH_DECODE_WORKERS', 2))
+PIPELINE_DEPTH = int(os.environ.get('AI_BATCH_PIPELINE_DEPTH', 32))
+MAX_CONCURRENT_JOBS = int(os.environ.get('AI_BATCH_MAX_JOBS', 1))
+STATE_FLUSH_SECONDS = 1.0
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif')
+
+_DONE = object()
+
+
+def read_capped(f, limit=MAX_UPLOAD_BYTES):
+    """Read a file or archive member, refusing it once it passes the upload limit"""
+    data = f.read(limit + 1)
+    if len(data) > limit:
+        raise ImageRejected(f'Image exceeds {limit // (1024 * 1024)} MB')
+    return data
+
+
+def is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not os.path.basename(name).startswith('.')
+
+
+class BatchJobManager:
+    """Creates, runs, resumes and reports on batch jobs stored under JOBS_DIR"""
+
+    def __init__(self, registry, jobs_dir=JOBS_DIR, duplicates=None):
+        self.registry = registry
+        # Item photo hashes (DuplicateIndex); images matching one are not run through the model
+        self.duplicates = duplicates
+        self.jobs_dir = jobs_dir
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._slots = threading.BoundedSemaphore(MAX_CONCURRENT_JOBS)
+        self._running = set()
+        self._lock = threading.Lock()
+
+    # ---- job creation --------------------------------------------------------
+
+    def _job_dir(self, job_id):
+        # Job ids are generated hex strings; refuse anything that could escape the jobs dir
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.jobs_dir, job_id)
+
+    def create_from_uploads(self, files, options):
+        """Multipart list of images; each is streamed to disk before the job starts"""
+        job_id, job_dir = self._new_job_dir()
+        inputs = os.path.join(job_dir, 'inputs')
+        os.makedirs(inputs)
+        entries = []
+        for i, f in enumerate(files):
+            name = os.path.basename(f.filename or f'upload_{i}')
+            stored = f'{i:06d}_{name}'
+            f.save(os.path.join(inputs, stored))
+            entries.append({'name': name, 'source': 'file', 'path': os.path.join('inputs', stored)})
+        return self._finish_create(job_id, job_dir, entries, options)
+
+    def create_from_zip(self, archive, options):
+        """Zip upload; members are read lazily from the saved archive"""
+        job_id, job_dir = self._new_job_dir()
+        archive_path = os.path.join(job_dir, 'input.zip')
+        archive.save(archive_path)
+        with zipfile.ZipFile(archive_path) as zf:
+            entries = [{'name': info.filename, 'source': 'zip', 'path': info.filename}
+                       for info in zf.infolist() if not info.is_dir() and is_image_name(info.filename)]
+        return self._finish_create(job_id, job_dir, entries, options)
+
+    def create_from_directory(self, directory, options):
+        """Directory on a shared volume; must live under AI_BATCH_SHARED_ROOT"""
+        if not SHARED_ROOT:
+            raise ValueError('Directory manifests are disabled (AI_BATCH_SHARED_ROOT is not set)')
+        root = os.path.realpath(SHARED_ROOT)
+        directory = os.path.realpath(os.path.join(root, directory))
+        if os.path.commonpath([root, directory]) != root or not os.path.isdir(directory):
+            raise ValueError('Directory must be an existing folder under the shared root')
+
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if is_image_name(filename):
+                    path = os.path.join(dirpath, filename)
+                    entries.append({'name': os.path.relpath(path, directory), 'source': 'path', 'path': path})
+
+        job_id, job_dir = self._new_job_dir()
+        return self._finish_create(job_id, job_dir, entries, options)
+
+    def _new_job_dir(self):
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+        return job_id, job_dir
+
+    def _finish_create(self, job_id, job_dir, entries, options):
+        if not entries:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise ValueError('No images found in the manifest')
+        with open(os.path.join(job_dir, 'manifest.json'), 'w') as f:
+            json.dump({'entries': entries, 'options': options}, f)
+        state = {
+            'job_id': job_id,
+            'status': 'queued',
+            'total': len(entries),
+            'done': 0,
+            'failed': 0,
+            'duplicates': 0,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        }
+        self._write_state(job_dir, state)
+        self.start(job_id)
+        return state
+
+    # ---- state ----------------------------------------------------------------
+
+    @staticmethod
+    def _write_state(job_dir, state):
+        tmp = os.path.join(job_dir, 'state.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, os.path.join(job_dir, 'state.json'))
+
+    def _read_state(self, job_id):
+        with open(os.path.join(self._job_dir(job_id), 'state.json')) as f:
+            return json.load(f)
+
+    def status(self, job_id):
+        """Progress snapshot; read from disk so any worker process can answer"""
+        state = self._read_state(job_id)
+        elapsed = (state.get('finished_at') or time.time()) - (state.get('started_at') or time.time())
+        processed = state['done'] + state['failed']
+        state['progress'] = round(processed / state['total'], 4) if state['total'] else 1.0
+        state['images_per_second'] = round(processed / elapsed, 2) if elapsed > 0 else 0
+        return state
+
+    def results_path(self, job_id):
+        return os.path.join(self._job_dir(job_id), 'results.ndjson')
+
+    def list_jobs(self):
+        jobs = []
+        for job_id in sorted(os.listdir(self.jobs_dir)):
+            try:
+                jobs.append(self.status(job_id))
+            except (KeyError, OSError, ValueError):
+                continue
+        return jobs
+
+    # ---- execution ---------------------------------------------------------------
+
+    def start(self, job_id):
+        with self._lock:
+            if job_id in self._running:
+                return
+            self._running.add(job_id)
+        threading.Thread(target=self._run, args=(job_id,), name=f'batch-{job_id[:8]}', daemon=True).start()
+
+    def resume(self, job_id):
+        """Restart a failed or interrupted job from where its results file stops"""
+        state = self._read_state(job_id)
+        if state['status'] == 'completed':
+            return state
+        self.start(job_id)
+        return self.status(job_id)
+
+    def resume_incomplete(self):
+        """Restart jobs that were queued or running when the process died"""
+        for job_id in sorted(os.listdir(self.jobs_dir)):
+            try:
+                state = self.status(job_id)
+            except (KeyError, OSError, ValueError):
+                continue
+            if state['status'] in ('queued', 'running'):
+                print(f"Resuming batch job {job_id} ({state['done'] + state['failed']}/{state['total']})")
+                self.start(job_id)
+
+    def _acquire_job_lock(self, job_dir):
+        """Only one process may run a job; the flock dies with its holder"""
+        handle = open(os.path.join(job_dir, 'job.lock'), 'a')
+        if fcntl is None:
+            return handle
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return handle
+        except OSError:
+            handle.close()
+            return None
+
+    def _completed_indices(self, results_path):
+        """Indices already written, truncating a half-written trailing line"""
+        done = set()
+        if not os.path.exists(results_path):
+            return done
+        valid_bytes = 0
+        with open(results_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    done.add(json.loads(line)['index'])
+                except (ValueError, KeyError):
+                    break
+                valid_bytes += len(line)
+        with open(results_path, 'ab') as f:
+            f.truncate(valid_bytes)
+        return done
+
+    def _run(self, job_id):
+        job_dir = self._job_dir(job_id)
+        lock = None
+        try:
+            with self._slots:
+                lock = self._acquire_job_lock(job_dir)
+                if lock is None:
+                    return  # another worker owns this job
+                version, engine = self.registry.acquire(self._read_options(job_dir).get('model'))
+                try:
+                    self._process(job_id, job_dir, engine)
+                finally:
+                    self.registry.release(version)
+        except Exception as e:
+            print(f"Error in batch job {job_id}: {str(e)}")
+            try:
+                state = self._read_state(job_id)
+                state.update(status='failed', error=str(e), finished_at=time.time())
+                self._write_state(job_dir, state)
+            except Exception:
+                pass
+        finally:
+            if lock is not None:
+                lock.close()
+            with self._lock:
+                self._running.discard(job_id)
+
+    @staticmethod
+    def _read_options(job_dir):
+        with open(os.path.join(job_dir, 'manifest.json')) as f:
+            return json.load(f).get('options', {})
+
+    def _process(self, job_id, job_dir, engine):
+        with open(os.path.join(job_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        entries = manifest['entries']
+        options = manifest.get('options', {})
+
+        results_path = os.path.join(job_dir, 'results.ndjson')
+        completed = self._completed_indices(results_path)
+        state = self._read_state(job_id)
+        state.pop('error', None)
+
+        # Recount from the results file so a crash between writes never double counts;
+        # images analyzed before a restart are again duplicates' originals
+        state['done'] = state['failed'] = state['duplicates'] = 0
+        seen = HammingIndex()
+        if completed:
+            with open(results_path, 'rb') as f:
+                for line in f:
+                    record = json.loads(line)
+                    state['failed' if record.get('status') == 'error' else 'done'] += 1
+                    state['duplicates'] += record.get('status') == 'duplicate'
+                    if record.get('status') not in ('error', 'duplicate') and record.get('phash'):
+                        seen.add(record['index'], int(record['phash'], 16))
+        state['status'] = 'running'
+        state['started_at'] = state.get('started_at') or time.time()
+        self._write_state(job_dir, state)
+
+        pending = [i for i in range(len(entries)) if i not in completed]
+        decoded = queue.Queue(maxsize=PIPELINE_DEPTH)
+        todo = queue.Queue()
+        for i in pending:
+            todo.put(i)
+
+        archive = None
+        if any(e['source'] == 'zip' for e in entries):
+            archive = zipfile.ZipFile(os.path.join(job_dir, 'input.zip'))
+        archive_lock = threading.Lock()
+
+        def read_entry(entry):
+            if entry['source'] == 'zip':
+                with archive_lock:
+                    # Checked before inflating, and capped while reading (the header may lie)
+                    info = archive.getinfo(entry['path'])
+                    check_upload_size(info.file_size)
+                    with archive.open(info) as f:
+                        return read_capped(f)
+            path = entry['path'] if entry['source'] == 'path' else os.path.join(job_dir, entry['path'])
+            with open(path, 'rb') as f:
+                return read_capped(f)
+
+        def decoder():
+            while True:
+                try:
+                    i = todo.get_nowait()
+                except queue.Empty:
+                    decoded.put(_DONE)
+                    return
+                try:
+                    decoded.put((i, decode_image(read_entry(entries[i])), None))
+                except Exception as e:
+                    decoded.put((i, None, str(e)))
+
+        workers = [threading.Thread(target=decoder, daemon=True) for _ in range(max(1, DECODE_WORKERS))]
+        for w in workers:
+            w.start()
+
+        batch_size = engine.batcher.max_batch_size
+        finished_workers = 0
+        last_flush = time.time()
+        with open(results_path, 'ab') as out:
+            while finished_workers < len(workers):
+                batch = []
+                # Fill a batch from the bounded queue without waiting once it runs dry
+                while len(batch) < batch_size and finished_workers < len(workers):
+                    try:
+                        item = decoded.get(timeout=0.05 if batch else None)
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        finished_workers += 1
+                    else:
+                        batch.append(item)
+
+                records = self._infer(engine, entries, batch, options, seen)
+                for record in records:
+                    out.write((json.dumps(record) + '\n').encode())
+                    state['failed' if record['status'] == 'error' else 'done'] += 1
+                    state['duplicates'] += record['status'] == 'duplicate'
+                out.flush()
+
+                if time.time() - last_flush >= STATE_FLUSH_SECONDS:
+                    os.fsync(out.fileno())
+                    self._write_state(job_dir, state)
+                    last_flush = time.time()
+            os.fsync(out.fileno())
+
+        if archive is not None:
+            archive.close()
+        state['status'] = 'completed'
+        state['finished_at'] = time.time()
+        self._write_state(job_dir, state)
+        print(f"Batch job {job_id} completed: {state['done']} ok, {state['failed']} failed")
+
+    def _infer(self, engine, entries, batch, options, seen):
+        """
+        Run the decoded images of one batch through the engine together. With skip_duplicates,
+        an image whose pHash is near an indexed item or an image already analyzed in this job
+        (seen) is recorded as a duplicate instead.
+        """
+        records = []
+        ok = []
+        for i, decoded, error in batch:
+            if error is not None:
+                continue
+            photo_hash = phash(decoded[0])
+            if photo_hash is not None and options.get('skip_duplicates'):
+                duplicate_of = self._duplicate_of(photo_hash, seen, entries)
+                if duplicate_of is not None:
+                    records.append({'index': i, 'name': entries[i]['name'], 'status': 'duplicate',
+                                    'phash': hash_hex(photo_hash), 'duplicate_of': duplicate_of})
+                    continue
+                seen.add(i, photo_hash)
+            ok.append((i, decoded))
+
+        raws = engine.analyze_many([img for _, (img, _) in ok], scales=[scale for _, (_, scale) in ok]) if ok else []
+        for (i, _), raw in zip(ok, raws):
+            # The /analyze-hybrid body has its own 'status' (SUCCESS/LOW_CONFIDENCE), so it is nested
+            record = {'index': i, 'name': entries[i]['name'], 'status': 'ok', 'phash': hash_hex(raw['phash']),
+                      'result': engine.hybrid_view(raw)}
+            if options.get('include_embedding'):
+                record['embedding'] = raw['embedding'].tolist()
+            records.append(record)
+        for i, _, error in batch:
+            if error is not None:
+                records.append({'index': i, 'name': entries[i]['name'], 'status': 'error', 'error': error})
+        return records
+
+    def _duplicate_of(self, photo_hash, seen, entries):
+        """{'item_id'} of a near-identical indexed item, else {'index', 'name'} of an earlier image in the job"""
+        if self.duplicates is not None:
+            found = self.duplicates.search(photo_hash)
+            if found:
+                return {'item_id': found[0]['item_id'], 'distance': found[0]['distance']}
+        found = seen.search(photo_hash, DUPLICATE_DISTANCE)
+        if found:
+            index, distance = found[0]
+            return {'index': index, 'name': entries[index]['name'], 'distance': distance}
+        return None
@@ -0,0 +1,175 @@
+"""
+Micro-batching inference queue
+Collects concurrent single-image requests and runs them as one batched model call
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+import metrics
+
+
+# Defaults can be overridden per deployment to tune throughput vs latency
+DEFAULT_MAX_BATCH_SIZE = int(os.environ.get('AI_BATCH_MAX_SIZE', 8))
+DEFAULT_MAX_WAIT_MS = float(os.environ.get('AI_BATCH_MAX_WAIT_MS', 10))
+
+# Number of recent samples kept for queue-wait percentiles
+WAIT_SAMPLE_WINDOW = 1024
+
+# Smoothing of the running batch-latency estimate used for admission decisions
+BATCH_MS_SMOOTHING = 0.2
+
+
+class MicroBatcher:
+    """Hold requests for up to max_wait_ms (or until max_batch_size) and run them together"""
+
+    def __init__(self, run_batch, max_batch_size=None, max_wait_ms=None, name='inference'):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size or DEFAULT_MAX_BATCH_SIZE)
+        self.max_wait = max(0.0, (DEFAULT_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0)
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._worker_pid = None
+        self._closing = False
+
+        # Metrics
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._errors = 0
+        self._batch_sizes = {}
+        self._waits_ms = deque(maxlen=WAIT_SAMPLE_WINDOW)
+        self._last_batch = None
+        self.batch_ms_ewma = None
+
+    def submit(self, item, timeout=None):
+        """Queue a single item and block until its batched result is ready"""
+        return self.submit_async(item).result(timeout=timeout)
+
+    def submit_async(self, item):
+        """Queue a single item and return a Future for its result"""
+        future = Future()
+        with self._cond:
+            self._ensure_worker()
+            self._queue.append((item, future, time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def estimate_wait_ms(self, default_batch_ms):
+        """Expected time until a request submitted now has its result"""
+        batch_ms = self.batch_ms_ewma if self.batch_ms_ewma is not None else default_batch_ms
+        batches_ahead = self.queue_depth() // self.max_batch_size + 1
+        return batches_ahead * batch_ms + self.max_wait * 1000.0
+
+    def queue_depth(self):
+        """Number of requests currently waiting for a batch slot"""
+        with self._cond:
+            return len(self._queue)
+
+    def close(self):
+        """Let the worker exit once the queue drains (a later submit starts a new one)"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a pre-forked worker starts its own
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        self._worker_pid = os.getpid()
+        self._closing = False
+        self._worker = threading.Thread(target=self._loop, name=f'{self.name}-batcher', daemon=True)
+        self._worker.start()
+
+    def _next_batch(self):
+        """Block until a batch is ready according to the size/deadline policy (None once closed)"""
+        with self._cond:
+            while not self._queue:
+                if self._closing:
+                    return None
+                self._cond.wait()
+
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            size = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(size)]
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            items = [entry[0] for entry in batch]
+
+            try:
+                results = self.run_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f'Batch returned {len(results)} results for {len(items)} inputs')
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+                failed = False
+            except Exception as e:
+                print(f"Error in {self.name} batch: {str(e)}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                failed = True
+
+            self._record(batch, started, time.perf_counter(), failed)
+
+    def _record(self, batch, started, finished, failed):
+        size = len(batch)
+        waits = [(started - enqueued) * 1000.0 for _, _, enqueued in batch]
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += size
+            if failed:
+                self._errors += 1
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            batch_ms = (finished - started) * 1000.0
+            if not failed:
+                self.batch_ms_ewma = batch_ms if self.batch_ms_ewma is None else \
+                    self.batch_ms_ewma + BATCH_MS_SMOOTHING * (batch_ms - self.batch_ms_ewma)
+            self._waits_ms.extend(waits)
+            self._last_batch = {
+                'size': size,
+                'max_queue_wait_ms': round(max(waits), 2),
+                'inference_ms': round(batch_ms, 2)
+            }
+        metrics.BATCH_SIZE.observe(size, batcher=self.name)
+        for wait in waits:
+            metrics.record('batch_queue', wait / 1000.0)
+
+    def stats(self):
+        """Per-batch size and queue-wait metrics"""
+        with self._stats_lock:
+            waits = np.sort(np.fromiter(self._waits_ms, dtype=np.float64)) if self._waits_ms else None
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': round(self.max_wait * 1000.0, 2),
+                'batches': self._batches,
+                'requests': self._requests,
+                'errors': self._errors,
+                'avg_batch_size': round(self._requests / self._batches, 2) if self._batches else 0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                'queue_wait_ms': {
+                    'avg': round(float(waits.mean()), 2),
+                    'p50': round(float(np.percentile(waits, 50)), 2),
+                    'p95': round(float(np.percentile(waits, 95)), 2),
+                    'max': round(float(waits[-1]), 2)
+                } if waits is not None else None,
+                'queue_depth': self.queue_depth(),
+                'batch_ms_ewma': round(self.batch_ms_ewma, 2) if self.batch_ms_ewma is not None else None,
+                'last_batch': self._last_batch
+            }
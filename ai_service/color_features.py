@@ -0,0 +1,130 @@
+"""
+Colour and tone features
+Every decision comes from one normalized HSV histogram of a downsampled view,
+so the cost and the thresholds are independent of the upload resolution.
+"""
+
+import numpy as np
+import cv2
+
+
+# Longest side of the strided view the histogram is computed on
+ANALYSIS_MAX_SIDE = 256
+
+# OpenCV hue runs 0-179; 6-unit hue bins line up with the palette boundaries below
+H_BINS, S_BINS, V_BINS = 30, 8, 16
+
+# A palette colour is reported once it covers this fraction of the image
+MIN_COLOR_FRACTION = 0.05
+
+PALETTE = ['black', 'white', 'gray', 'red', 'orange', 'yellow', 'green',
+           'cyan', 'blue', 'purple', 'pink', 'brown']
+
+# Upper hue bound (exclusive, OpenCV units) for each chromatic name; red wraps around
+HUE_RANGES = [(12, 'red'), (24, 'orange'), (36, 'yellow'), (84, 'green'), (96, 'cyan'),
+              (132, 'blue'), (150, 'purple'), (168, 'pink'), (180, 'red')]
+
+# Saturation / value cut-offs separating achromatic tones from colours
+CHROMA_MIN_S = 64
+CHROMA_MIN_V = 64
+WHITE_MIN_V = 192
+BROWN_MAX_V = 160
+
+
+def _bin_centers(bins, upper):
+    return (np.arange(bins) + 0.5) * upper / bins
+
+
+H_CENTERS = _bin_centers(H_BINS, 180)
+S_CENTERS = _bin_centers(S_BINS, 256)
+V_CENTERS = _bin_centers(V_BINS, 256)
+
+
+def _name_for(h, s, v):
+    if v < CHROMA_MIN_V:
+        return 'black'
+    if s < CHROMA_MIN_S:
+        return 'white' if v >= WHITE_MIN_V else 'gray'
+    if 6 <= h < 30 and v < BROWN_MAX_V:
+        return 'brown'
+    return next(name for upper, name in HUE_RANGES if h < upper)
+
+
+def _build_palette_lut():
+    """Palette index for every (h, s, v) histogram bin, computed once at import"""
+    lut = np.empty((H_BINS, S_BINS, V_BINS), dtype=np.intp)
+    for i, h in enumerate(H_CENTERS):
+        for j, s in enumerate(S_CENTERS):
+            for k, v in enumerate(V_CENTERS):
+                lut[i, j, k] = PALETTE.index(_name_for(h, s, v))
+    return lut
+
+
+PALETTE_LUT = _build_palette_lut()
+
+
+def downsampled_view(img, max_side=ANALYSIS_MAX_SIDE):
+    """Strided view with its longest side at most max_side (no resampling pass)"""
+    step = max(1, -(-max(img.shape[:2]) // max_side))
+    return img[::step, ::step]
+
+
+def hsv_histogram(img):
+    """Joint H/S/V histogram of an RGB image, normalized to sum to 1"""
+    small = np.ascontiguousarray(downsampled_view(img))
+    hsv = cv2.cvtColor(small, cv2.COLOR_RGB2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, [H_BINS, S_BINS, V_BINS], [0, 180, 0, 256, 0, 256])
+    return hist / max(float(hist.sum()), 1.0)
+
+
+def summarize(hist):
+    """Tone statistics and palette fractions derived from a normalized histogram"""
+    v_marginal = hist.sum(axis=(0, 1))
+    s_marginal = hist.sum(axis=(0, 2))
+    mean_v = float(v_marginal @ V_CENTERS)
+    std_v = float(np.sqrt(max(v_marginal @ (V_CENTERS - mean_v) ** 2, 0.0)))
+    palette = np.bincount(PALETTE_LUT.ravel(), weights=hist.ravel(), minlength=len(PALETTE))
+    return {
+        'brightness': mean_v,
+        'contrast': std_v,
+        'saturation': float(s_marginal @ S_CENTERS),
+        'palette': dict(zip(PALETTE, palette.tolist()))
+    }
+
+
+def analyze_features(img):
+    """Analyze image for additional features"""
+    summary = summarize(hsv_histogram(img))
+    palette = summary['palette']
+    features = []
+
+    # Check brightness
+    if summary['brightness'] > 150:
+        features.append('bright')
+    elif summary['brightness'] < 100:
+        features.append('dark')
+
+    # Check color saturation
+    if summary['saturation'] < 50:
+        features.append('neutral')
+    elif summary['saturation'] > 150:
+        features.append('vibrant')
+
+    # Primary colours keep their historical order ahead of the wider palette
+    for name in ['red', 'blue', 'green']:
+        if palette[name] >= MIN_COLOR_FRACTION:
+            features.append(name)
+
+    # Overall tone
+    if summary['contrast'] < 30:
+        features.append('neutral_color')
+    elif summary['brightness'] > 200:
+        features.append('light_color')
+    elif summary['brightness'] < 50:
+        features.append('dark_color')
+
+    for name in PALETTE:
+        if name not in ('red', 'blue', 'green') and palette[name] >= MIN_COLOR_FRACTION:
+            features.append(name)
+
+    return features
@@ -0,0 +1,117 @@
+"""
+Near-duplicate item photos
+pHash of every indexed item in a multi-index Hamming structure, shared by workers through an op log
+"""
+
+import os
+import threading
+from perceptual_hash import HammingIndex
+from op_log import OpLog
+
+
+# Hashes at most this many of 64 bits apart are the same photo (re-encoded, resized, lightly edited)
+DUPLICATE_DISTANCE = int(os.environ.get('AI_DUPLICATE_DISTANCE', 6))
+
+# Largest max_distance a request may ask for: the probe masks grow combinatorially with it
+DUPLICATE_MAX_DISTANCE = int(os.environ.get('AI_DUPLICATE_MAX_DISTANCE', HammingIndex.CHUNK_BITS))
+
+# Rewrite the shared log once dead lines outnumber live hashes (and at least this many)
+COMPACT_MIN_DEAD = 1000
+
+
+def hash_hex(value):
+    return f'{value:016x}' if value is not None else None
+
+
+class DuplicateIndex:
+    """item_id -> 64-bit pHash, searchable by Hamming distance"""
+
+    def __init__(self, log_path=None, max_distance=DUPLICATE_DISTANCE):
+        self.log = OpLog(log_path) if log_path else None
+        self.max_distance = max_distance
+        self._lock = threading.RLock()
+        self._reset()
+        self.sync()
+
+    def _reset(self):
+        self._index = HammingIndex()
+        self._hashes = {}
+        self._lines = 0
+
+    def __len__(self):
+        return len(self._index)
+
+    def sync(self):
+        """Pick up hashes added or removed by other processes sharing the log"""
+        if self.log is None:
+            return
+        with self._lock:
+            self._apply(*self.log.read())
+
+    def _commit(self, op):
+        if self.log is None:
+            self._apply([op], False)
+        else:
+            self._apply(*self.log.append(op))
+
+    def _apply(self, ops, reset):
+        if reset:
+            self._reset()
+        for op in ops:
+            self._lines += 1
+            if op['op'] == 'add':
+                value = int(op['hash'], 16)
+                self._index.add(op['id'], value)
+                self._hashes[op['id']] = value
+            else:
+                self._index.remove(op['id'])
+                self._hashes.pop(op['id'], None)
+
+    def add(self, item_id, value):
+        with self._lock:
+            self._commit({'op': 'add', 'id': str(item_id), 'hash': hash_hex(value)})
+            # Re-adding an item (a re-hashed or edited photo) supersedes its earlier log line
+            if self._should_compact():
+                self.compact()
+
+    def remove(self, item_id):
+        """False if item_id had no hash"""
+        with self._lock:
+            self.sync()
+            if str(item_id) not in self._hashes:
+                return False
+            self._commit({'op': 'remove', 'id': str(item_id)})
+            if self._should_compact():
+                self.compact()
+            return True
+
+    def _should_compact(self):
+        """Superseded log lines are at least COMPACT_MIN_DEAD and at least as many as live hashes"""
+        return self._lines - len(self._hashes) >= max(COMPACT_MIN_DEAD, len(self._hashes))
+
+    def compact(self):
+        """Rewrite the shared log (and the in-memory tables) with only the live hashes"""
+        with self._lock:
+            if self.log is not None:
+                # Read and rewrite under the log's lock, so adds and removes by other workers survive
+                self.log.compact(self._apply, lambda: [{'op': 'add', 'id': item_id, 'hash': hash_hex(value)}
+                                                       for item_id, value in self._hashes.items()])
+            hashes = dict(self._hashes)
+            self._reset()
+            for item_id, value in hashes.items():
+                self._index.add(item_id, value)
+                self._hashes[item_id] = value
+            self._lines = len(hashes)
+
+    def search(self, value, max_distance=None, exclude=None):
+        """[{'item_id', 'distance'}] within max_distance bits, nearest first"""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        with self._lock:
+            self.sync()
+            return [{'item_id': item_id, 'distance': distance}
+                    for item_id, distance in self._index.search(value, max_distance) if item_id != exclude]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._index.stats(), max_distance=self.max_distance,
+                        log=self.log.path if self.log is not None else None)
@@ -0,0 +1,278 @@
+"""
+Embedding row stores
+Append-only float32 rows plus an operation log of ids, metadata and tombstones.
+EmbeddingStore persists them as a memory-mapped file with a JSONL sidecar;
+MemoryStore keeps the same interface entirely in RAM.
+"""
+
+import os
+import json
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+
+MANIFEST = 'store.json'
+
+
+def latest_rows(live):
+    """Live rows in order, keeping only the newest row per item id"""
+    newest = {}
+    for row in sorted(live):
+        newest[live[row]['id']] = row
+    return sorted(newest.values())
+
+
+class MemoryStore:
+    """In-process rows, lost on restart"""
+
+    def __init__(self):
+        self.dim = None
+        self.generation = 0
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._count = 0
+        self._live = {}
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """Operations written by other processes since the last call (never any in RAM)"""
+        return [], False
+
+    def matrix(self):
+        return self._matrix[:self._count]
+
+    def append(self, vector, item_id, category=None, item_type=None):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        with self._lock:
+            if self.dim is None:
+                self.dim = vector.shape[0]
+                self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+            if vector.shape[0] != self.dim:
+                raise ValueError(f'Expected a {self.dim}-d vector, got {vector.shape[0]}-d')
+
+            if self._count == len(self._matrix):
+                grown = np.zeros((max(64, 2 * self._count), self.dim), dtype=np.float32)
+                grown[:self._count] = self._matrix[:self._count]
+                self._matrix = grown
+            row = self._count
+            self._matrix[row] = vector
+            self._count += 1
+
+            op = {'op': 'add', 'row': row, 'id': item_id, 'category': category, 'type': item_type}
+            self._live[row] = op
+            return [op], False
+
+    def tombstone(self, row):
+        with self._lock:
+            self._live.pop(row, None)
+            return [{'op': 'del', 'row': row}], False
+
+    def compact(self):
+        """Drop tombstoned rows; returns the renumbered add operations"""
+        with self._lock:
+            rows = latest_rows(self._live)
+            self._matrix = self._matrix[rows].copy() if rows else np.zeros((0, self.dim or 0), dtype=np.float32)
+            self._count = len(rows)
+            ops = [dict(self._live[row], row=new_row) for new_row, row in enumerate(rows)]
+            self._live = {op['row']: op for op in ops}
+            self.generation += 1
+            return ops, True
+
+    def stats(self):
+        return {
+            'persistent': False,
+            'rows': self._count,
+            'live': len(self._live),
+            'generation': self.generation
+        }
+
+
+class EmbeddingStore:
+    """
+    On-disk layout (one generation is live at a time):
+        store.json              {"dim": d, "generation": g}
+        vectors.<g>.f32         raw float32 rows, append-only, opened with mmap
+        meta.<g>.jsonl          {"op": "add", "row", "id", "category", "type"} / {"op": "del", "row"}
+    Vectors are written before their metadata line, so a crash can only leave
+    unreferenced trailing bytes, which are trimmed by the next append.
+    Writers hold an flock so preforked workers can share one directory; each
+    process tails the log to pick up rows the others appended.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.dim = None
+        self.generation = 0
+        self._count = 0
+        self._meta_offset = 0
+        self._live = {}
+        self._synced = False
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _vectors_path(self, generation=None):
+        return self._path(f'vectors.{self.generation if generation is None else generation}.f32')
+
+    def _meta_path(self, generation=None):
+        return self._path(f'meta.{self.generation if generation is None else generation}.jsonl')
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST)) as f:
+                manifest = json.load(f)
+            return manifest['dim'], manifest['generation']
+        except FileNotFoundError:
+            return self.dim, self.generation
+
+    def _write_manifest(self, generation):
+        tmp = self._path(MANIFEST + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'dim': self.dim, 'generation': generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(MANIFEST))
+
+    def _writer_lock(self):
+        handle = open(self._path('.lock'), 'a')
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def matrix(self):
+        """Zero-copy read-only view over every row written so far"""
+        if self.dim is None or self._count == 0:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self._vectors_path(), dtype=np.float32, mode='r', shape=(self._count, self.dim))
+
+    def sync(self):
+        """Return (ops, reset): log entries since the last call; reset means start over"""
+        with self._lock:
+            return self._catch_up()
+
+    def _catch_up(self):
+        dim, generation = self._read_manifest()
+        reset = generation != self.generation or not self._synced
+        self._synced = True
+        self.dim = dim
+        if reset:
+            self.generation = generation
+            self._meta_offset = 0
+            self._count = 0
+            self._live = {}
+
+        ops = []
+        try:
+            with open(self._meta_path(), 'rb') as f:
+                f.seek(self._meta_offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # partially written line
+                    self._meta_offset += len(line)
+                    op = json.loads(line)
+                    self._apply(op)
+                    ops.append(op)
+        except FileNotFoundError:
+            pass
+        return ops, reset
+
+    def _apply(self, op):
+        if op['op'] == 'add':
+            self._live[op['row']] = op
+            self._count = max(self._count, op['row'] + 1)
+        else:
+            self._live.pop(op['row'], None)
+
+    def _log(self, op):
+        with open(self._meta_path(), 'ab') as f:
+            f.write((json.dumps(op) + '\n').encode())
+            f.flush()
+            os.fsync(f.fileno())
+            self._meta_offset = f.tell()
+        self._apply(op)
+
+    def append(self, vector, item_id, category=None, item_type=None):
+        """Append one row; returns (ops, reset) including any rows other processes added"""
+        vector = np.ascontiguousarray(vector, dtype=np.float32).ravel()
+        with self._lock, self._writer_lock():
+            ops, reset = self._catch_up()
+            if self.dim is None:
+                self.dim = vector.shape[0]
+                self._write_manifest(self.generation)
+            if vector.shape[0] != self.dim:
+                raise ValueError(f'Expected a {self.dim}-d vector, got {vector.shape[0]}-d')
+
+            row = self._count
+            with open(self._vectors_path(), 'ab') as f:
+                f.truncate(row * self.dim * 4)
+                f.write(vector.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            op = {'op': 'add', 'row': row, 'id': item_id, 'category': category, 'type': item_type}
+            self._log(op)
+            ops.append(op)
+            return ops, reset
+
+    def tombstone(self, row):
+        """Mark a row deleted; returns (ops, reset) like append()"""
+        with self._lock, self._writer_lock():
+            ops, reset = self._catch_up()
+            if row in self._live:
+                op = {'op': 'del', 'row': row}
+                self._log(op)
+                ops.append(op)
+            return ops, reset
+
+    def compact(self):
+        """Rewrite live rows into a new generation and switch to it atomically"""
+        with self._lock, self._writer_lock():
+            self._catch_up()
+            old_generation = self.generation
+            new_generation = old_generation + 1
+            source = self.matrix()
+            rows = latest_rows(self._live)
+            ops = []
+
+            with open(self._vectors_path(new_generation), 'wb') as vf, \
+                 open(self._meta_path(new_generation), 'wb') as mf:
+                for new_row, row in enumerate(rows):
+                    vf.write(np.ascontiguousarray(source[row]).tobytes())
+                    op = dict(self._live[row], row=new_row)
+                    mf.write((json.dumps(op) + '\n').encode())
+                    ops.append(op)
+                vf.flush()
+                os.fsync(vf.fileno())
+                mf.flush()
+                os.fsync(mf.fileno())
+                meta_size = mf.tell()
+            del source
+
+            # The manifest switch is the commit point; old files are only garbage afterwards
+            self._write_manifest(new_generation)
+            self.generation = new_generation
+            self._count = len(ops)
+            self._meta_offset = meta_size
+            self._live = {op['row']: op for op in ops}
+
+            for path in (self._vectors_path(old_generation), self._meta_path(old_generation)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            return ops, True
+
+    def stats(self):
+        return {
+            'persistent': True,
+            'directory': self.directory,
+            'rows': self._count,
+            'live': len(self._live),
+            'generation': self.generation
+        }
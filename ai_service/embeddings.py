@@ -0,0 +1,58 @@
+"""
+Image embeddings for similarity search
+Pooled YOLO backbone features, with a deterministic colour/layout fallback
+"""
+
+import numpy as np
+import cv2
+
+
+# Index of the SPPF block (end of the backbone) in YOLOv8 detection models
+BACKBONE_LAYER = 9
+
+FALLBACK_EMBEDDING_NAME = 'color-layout-128'
+
+
+def l2_normalize(vectors):
+    """L2-normalize a vector or each row of a matrix"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def fallback_embedding(img):
+    """128-d descriptor: 8x4x2 HSV histogram plus an 8x8 luminance layout"""
+    small = cv2.resize(img, (64, 64), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_RGB2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, [8, 4, 2], [0, 180, 0, 256, 0, 256]).ravel()
+
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+    layout = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    layout -= layout.mean()
+
+    return l2_normalize(np.concatenate([l2_normalize(hist), l2_normalize(layout)]))
+
+
+class BackboneTap:
+    """Forward hook that global-average-pools a backbone layer during detection"""
+
+    def __init__(self, yolo, layer_index=BACKBONE_LAYER):
+        self.layer_index = layer_index
+        self.pooled = None
+        layer = yolo.model.model[layer_index]
+        self.handle = layer.register_forward_hook(self._hook)
+        self.name = f'yolo-{type(layer).__name__.lower()}-gap'
+
+    def _hook(self, module, inputs, output):
+        # (B, C, H, W) -> (B, C); the last forward of a batch wins, so warm-up passes are harmless
+        self.pooled = output.detach().float().mean(dim=(2, 3)).cpu().numpy()
+
+    def take(self, batch_size):
+        """Return normalized embeddings for the batch that just ran"""
+        pooled, self.pooled = self.pooled, None
+        if pooled is None or len(pooled) != batch_size:
+            return [None] * batch_size
+        return list(l2_normalize(pooled))
+
+    def remove(self):
+        self.handle.remove()
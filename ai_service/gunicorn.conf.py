@@ -0,0 +1,74 @@
+"""
+Gunicorn configuration for the AI service
+    gunicorn -c gunicorn.conf.py main:app
+The master imports main (and loads YOLO) once; workers are forked from it and share
+the weights copy-on-write. Each worker serves requests on a thread pool so the
+micro-batcher can group concurrent requests into one forward pass.
+"""
+
+import gc
+import os
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+workers = int(os.environ.get('AI_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('AI_WORKER_THREADS', 4))
+
+# Load the app (and the model) in the master before forking
+preload_app = os.environ.get('AI_PRELOAD', '1') == '1'
+
+# A loader thread started in the master would not survive fork(), so preloading loads eagerly;
+# without preloading each worker loads in the background (AI_LAZY_LOAD) and reports LOADING meanwhile
+if preload_app:
+    os.environ['AI_LAZY_LOAD'] = '0'
+
+# Inference on a cold worker can be slow; SIGTERM drains in-flight requests for graceful_timeout
+timeout = int(os.environ.get('AI_WORKER_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('AI_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def intra_op_threads():
+    """Math-library threads per worker, so workers x threads does not exceed the cores"""
+    configured = os.environ.get('AI_INTRA_OP_THREADS')
+    if configured:
+        return max(1, int(configured))
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+# OpenMP/MKL/OpenBLAS read these once, when torch (or numpy) is first imported. With preload_app
+# that import happens while gunicorn loads the app, before any server hook runs, so they are set
+# here: gunicorn executes this file before it loads the app.
+for _var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+    os.environ.setdefault(_var, str(intra_op_threads()))
+
+
+def pre_fork(server, worker):
+    # Keep the garbage collector from touching (and so copying) the preloaded objects
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    n = intra_op_threads()
+    try:
+        import cv2
+        cv2.setNumThreads(n)
+    except ImportError:
+        pass
+    try:
+        import torch
+        torch.set_num_threads(n)
+    except ImportError:
+        pass
+    server.log.info(f"Worker {worker.pid}: {n} intra-op threads, {threads} request threads")
+
+
+def post_worker_init(worker):
+    # Background threads started in the master would not survive fork(); start them per worker
+    import main
+    main.start_background_work()
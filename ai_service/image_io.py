@@ -0,0 +1,117 @@
+"""
+Image ingestion
+Decode uploads at roughly the model's input resolution, straight from the request stream
+"""
+
+import io
+import os
+import numpy as np
+from PIL import Image, ImageOps
+
+
+# Decoded images keep at least this many pixels on their longest side
+DECODE_TARGET_SIDE = int(os.environ.get('AI_DECODE_TARGET_SIDE', 640))
+
+MAX_UPLOAD_BYTES = int(os.environ.get('AI_MAX_UPLOAD_MB', 25)) * 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.environ.get('AI_MAX_IMAGE_MEGAPIXELS', 64)) * 1000 * 1000
+
+# PIL's own bomb check is the last line of defence behind the header check below
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class ImageRejected(ValueError):
+    """Upload refused before decoding (too large, too many pixels, not an image)"""
+
+    def __init__(self, message, status_code=413):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def as_stream(source):
+    """Binary stream over bytes-like data (BytesIO shares a bytes object without copying)"""
+    if hasattr(source, 'read'):
+        return source
+    return io.BytesIO(source if isinstance(source, bytes) else bytes(source))
+
+
+def stream_size(stream):
+    """Bytes remaining in a seekable stream, without reading it"""
+    position = stream.tell()
+    size = stream.seek(0, io.SEEK_END) - position
+    stream.seek(position)
+    return size
+
+
+def check_upload_size(content_length):
+    """Refuse an oversized request from its Content-Length, before the body is read"""
+    if content_length and content_length > MAX_UPLOAD_BYTES:
+        raise ImageRejected(f'Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB')
+
+
+def decode_image(source, target_side=DECODE_TARGET_SIDE):
+    """
+    Decode an upload to an RGB array whose longest side is about target_side.
+    Returns (array, scale) where scale maps array pixels back to original pixels.
+    JPEGs are decoded with draft mode (DCT scaling), so a 12-MP photo never
+    materializes at full size; other formats are box-reduced after decoding.
+    """
+    stream = as_stream(source)
+    check_upload_size(stream_size(stream))
+
+    try:
+        img = Image.open(stream)
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(str(e))
+    except Exception as e:
+        raise ImageRejected(f'Not a readable image: {e}', status_code=400)
+
+    # Only the header has been parsed so far; refuse bombs before allocating pixels
+    width, height = img.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageRejected(f'Image has {width * height} pixels (limit {MAX_IMAGE_PIXELS})')
+
+    longest = max(width, height)
+    # Pixel data is only read from here on: a truncated or corrupt file fails in these steps
+    try:
+        if target_side and longest > target_side and img.format == 'JPEG':
+            ratio = target_side / longest
+            img.draft('RGB', (max(1, int(width * ratio)), max(1, int(height * ratio))))
+        img.load()
+
+        img = ImageOps.exif_transpose(img)
+
+        factor = max(img.size) // target_side if target_side else 1
+        if factor >= 2:
+            img = img.reduce(factor)
+
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(str(e))
+    except (OSError, ValueError, SyntaxError) as e:
+        raise ImageRejected(f'Not a readable image: {e}', status_code=400)
+
+    # exif_transpose may swap axes, so compare longest sides
+    return np.asarray(img), longest / max(img.size)
+
+
+def crop_array(img, box):
+    """View of img inside box (x1, y1, x2, y2 in array pixels, clipped to the image); None if empty"""
+    h, w = img.shape[:2]
+    x1, y1 = max(0, int(box[0])), max(0, int(box[1]))
+    x2, y2 = min(w, int(np.ceil(box[2]))), min(h, int(np.ceil(box[3])))
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return img[y1:y2, x1:x2]
+
+
+def crop_jpeg(img, box, max_side, quality=85):
+    """JPEG bytes of img[box], shrunk to at most max_side; None if the box is empty"""
+    crop = crop_array(img, box)
+    if crop is None:
+        return None
+    crop = Image.fromarray(crop)
+    crop.thumbnail((max_side, max_side))
+    out = io.BytesIO()
+    crop.save(out, format='JPEG', quality=quality)
+    return out.getvalue()
@@ -0,0 +1,99 @@
+"""
+Latency-budget admission
+Picks the most accurate inference tier whose predicted latency fits the request's budget,
+and sheds load when even the cheapest tier cannot keep up
+"""
+
+import os
+from collections import namedtuple
+
+
+# Budget applied when a request does not carry one; a deep queue pushes requests down the tiers
+DEFAULT_BUDGET_MS = float(os.environ.get('AI_LATENCY_BUDGET_MS', 3000))
+# Variant used by the cheaper tiers (see model_registry variants)
+FAST_VARIANT = os.environ.get('AI_FAST_VARIANT', 'n')
+PREVIEW_IMGSZ = int(os.environ.get('AI_PREVIEW_IMGSZ', 320))
+# Beyond this many queued requests every new request is shed, whatever its budget
+MAX_QUEUE_DEPTH = int(os.environ.get('AI_MAX_QUEUE_DEPTH', 64))
+
+# variant None means the requested (or active) model; imgsz None its default input size
+Tier = namedtuple('Tier', ['name', 'variant', 'imgsz', 'features', 'default_batch_ms'])
+
+TIERS = [
+    Tier('full', None, None, True, 400.0),
+    Tier('fast', FAST_VARIANT, None, True, 120.0),
+    Tier('preview', FAST_VARIANT, PREVIEW_IMGSZ, False, 50.0)
+]
+
+# Colour features are computed outside the batch, on the request thread
+FEATURES_MS = 5.0
+
+Plan = namedtuple('Plan', ['tier', 'version', 'engine', 'imgsz', 'features', 'predicted_ms', 'budget_ms'])
+
+
+class Overloaded(Exception):
+    """No tier can meet the budget while requests are queueing"""
+
+    def __init__(self, budget_ms, predicted_ms):
+        super().__init__(f'Service overloaded: {predicted_ms:.0f} ms predicted for a {budget_ms:.0f} ms budget')
+        self.budget_ms = budget_ms
+        self.predicted_ms = predicted_ms
+
+
+def parse_budget(value):
+    """Budget in ms from a header/form value; None when absent or invalid"""
+    try:
+        budget = float(value)
+    except (TypeError, ValueError):
+        return None
+    return budget if budget > 0 else None
+
+
+def predict_ms(engine, tier):
+    batcher = engine.batcher_for(tier.imgsz)
+    return batcher.estimate_wait_ms(tier.default_batch_ms) + (FEATURES_MS if tier.features else 0.0)
+
+
+def plan(registry, model=None, budget_ms=None):
+    """
+    Choose the tier for one request. An explicit model pins the variant, so only
+    resolution/feature downgrades apply. Raises Overloaded to shed the request.
+    """
+    budget = budget_ms or DEFAULT_BUDGET_MS
+    pinned = registry.resolve(model) if model else None
+    fallback = None
+    queued = 0
+
+    for tier in TIERS:
+        if tier.variant is not None and pinned is not None and tier.imgsz is None:
+            continue  # same as 'full' once the model is pinned
+        if tier.variant is not None and pinned is None:
+            try:
+                version = registry.resolve(tier.variant)
+            except KeyError:
+                continue
+        else:
+            version = pinned or registry.resolve()
+
+        engine = registry.get(version)
+        if engine.state == 'loading' and tier is TIERS[0]:
+            return None  # cold start: do not pull in the cheaper models as well
+        if engine.state != 'ready' and tier is not TIERS[0]:
+            # Still loading (get() has started it for next time) or failed: a failed cheaper
+            # model would answer with mock detections, so only the full tier may be degraded
+            continue
+        queued = max(queued, engine.batcher_for(tier.imgsz).queue_depth())
+        predicted = predict_ms(engine, tier)
+        candidate = Plan(tier.name, version, engine, tier.imgsz, tier.features, predicted, budget)
+        if queued >= MAX_QUEUE_DEPTH:
+            raise Overloaded(budget, predicted)
+        if predicted <= budget:
+            return candidate
+        fallback = candidate
+
+    if fallback is None:
+        return None  # nothing loaded yet; the caller reports LOADING
+    if queued > 0:
+        raise Overloaded(budget, fallback.predicted_ms)
+    # An idle service serves an unattainable budget with its cheapest tier rather than refusing
+    return fallback
@@ -3,207 +3,221 @@ Lost & Found AI Service
 Object Detection and Image Classification using YOLO
 """
 
+import time
+STARTED_AT = time.time()
+
 import os
-import io
-import base64
+import json
+import zipfile
+import threading
 import numpy as np
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
-from PIL import Image
-import cv2
 import warnings
+from model_registry import ModelRegistry
+from latency_budget import plan, parse_budget, Overloaded
+from tiling import TILING_MODE, TILING_MODES
+from vector_index import VectorIndex
+from embedding_store import EmbeddingStore
+from batch_jobs import BatchJobManager
+from match_engine import MatchEngine
+from duplicate_index import DuplicateIndex, DUPLICATE_MAX_DISTANCE, hash_hex
+from perceptual_hash import phash
+from image_io import ImageRejected, check_upload_size, decode_image
+from ai_engine import ANALYZE_OUTPUTS, DEFAULT_OUTPUTS, HYBRID_CONFIDENCE
+from video_inventory import (FRAME_STREAM_MIMETYPE, MAX_VIDEO_BYTES, SAMPLE_FPS, inventory, spool_upload,
+                             stream_frames, video_frames)
+import wire_format
+import metrics
+from metrics import span
 warnings.filterwarnings('ignore')
 
 app = Flask(__name__)
 CORS(app)
+# Registered first, so requests rejected by later before_request hooks are counted too;
+# the monitoring routes are left out of the slowest-request profiles
+metrics.instrument(app, unprofiled={'/metrics', '/profile', '/health', '/ready'})
 
 # Configure port for HuggingFace Spaces (requires port 7860)
 PORT = int(os.environ.get('PORT', 5000))
 
-# Category mapping for lost & found items
-CATEGORY_MAPPING = {
-    'person': 'other',
-    'backpack': 'bags',
-    'bag': 'bags',
-    'luggage': 'bags',
-    'purse': 'bags',
-    'wallet': 'accessories',
-    'phone': 'electronics',
-    'laptop': 'electronics',
-    'computer': 'electronics',
-    'tablet': 'electronics',
-    'headphones': 'electronics',
-    'camera': 'electronics',
-    'watch': 'jewelry',
-    'glasses': 'accessories',
-    'umbrella': 'accessories',
-    'book': 'books',
-    'bottle': 'other',
-    'cup': 'other',
-    'keys': 'keys',
-    'jacket': 'clothing',
-    'shirt': 'clothing',
-    'pants': 'clothing',
-    'dress': 'clothing',
-    'shoe': 'clothing',
-    'ball': 'sports_equipment',
-    'bat': 'sports_equipment',
-    'racket': 'sports_equipment',
-    'toy': 'toys',
-    'teddy bear': 'toys',
-    'document': 'documents',
-    'paper': 'documents',
-    'folder': 'documents'
-}
-
-# Valid categories
-VALID_CATEGORIES = [
-    'electronics', 'clothing', 'accessories', 'bags', 'books', 
-    'keys', 'jewelry', 'sports_equipment', 'documents', 'toys', 
-    'tools', 'furniture', 'other'
-]
-
-# Color mapping for categories
-CATEGORY_COLORS = {
-    'electronics': (255, 0, 0),
-    'clothing': (0, 255, 0),
-    'accessories': (0, 0, 255),
-    'bags': (255, 255, 0),
-    'books': (255, 0, 255),
-    'keys': (0, 255, 255),
-    'jewelry': (128, 0, 128),
-    'sports_equipment': (255, 165, 0),
-    'documents': (128, 128, 0),
-    'toys': (128, 0, 0),
-    'tools': (0, 128, 0),
-    'furniture': (0, 0, 128),
-    'other': (128, 128, 128)
-}
-
-print("Loading YOLO model...")
-
-# Try to load YOLO model, fall back to mock if unavailable
-try:
-    from ultralytics import YOLO
-    model = YOLO('yolov8m.pt')
-    model_loaded = True
-    print("✓ YOLO model loaded successfully")
-except Exception as e:
-    print(f"⚠ YOLO model not available: {e}")
-    print("⚠ Running in fallback mode with mock detections")
-    model_loaded = False
-
-
-def preprocess_image(file_bytes):
-    """Convert uploaded file to image array"""
-    img = Image.open(io.BytesIO(file_bytes))
-    img = img.convert('RGB')
-    return np.array(img)
-
-
-def map_to_category(detected_class):
-    """Map detected object to lost & found category"""
-    detected_class = detected_class.lower()
-    return CATEGORY_MAPPING.get(detected_class, 'other')
-
-
-def analyze_features(img):
-    """Analyze image for additional features"""
-    features = []
-    
-    # Convert to HSV for color analysis
-    hsv = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
-    
-    # Check brightness
-    brightness = np.mean(hsv[:,:,2])
-    if brightness > 150:
-        features.append('bright')
-    elif brightness < 100:
-        features.append('dark')
-    
-    # Check color saturation
-    saturation = np.mean(hsv[:,:,1])
-    if saturation < 50:
-        features.append('neutral')
-    elif saturation > 150:
-        features.append('vibrant')
-    
-    # Check for specific colors
-    # Red
-    red_mask = cv2.inRange(hsv, (0, 100, 100), (10, 255, 255))
-    if np.sum(red_mask) > 10000:
-        features.append('red')
-    
-    # Blue
-    blue_mask = cv2.inRange(hsv, (100, 100, 100), (130, 255, 255))
-    if np.sum(blue_mask) > 10000:
-        features.append('blue')
-    
-    # Green
-    green_mask = cv2.inRange(hsv, (40, 100, 100), (80, 255, 255))
-    if np.sum(green_mask) > 10000:
-        features.append('green')
-    
-    # Black/White/Gray
-    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    if np.std(gray) < 30:
-        features.append('neutral_color')
-    elif np.mean(gray) > 200:
-        features.append('light_color')
-    elif np.mean(gray) < 50:
-        features.append('dark_color')
-    
-    return features
+# Directory for the persistent embedding index (in-memory only when unset)
+INDEX_DIR = os.environ.get('AI_INDEX_DIR')
+
+# Shared log of open items for lost<->found matching (alongside the index when persistent)
+MATCH_LOG = os.environ.get('AI_MATCH_LOG') or (os.path.join(INDEX_DIR, 'matches.jsonl') if INDEX_DIR else None)
+# Shared log of item photo hashes for near-duplicate detection
+DUPLICATE_LOG = os.environ.get('AI_DUPLICATE_LOG') or (os.path.join(INDEX_DIR, 'hashes.jsonl') if INDEX_DIR else None)
+
+# Load the model on a background thread so the app answers /health immediately (cold starts)
+LAZY_LOAD = os.environ.get('AI_LAZY_LOAD', '1') == '1'
+# Run one synthetic inference before the first real request
+WARMUP = os.environ.get('AI_WARMUP', '1') == '1'
+
+# View functions that run a model (chosen by the 'model' field); 503 LOADING until it is ready
+MODEL_ENDPOINTS = {'analyze', 'detect_objects', 'analyze_hybrid', 'extract_features', 'video_inventory'}
+# Of those, the ones that may be served by a cheaper tier to meet a latency budget
+TIERED_ENDPOINTS = {'analyze', 'detect_objects', 'analyze_hybrid'}
+# These embed uploads with the active model only, so index vectors stay comparable
+IMAGE_ENDPOINTS = {'index_add', 'index_search', 'match_add'}
+
+registry = ModelRegistry(lazy=LAZY_LOAD, warmup=WARMUP)
+vector_index = VectorIndex(EmbeddingStore(INDEX_DIR) if INDEX_DIR else None)
+duplicate_index = DuplicateIndex(DUPLICATE_LOG)
+batch_jobs = BatchJobManager(registry, duplicates=duplicate_index)
+match_engine = MatchEngine(vector_index, MATCH_LOG)
+
+IMPORT_SECONDS = round(time.time() - STARTED_AT, 3)
+first_response_at = None
+
+
+def start_background_work():
+    """Start per-process threads; gunicorn calls this in each worker after fork"""
+    if not LAZY_LOAD and WARMUP:
+        # Never in the preloading master: a forked child must not inherit warmed-up thread pools
+        threading.Thread(target=registry.get().warm_up, name='model-warmup', daemon=True).start()
+    batch_jobs.resume_incomplete()
+
+
+def loading_response():
+    return jsonify({'error': 'Model is loading, retry shortly', 'status': 'LOADING'}), 503, {'Retry-After': '5'}
+
+
+@app.before_request
+def select_model():
+    """
+    Pin the model (and for tiered endpoints the tier) for this request.
+    503 LOADING until the model is ready, 503 DEGRADED when the request is shed.
+    """
+    if request.endpoint in MODEL_ENDPOINTS:
+        name = request.values.get('model') or request.headers.get('X-Model')
+    elif request.endpoint in IMAGE_ENDPOINTS and 'image' in request.files:
+        name = None
+    else:
+        return None
+
+    g.tier, g.imgsz, g.with_features, g.tiling = 'full', None, True, 'off'
+    try:
+        if request.endpoint in TIERED_ENDPOINTS:
+            g.tiling = request.values.get('tiling') or TILING_MODE
+            if g.tiling not in TILING_MODES:
+                return jsonify({'error': f"tiling must be one of {', '.join(TILING_MODES)}"}), 400
+            budget = parse_budget(request.headers.get('X-Latency-Budget-Ms') or request.values.get('latency_budget_ms'))
+            choice = plan(registry, name, budget)
+            if choice is None:
+                return loading_response()
+            name = choice.version
+            g.tier, g.imgsz, g.with_features = choice.tier, choice.imgsz, choice.features
+            if choice.tier != 'full':
+                g.tiling = 'off'  # tiles multiply the work of a request that is already degraded
+        g.model_version, g.engine = registry.acquire(name)
+    except KeyError as e:
+        return jsonify({'error': str(e.args[0])}), 400
+    except Overloaded as e:
+        return jsonify({'error': str(e), 'status': 'DEGRADED', 'tier': 'shed'}), 503, {'Retry-After': '2'}
+    if g.engine.state == 'loading':
+        return loading_response()
+    return None
+
+
+@app.teardown_request
+def release_model(exc):
+    version = g.pop('model_version', None)
+    if version is not None:
+        registry.release(version)
+
+
+@app.after_request
+def record_first_response(response):
+    global first_response_at
+    if first_response_at is None:
+        first_response_at = time.time()
+    if 'model_version' in g:
+        response.headers['X-Model-Version'] = g.model_version
+        response.headers['X-Inference-Tier'] = g.tier
+    return response
+
+
+def startup_timings():
+    """Cold-start milestones, in seconds since main was imported"""
+    def since(timestamp):
+        return round(timestamp - STARTED_AT, 3) if timestamp else None
+
+    timings = registry.get().timings
+    return {
+        'import_seconds': IMPORT_SECONDS,
+        'time_to_first_byte': since(first_response_at),
+        'model_load_seconds': timings['load_seconds'],
+        'warmup_seconds': timings['warmup_seconds'],
+        'time_to_ready': since(timings['ready_at']),
+        'time_to_first_inference': since(timings['first_inference_at'])
+    }
+
+
+def read_upload():
+    """
+    Stream of the 'image' field of the current request, or None if missing.
+    The stream is handed to the engine as-is, so the upload is never copied into a bytes object.
+    """
+    check_upload_size(request.content_length)
+    if 'image' not in request.files:
+        return None
+    return request.files['image'].stream
+
+
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    """
+    Detections, features, secondary tags, embedding and crops from one upload, decode and
+    forward pass. 'outputs' picks a comma-separated subset; format=msgpack (or Accept:
+    application/msgpack) returns msgpack with the embedding as raw float32 bytes.
+    """
+    try:
+        requested = request.values.get('outputs')
+        outputs = [o.strip() for o in requested.split(',') if o.strip()] if requested else list(DEFAULT_OUTPUTS)
+        unknown = [o for o in outputs if o not in ANALYZE_OUTPUTS]
+        if unknown:
+            return jsonify({'error': f"Unknown outputs {', '.join(unknown)}; choose from {', '.join(ANALYZE_OUTPUTS)}"}), 400
+        binary = wire_format.wants_msgpack(request)
+        if binary and wire_format.msgpack is None:
+            return jsonify({'error': 'msgpack is not installed on this service'}), 406
+
+        upload = read_upload()
+        if upload is None:
+            return jsonify({'error': 'No image provided'}), 400
+
+        with_features = g.with_features and ('features' in outputs or 'secondary_tags' in outputs)
+        needs_image = 'crops' in outputs or 'detection_embeddings' in outputs
+        result = g.engine.analyze_upload(upload, with_features=with_features, imgsz=g.imgsz,
+                                         tiling=g.tiling, return_image=needs_image)
+        raw, image = result if needs_image else (result, None)
+        with span('serialize'):
+            body = dict(g.engine.analyze_view(raw, outputs, image), tier=g.tier)
+            if binary:
+                return Response(wire_format.to_msgpack(body), mimetype='application/msgpack')
+            return Response(wire_format.to_json(body), mimetype='application/json')
+
+    except ImageRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        print(f"Error in analyze: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 
 @app.route('/detect', methods=['POST'])
 def detect_objects():
     """Detect objects in uploaded image"""
     try:
-        if 'image' not in request.files:
+        upload = read_upload()
+        if upload is None:
             return jsonify({'error': 'No image provided'}), 400
+
+        raw = g.engine.analyze_upload(upload, with_features=False, imgsz=g.imgsz, tiling=g.tiling)
+        with span('serialize'):
+            return jsonify(dict(g.engine.detect_view(raw), tier=g.tier))
         
-        file = request.files['image']
-        img_bytes = file.read()
-        img = preprocess_image(img_bytes)
-        
-        detections = []
-        
-        if model_loaded:
-            # Run YOLO detection
-            results = model(img, verbose=False)
-            
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    conf = float(box.conf[0])
-                    if conf > 0.3:  # Confidence threshold
-                        cls = int(box.cls[0])
-                        class_name = model.names[cls]
-                        category = map_to_category(class_name)
-                        
-                        # Get bounding box
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        
-                        detections.append({
-                            'class': class_name,
-                            'category': category,
-                            'confidence': round(conf, 2),
-                            'bbox': [int(x1), int(y1), int(x2), int(y2)]
-                        })
-        else:
-            # Fallback mock detection
-            detections = [
-                {'class': 'bag', 'category': 'bags', 'confidence': 0.75, 'bbox': [50, 50, 200, 200]},
-                {'class': 'electronics', 'category': 'electronics', 'confidence': 0.60, 'bbox': [100, 100, 180, 180]}
-            ]
-        
-        return jsonify({
-            'detections': detections,
-            'status': 'SUCCESS' if detections else 'LOW_CONFIDENCE',
-            'count': len(detections)
-        })
-        
+    except ImageRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error in detect: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -213,74 +227,16 @@ def detect_objects():
 def analyze_hybrid():
     """Hybrid analysis combining detection + feature extraction"""
     try:
-        if 'image' not in request.files:
+        upload = read_upload()
+        if upload is None:
             return jsonify({'error': 'No image provided'}), 400
+
+        raw = g.engine.analyze_upload(upload, with_features=g.with_features, imgsz=g.imgsz, tiling=g.tiling)
+        with span('serialize'):
+            return jsonify(dict(g.engine.hybrid_view(raw), tier=g.tier))
         
-        file = request.files['image']
-        img_bytes = file.read()
-        img = preprocess_image(img_bytes)
-        
-        # Get detections
-        detections = []
-        best_category = 'other'
-        best_confidence = 0
-        
-        if model_loaded:
-            results = model(img, verbose=False)
-            
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    conf = float(box.conf[0])
-                    if conf > 0.25:
-                        cls = int(box.cls[0])
-                        class_name = model.names[cls]
-                        category = map_to_category(class_name)
-                        
-                        detections.append({
-                            'class': class_name,
-                            'category': category,
-                            'confidence': round(conf, 2),
-                            'bbox': box.xyxy[0].cpu().numpy().tolist()
-                        })
-                        
-                        if conf > best_confidence:
-                            best_confidence = conf
-                            best_category = category
-        else:
-            # Fallback
-            detections = [{'class': 'bag', 'category': 'bags', 'confidence': 0.70}]
-            best_category = 'bags'
-        
-        # Analyze features
-        features = analyze_features(img)
-        
-        # Generate secondary tags
-        secondary_tags = []
-        if 'red' in features:
-            secondary_tags.append('red')
-        if 'blue' in features:
-            secondary_tags.append('blue')
-        if 'dark_color' in features:
-            secondary_tags.append('dark')
-        if 'vibrant' in features:
-            secondary_tags.append('colorful')
-        
-        # Add importance indicators
-        if best_category in ['electronics', 'jewelry', 'keys']:
-            secondary_tags.append('valuable')
-        elif best_category in ['documents', 'books']:
-            secondary_tags.append('important')
-        
-        return jsonify({
-            'detections': detections,
-            'category': best_category,
-            'features': features,
-            'secondary_tags': secondary_tags,
-            'status': 'SUCCESS' if detections else 'LOW_CONFIDENCE',
-            'confidence': best_confidence
-        })
-        
+    except ImageRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error in analyze-hybrid: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -290,37 +246,483 @@ def analyze_hybrid():
 def extract_features():
     """Extract embedding/features from image for similarity search"""
     try:
-        if 'image' not in request.files:
+        upload = read_upload()
+        if upload is None:
             return jsonify({'error': 'No image provided'}), 400
-        
-        file = request.files['image']
-        img_bytes = file.read()
-        img = preprocess_image(img_bytes)
-        
-        # Generate mock embedding vector
-        # In production, use a proper embedding model
-        embedding = np.random.randn(128).tolist()
-        
-        return jsonify({
+
+        # per_detection=1 adds one vector per detected object, cut from the same decoded image
+        per_detection = request.values.get('per_detection', '').lower() in ('1', 'true', 'yes')
+        result = g.engine.analyze_upload(upload, with_features=False, return_image=per_detection)
+        raw, image = result if per_detection else (result, None)
+        embedding = raw['embedding'].tolist()
+
+        body = {
             'embedding': embedding,
-            'dimensions': len(embedding)
-        })
+            'dimensions': len(embedding),
+            'model': raw['embedding_model']
+        }
+        if per_detection:
+            detections = g.engine.with_embeddings(g.engine.detections(raw, HYBRID_CONFIDENCE), image)
+            body['detections'] = [dict(d, embedding=d['embedding'].tolist() if d['embedding'] is not None else None)
+                                  for d in detections]
+        with span('serialize'):
+            return jsonify(body)
         
+    except ImageRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error in extract: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/video', methods=['POST'])
+def video_inventory():
+    """
+    One inventory of the items seen in a short video or frame sequence, each with its best crop.
+    The body is a video (multipart field 'video', or raw with a video/* Content-Type), spooled
+    to disk, or a length-prefixed frame stream (Content-Type application/x-frame-stream, may be
+    chunked) that is decoded as it arrives. format=msgpack returns the crops as raw bytes.
+    """
+    path = None
+    try:
+        if request.content_length and request.content_length > MAX_VIDEO_BYTES:
+            raise ImageRejected(f'Video exceeds {MAX_VIDEO_BYTES // (1024 * 1024)} MB')
+        binary = wire_format.wants_msgpack(request)
+        if binary and wire_format.msgpack is None:
+            return jsonify({'error': 'msgpack is not installed on this service'}), 406
+        sample_fps = float(request.args.get('sample_fps', SAMPLE_FPS))
+
+        if request.mimetype == FRAME_STREAM_MIMETYPE:
+            fps = request.args.get('fps')
+            frames = stream_frames(request.stream, float(fps) if fps else None)
+        elif 'video' in request.files:
+            upload = request.files['video']
+            path = spool_upload(upload.stream, os.path.splitext(upload.filename or '')[1])
+            frames = video_frames(path, sample_fps)
+        elif request.mimetype.startswith('video/'):
+            path = spool_upload(request.stream, '.' + request.mimetype.split('/', 1)[1])
+            frames = video_frames(path, sample_fps)
+        else:
+            return jsonify({'error': 'No video provided'}), 400
+
+        body = inventory(g.engine, frames)
+        with span('serialize'):
+            if binary:
+                return Response(wire_format.to_msgpack(body), mimetype='application/msgpack')
+            return Response(wire_format.to_json(body), mimetype='application/json')
+
+    except ImageRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in video: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if path is not None:
+            os.unlink(path)
+
+
+def request_params():
+    """Merged JSON body / form fields of the current request"""
+    return request.get_json(silent=True) or request.form
+
+
+def read_query_embedding():
+    """Embedding from an uploaded 'image' or a JSON/form 'embedding' list"""
+    upload = read_upload()
+    if upload is not None:
+        return g.engine.analyze_upload(upload, with_features=False)['embedding']
+
+    embedding = request_params().get('embedding')
+    if embedding is None:
+        return None
+    if isinstance(embedding, str):
+        embedding = json.loads(embedding)
+    return np.asarray(embedding, dtype=np.float32)
+
+
+@app.route('/index/add', methods=['POST'])
+def index_add():
+    """Add or replace an item's embedding in the similarity index"""
+    try:
+        params = request_params()
+        item_id = params.get('item_id')
+        if not item_id:
+            return jsonify({'error': 'item_id is required'}), 400
+        item_id = str(item_id)
+
+        embedding = read_query_embedding()
+        if embedding is None:
+            return jsonify({'error': 'No image or embedding provided'}), 400
+
+        vector_index.add(item_id, embedding, category=params.get('category'), item_type=params.get('type'))
+        return jsonify({'success': True, 'item_id': item_id, 'size': len(vector_index)})
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in index add: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/index/remove', methods=['POST'])
+def index_remove():
+    """Remove an item (e.g. claimed or deleted) from the similarity index"""
+    try:
+        item_id = request_params().get('item_id')
+        if not item_id:
+            return jsonify({'error': 'item_id is required'}), 400
+        item_id = str(item_id)
+
+        removed = vector_index.remove(item_id)
+        return jsonify({'success': removed, 'item_id': item_id, 'size': len(vector_index)})
+
+    except Exception as e:
+        print(f"Error in index remove: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/index/search', methods=['POST'])
+def index_search():
+    """Top-k most similar indexed items, optionally filtered by category and type"""
+    try:
+        params = request_params()
+        embedding = read_query_embedding()
+        if embedding is None:
+            return jsonify({'error': 'No image or embedding provided'}), 400
+
+        k = int(params.get('k', 10))
+        hits = vector_index.search(embedding, k=k, category=params.get('category') or None,
+                                   item_type=params.get('type') or None)
+        return jsonify({
+            'matches': [dict(hit, score=round(hit['score'], 4)) for hit in hits],
+            'count': len(hits)
+        })
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in index search: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/match/add', methods=['POST'])
+def match_add():
+    """
+    Register a newly reported item and return its best matches among open items of the other type.
+    With an image the item is also indexed for similarity search, and its colour features
+    and detected category feed the match.
+    """
+    try:
+        params = request_params()
+        item_id = params.get('item_id')
+        if not item_id:
+            return jsonify({'error': 'item_id is required'}), 400
+        # Every index keys items by the string id, whether the body sent a number or a string
+        item_id = str(item_id)
+
+        embedding, features, detected, photo_hash, duplicates = None, None, None, None, []
+        upload = read_upload()
+        if upload is not None:
+            raw = g.engine.analyze_upload(upload, with_features=True)
+            embedding, features, photo_hash = raw['embedding'], raw['features'], raw['phash']
+            detections = [] if raw['fallback'] else g.engine.detections(raw, HYBRID_CONFIDENCE)
+            detected = detections[0]['category'] if detections else None
+            if photo_hash is not None:
+                duplicates = duplicate_index.search(photo_hash, exclude=item_id)
+        else:
+            embedding = read_query_embedding()
+
+        # Matching validates the item; only then is it indexed (candidates are scored against the query vector)
+        matches = match_engine.add(
+            item_id, params.get('type'), category=params.get('category'), title=params.get('title'),
+            description=params.get('description'), location=params.get('location'),
+            created_at=params.get('created_at'), user_id=params.get('user_id') or None,
+            embedding=embedding, features=features, detected_category=detected)
+        if embedding is not None:
+            vector_index.add(item_id, embedding, category=params.get('category'), item_type=params.get('type'))
+        if photo_hash is not None:
+            duplicate_index.add(item_id, photo_hash)
+        return jsonify({'item_id': item_id, 'matches': matches, 'count': len(matches),
+                        'detected_category': detected, 'duplicates': duplicates})
+
+    except ImageRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in match add: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/match/remove', methods=['POST'])
+def match_remove():
+    """Stop matching an item (claimed, closed or deleted) and drop it from the indexes"""
+    try:
+        item_id = request_params().get('item_id')
+        if not item_id:
+            return jsonify({'error': 'item_id is required'}), 400
+        item_id = str(item_id)
+
+        removed = match_engine.remove(item_id)
+        vector_index.remove(item_id)
+        duplicate_index.remove(item_id)
+        return jsonify({'success': removed, 'item_id': item_id, 'open_items': len(match_engine)})
+
+    except Exception as e:
+        print(f"Error in match remove: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/duplicates', methods=['POST'])
+def find_duplicates():
+    """
+    Indexed items whose photo is a near-duplicate of the uploaded 'image' (or of a 16-hex-digit
+    'hash'). Only decodes and hashes: no model runs, so it is cheap enough to call before every insert.
+    """
+    try:
+        params = request_params()
+        upload = read_upload()
+        if upload is not None:
+            photo_hash = phash(decode_image(upload)[0])
+        elif params.get('hash'):
+            try:
+                photo_hash = int(str(params['hash']), 16)
+            except ValueError:
+                photo_hash = -1
+            if not 0 <= photo_hash < 1 << 64:
+                return jsonify({'error': 'hash must be a 64-bit pHash as up to 16 hex digits'}), 400
+        else:
+            return jsonify({'error': 'No image or hash provided'}), 400
+        max_distance = params.get('max_distance')
+        if max_distance not in (None, ''):
+            try:
+                max_distance = int(max_distance)
+            except (TypeError, ValueError):
+                max_distance = -1
+            if not 0 <= max_distance <= DUPLICATE_MAX_DISTANCE:
+                return jsonify({'error': f'max_distance must be an integer from 0 to {DUPLICATE_MAX_DISTANCE}'}), 400
+        else:
+            max_distance = None
+        if photo_hash is None:
+            # A flat image has no usable hash (see perceptual_hash.phash)
+            return jsonify({'hash': None, 'duplicates': [], 'count': 0, 'search_ms': 0.0})
+
+        start = time.perf_counter()
+        duplicates = duplicate_index.search(photo_hash, max_distance,
+                                            exclude=str(params['item_id']) if params.get('item_id') else None)
+        return jsonify({
+            'hash': hash_hex(photo_hash),
+            'duplicates': duplicates,
+            'count': len(duplicates),
+            'search_ms': round((time.perf_counter() - start) * 1000, 3)
+        })
+
+    except ImageRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in duplicates: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/batch', methods=['POST'])
+def create_batch_job():
+    """Start a bulk ingest job from a multipart image list, a zip, or a shared directory"""
+    try:
+        params = request_params()
+        options = {'include_embedding': str(params.get('include_embedding', '')).lower() in ('1', 'true', 'yes'),
+                   'skip_duplicates': str(params.get('skip_duplicates', '1')).lower() in ('1', 'true', 'yes')}
+        # Pin the job to a concrete version so a resume uses the same weights
+        try:
+            options['model'] = registry.resolve(params.get('model'))
+        except KeyError as e:
+            return jsonify({'error': str(e.args[0])}), 400
+
+        if 'archive' in request.files:
+            state = batch_jobs.create_from_zip(request.files['archive'], options)
+        elif request.files.getlist('images'):
+            state = batch_jobs.create_from_uploads(request.files.getlist('images'), options)
+        elif params.get('directory'):
+            state = batch_jobs.create_from_directory(params['directory'], options)
+        else:
+            return jsonify({'error': "Provide 'images', 'archive' or 'directory'"}), 400
+
+        return jsonify(state), 202
+
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in batch create: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/batch', methods=['GET'])
+def list_batch_jobs():
+    """All known batch jobs with their progress"""
+    return jsonify({'jobs': batch_jobs.list_jobs()})
+
+
+@app.route('/batch/<job_id>', methods=['GET'])
+def batch_job_status(job_id):
+    """Progress of one batch job"""
+    try:
+        return jsonify(batch_jobs.status(job_id))
+    except (KeyError, FileNotFoundError):
+        return jsonify({'error': 'Job not found'}), 404
+
+
+@app.route('/batch/<job_id>/resume', methods=['POST'])
+def resume_batch_job(job_id):
+    """Restart a failed or interrupted job; finished images are skipped"""
+    try:
+        return jsonify(batch_jobs.resume(job_id))
+    except (KeyError, FileNotFoundError):
+        return jsonify({'error': 'Job not found'}), 404
+
+
+@app.route('/batch/<job_id>/results', methods=['GET'])
+def batch_job_results(job_id):
+    """Stream results written so far as NDJSON, optionally from a byte offset"""
+    try:
+        path = batch_jobs.results_path(job_id)
+        offset = int(request.args.get('offset', 0))
+    except KeyError:
+        return jsonify({'error': 'Job not found'}), 404
+    except ValueError:
+        return jsonify({'error': 'offset must be an integer'}), 400
+    if not os.path.exists(path):
+        return Response('', mimetype='application/x-ndjson')
+
+    def stream():
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                yield line
+
+    return Response(stream(), mimetype='application/x-ndjson')
+
+
+@app.route('/models', methods=['GET'])
+def list_models():
+    """Registered model versions (model_versions columns plus weights_path/variant)"""
+    return jsonify({'active': registry.resolve(), 'models': registry.entries(), 'loaded': registry.stats()['loaded']})
+
+
+@app.route('/models/refresh', methods=['POST'])
+def refresh_models():
+    """Rescan models.json and the training output folders for new weights"""
+    return jsonify({'active': registry.resolve(), 'models': registry.refresh()})
+
+
+@app.route('/models/activate', methods=['POST'])
+def activate_model():
+    """Load a version in the background and make it the default once ready"""
+    version = request_params().get('version')
+    if not version:
+        return jsonify({'error': 'version is required'}), 400
+    try:
+        return jsonify(registry.activate(version)), 202
+    except KeyError as e:
+        return jsonify({'error': str(e.args[0])}), 404
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Liveness: always 200 while the process is up; model_state tells loading/ready/failed"""
+    engine = registry.get()
     return jsonify({
         'status': 'healthy',
-        'model_loaded': model_loaded,
-        'service': 'lost-found-ai'
+        'model_state': engine.state,
+        'model_loaded': engine.model_loaded,
+        'service': 'lost-found-ai',
+        'model_version': engine.model_version,
+        'backend': engine.backend.kind if engine.backend is not None else None,
+        'batching': engine.batcher.stats(),
+        'cache': engine.cache.stats(),
+        'index': vector_index.stats(),
+        'matching': match_engine.stats(),
+        'duplicates': duplicate_index.stats(),
+        'models': registry.stats(),
+        'profiler': metrics.profiler.stats(),
+        'startup': startup_timings()
     })
 
 
+def service_metrics():
+    """Scrape-time values owned by the registry, cache and indexes (see metrics.Registry)"""
+    models = registry.stats()
+    cache = registry.cache.stats()
+    loaded = models['loaded'].items()
+    return [
+        ('ai_model_loaded', 'gauge', 'Loaded engines by version and state (1 = weights loaded, 0 = fallback)',
+         [({'version': v, 'state': m['state']}, int(m['state'] == 'ready')) for v, m in loaded]),
+        ('ai_model_in_flight', 'gauge', 'Requests pinned to each loaded model',
+         [({'version': v}, m['in_flight']) for v, m in loaded]),
+        ('ai_batch_queue_depth', 'gauge', 'Images waiting for a batch slot, by model',
+         [({'version': v}, m['batching']['queue_depth']) for v, m in loaded]),
+        ('ai_batch_ms_ewma', 'gauge', 'Smoothed batch latency used for admission, by model',
+         [({'version': v}, m['batching']['batch_ms_ewma']) for v, m in loaded]),
+        ('ai_cache_hits_total', 'counter', 'Result cache hits by tier',
+         [({'tier': 'memory'}, cache['hits']), ({'tier': 'disk'}, cache['disk_hits']),
+          ({'tier': 'phash'}, cache['phash_hits'])]),
+        ('ai_cache_misses_total', 'counter', 'Result cache misses', [({}, cache['misses'])]),
+        ('ai_cache_hit_ratio', 'gauge', 'Result cache hit rate since start', [({}, cache['hit_rate'])]),
+        ('ai_cache_entries', 'gauge', 'Results held in memory', [({}, cache['entries'])]),
+        ('ai_cache_bytes', 'gauge', 'Bytes of results held in memory', [({}, cache['bytes'])]),
+        ('ai_cache_evictions_total', 'counter', 'Results evicted for space', [({}, cache['evictions'])]),
+        ('ai_index_vectors', 'gauge', 'Vectors in the similarity index', [({}, len(vector_index))]),
+        ('ai_match_open_items', 'gauge', 'Open items in the match engine', [({}, len(match_engine))]),
+        ('ai_duplicate_hashes', 'gauge', 'Photo hashes in the duplicate index', [({}, len(duplicate_index))])
+    ]
+
+
+metrics.REGISTRY.add_collector(service_metrics)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition; values are per worker process (ai_worker_info tells them apart)"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/profile', methods=['GET'])
+def profile_dump():
+    """
+    Stacks of the slowest requests sampled by the profiler, as folded lines for flamegraph.pl
+    or speedscope; format=json lists each request with its spans and stack counts instead.
+    """
+    if request.args.get('format') == 'json':
+        return jsonify({'profiler': metrics.profiler.stats(), 'requests': metrics.profiler.slowest()})
+    return Response(metrics.profiler.folded(), mimetype='text/plain')
+
+
+@app.route('/profile', methods=['POST'])
+def profile_configure():
+    """Switch the sampling profiler on or off: {"enabled", "keep", "interval_ms", "reset"} (all optional)"""
+    params = request_params()
+    try:
+        enabled = params.get('enabled')
+        if isinstance(enabled, str):
+            enabled = enabled.lower() in ('1', 'true', 'yes', 'on')
+        reset = params.get('reset') in (True, '1', 'true', 'yes')
+        return jsonify(metrics.profiler.configure(enabled, params.get('keep'), params.get('interval_ms'), reset))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'keep and interval_ms must be numbers'}), 400
+
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 503 until the model has loaded (or failed over to fallback mode)"""
+    engine = registry.get()
+    body = {'model_state': engine.state, 'model_version': engine.model_version}
+    return jsonify(body), 503 if engine.state == 'loading' else 200
+
+
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint"""
@@ -328,14 +730,29 @@ def root():
         'service': 'Lost & Found AI Service',
         'version': '1.0.0',
         'endpoints': [
+            '/analyze',
             '/detect',
             '/analyze-hybrid',
             '/extract',
-            '/health'
+            '/video',
+            '/index/add',
+            '/index/remove',
+            '/index/search',
+            '/match/add',
+            '/match/remove',
+            '/duplicates',
+            '/batch',
+            '/models',
+            '/metrics',
+            '/profile',
+            '/health',
+            '/ready'
         ]
     })
 
 
 if __name__ == '__main__':
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
+    start_background_work()
     print(f"Starting AI Service on port {PORT}...")
     app.run(host='0.0.0.0', port=PORT, debug=False)
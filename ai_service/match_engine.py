@@ -0,0 +1,275 @@
+"""
+Lost <-> found match engine
+Incremental: each new item is compared only with open items of the opposite type that share
+a category block, fall inside the time window and do not contradict its location
+"""
+
+import os
+import re
+import sys
+import time
+import bisect
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from ai_engine import VALID_CATEGORIES, map_to_category
+from op_log import OpLog
+
+# Candidates must have been reported within this many days of each other
+MATCH_WINDOW_DAYS = float(os.environ.get('AI_MATCH_WINDOW_DAYS', 60))
+MATCH_TOP_K = int(os.environ.get('AI_MATCH_TOP_K', 5))
+MIN_MATCH_SCORE = float(os.environ.get('AI_MATCH_MIN_SCORE', 0.45))
+# Blocks wider than this are cut to the candidates closest in time
+MAX_CANDIDATES = int(os.environ.get('AI_MATCH_MAX_CANDIDATES', 5000))
+
+# Relative weight of each signal; signals missing on either side are left out and the rest renormalized
+SIGNAL_WEIGHTS = {'embedding': 0.5, 'colour': 0.2, 'text': 0.3}
+
+# Rewrite the shared log once removals outnumber live items (and at least this many)
+COMPACT_MIN_DEAD = 1000
+
+OPPOSITE_TYPE = {'lost': 'found', 'found': 'lost'}
+
+STOPWORDS = frozenset('''
+    a an and are at by for from has have in is it its lost found my near of off on or our
+    the this to was were with item items left someone please
+'''.split())
+
+
+def tokens(text):
+    """Lower-case word tokens without stopwords, interned (many items share the same words)"""
+    words = re.findall(r'[a-z0-9]+', (text or '').lower())
+    return frozenset(map(sys.intern, (w for w in words if len(w) > 1 and w not in STOPWORDS)))
+
+
+def canonical_category(value):
+    """A lost & found category from a category name or a detector class name (CATEGORY_MAPPING)"""
+    value = (value or '').strip().lower()
+    if not value:
+        return None
+    return value if value in VALID_CATEGORIES else map_to_category(value)
+
+
+def parse_timestamp(value):
+    """Epoch seconds from epoch seconds or an ISO 8601 string (Supabase created_at); now if missing"""
+    if value in (None, ''):
+        return time.time()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        # Supabase TIMESTAMP columns are UTC without an offset
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return None
+    return len(a & b) / len(a | b)
+
+
+class MatchEngine:
+    """
+    Open items by (category, type) block, each block sorted by report time.
+    add() scores the new item against the survivors of blocking and returns its best matches;
+    nothing is ever rescanned, so each pair is reported once, when its second item arrives.
+    Embeddings live in the VectorIndex (looked up by item id); everything else is kept here.
+    """
+
+    def __init__(self, vector_index, log_path=None, window_days=MATCH_WINDOW_DAYS, top_k=MATCH_TOP_K,
+                 min_score=MIN_MATCH_SCORE, max_candidates=MAX_CANDIDATES):
+        self.vector_index = vector_index
+        self.log = OpLog(log_path) if log_path else None
+        self.window = window_days * 86400
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_candidates = max_candidates
+        self._lock = threading.RLock()
+        self._reset()
+        self.sync()
+
+    def _reset(self):
+        self._items = {}
+        self._blocks = {}
+        self._lines = 0  # log lines applied; those beyond the live items are dead
+        self._last_blocking = {'blocked': 0, 'scored': 0}
+
+    def __len__(self):
+        return len(self._items)
+
+    def sync(self):
+        """Pick up items added or removed by other processes sharing the log"""
+        if self.log is None:
+            return
+        with self._lock:
+            self._apply(*self.log.read())
+
+    def _commit(self, op):
+        if self.log is None:
+            self._apply([op], False)
+        else:
+            self._apply(*self.log.append(op))
+
+    def _apply(self, ops, reset):
+        if reset:
+            self._reset()
+        for op in ops:
+            self._lines += 1
+            if op['id'] in self._items:
+                self._delete(op['id'])
+            if op['op'] == 'add':
+                self._insert(op)
+
+    def _insert(self, op):
+        item = {
+            'id': op['id'],
+            'type': op['type'],
+            'categories': tuple(op['categories']),
+            'ts': op['ts'],
+            'location': tokens(op.get('location')),
+            'text': tokens(op.get('text')),
+            'colours': frozenset(op.get('colours') or ()),
+            'user_id': op.get('user_id'),
+            'title': op.get('title')
+        }
+        self._items[item['id']] = item
+        for category in item['categories']:
+            bisect.insort(self._blocks.setdefault((category, item['type']), []), (item['ts'], item['id']))
+
+    def _delete(self, item_id):
+        item = self._items.pop(item_id)
+        for category in item['categories']:
+            block = self._blocks[(category, item['type'])]
+            i = bisect.bisect_left(block, (item['ts'], item_id))
+            if i < len(block) and block[i][1] == item_id:
+                del block[i]
+
+    def add(self, item_id, item_type, category=None, title='', description='', location='',
+            created_at=None, user_id=None, embedding=None, features=None, detected_category=None, match=True):
+        """
+        Register an open item and return its best matches among open items of the other type.
+        category is the reporter's choice, detected_category the detector's; both are blocks.
+        """
+        if item_type not in OPPOSITE_TYPE:
+            raise ValueError("type must be 'lost' or 'found'")
+        if embedding is not None and self.vector_index.dim not in (None, np.asarray(embedding).size):
+            raise ValueError(f'Expected a {self.vector_index.dim}-d vector, got {np.asarray(embedding).size}-d')
+        categories = []
+        for value in (category, detected_category):
+            value = canonical_category(value)
+            if value and value not in categories:
+                categories.append(value)
+        op = {
+            'op': 'add', 'id': str(item_id), 'type': item_type, 'categories': categories or ['other'],
+            'ts': parse_timestamp(created_at), 'location': location or '',
+            'text': f'{title or ""} {description or ""}', 'colours': list(features or []),
+            'user_id': user_id, 'title': title
+        }
+        with self._lock:
+            self._commit(op)
+            if not match:
+                return []
+            return self._matches(self._items[op['id']], embedding)
+
+    def remove(self, item_id):
+        """Drop an item (claimed, closed or deleted); False if it was not open"""
+        with self._lock:
+            self.sync()
+            if str(item_id) not in self._items:
+                return False
+            self._commit({'op': 'remove', 'id': str(item_id)})
+            if self._lines - len(self._items) >= max(COMPACT_MIN_DEAD, len(self._items)):
+                self.compact()
+            return True
+
+    def compact(self):
+        """Rewrite the shared log with only the live items"""
+        with self._lock:
+            if self.log is None:
+                self._lines = len(self._items)
+                return
+            # Read and rewrite under the log's lock, so adds and removes by other workers survive
+            ops = self.log.compact(self._apply, lambda: [self._op_for(item) for item in self._items.values()])
+            self._lines = len(ops)
+
+    @staticmethod
+    def _op_for(item):
+        return {'op': 'add', 'id': item['id'], 'type': item['type'], 'categories': list(item['categories']),
+                'ts': item['ts'], 'location': ' '.join(sorted(item['location'])),
+                'text': ' '.join(sorted(item['text'])), 'colours': sorted(item['colours']),
+                'user_id': item['user_id'], 'title': item['title']}
+
+    def _candidates(self, item):
+        """Blocking: same category block, opposite type, within the window, compatible location"""
+        other = OPPOSITE_TYPE[item['type']]
+        start, end = item['ts'] - self.window, item['ts'] + self.window
+        found = {}
+        for category in item['categories']:
+            block = self._blocks.get((category, other))
+            if not block:
+                continue
+            lo = bisect.bisect_left(block, start, key=lambda entry: entry[0])
+            hi = bisect.bisect_right(block, end, key=lambda entry: entry[0])
+            for ts, candidate in block[lo:hi]:
+                found[candidate] = ts
+
+        location = item['location']
+        if location:
+            # Two named places with no word in common are different places; unnamed is compatible
+            found = {c: ts for c, ts in found.items()
+                     if not self._items[c]['location'] or self._items[c]['location'] & location}
+
+        ids = list(found)
+        if len(ids) > self.max_candidates:
+            gaps = np.abs(np.fromiter(found.values(), dtype=np.float64, count=len(ids)) - item['ts'])
+            ids = [ids[i] for i in np.argpartition(gaps, self.max_candidates - 1)[:self.max_candidates]]
+        return ids
+
+    def _matches(self, item, embedding=None):
+        ids = self._candidates(item)
+        self._last_blocking = {'blocked': len(self._items) - len(ids), 'scored': len(ids)}
+        if not ids:
+            return []
+
+        similarities = (self.vector_index.similarities(embedding, ids) if embedding is not None
+                        else np.full(len(ids), np.nan, dtype=np.float32))
+        scored = []
+        for candidate_id, similarity in zip(ids, similarities.tolist()):
+            candidate = self._items[candidate_id]
+            signals = {
+                'embedding': None if similarity != similarity else max(0.0, similarity),
+                'colour': jaccard(item['colours'], candidate['colours']),
+                'text': jaccard(item['text'], candidate['text'])
+            }
+            weight = sum(SIGNAL_WEIGHTS[name] for name, value in signals.items() if value is not None)
+            if not weight:
+                continue
+            score = sum(SIGNAL_WEIGHTS[name] * value for name, value in signals.items() if value is not None) / weight
+            if score >= self.min_score:
+                scored.append((score, candidate_id, signals))
+
+        scored.sort(key=lambda entry: -entry[0])
+        return [{
+            'item_id': candidate_id,
+            'score': round(score, 4),
+            'type': self._items[candidate_id]['type'],
+            'category': self._items[candidate_id]['categories'][0],
+            'title': self._items[candidate_id]['title'],
+            'user_id': self._items[candidate_id]['user_id'],
+            'signals': {name: None if value is None else round(value, 4) for name, value in signals.items()}
+        } for score, candidate_id, signals in scored[:self.top_k]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open_items': len(self._items),
+                'blocks': sum(1 for block in self._blocks.values() if block),
+                'window_days': self.window / 86400,
+                'top_k': self.top_k,
+                'min_score': self.min_score,
+                'last_add': self._last_blocking,
+                'log': self.log.path if self.log is not None else None
+            }
@@ -0,0 +1,384 @@
+"""
+Service metrics and per-request profiling
+Prometheus text exposition for /metrics without a client library, timing spans per processing
+stage, and an opt-in sampling profiler that keeps the stacks of the slowest requests
+"""
+
+import os
+import sys
+import time
+import heapq
+import bisect
+import resource
+import itertools
+import threading
+from contextlib import contextmanager
+
+
+# Seconds; covers a cache hit (sub-millisecond) to a cold CPU inference on a 12-MP photo
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+# Sampling profiler: off unless AI_PROFILE=1 (or switched on through POST /profile)
+PROFILE_ENABLED = os.environ.get('AI_PROFILE', '0') == '1'
+PROFILE_INTERVAL_MS = float(os.environ.get('AI_PROFILE_INTERVAL_MS', 5))
+PROFILE_SLOWEST = int(os.environ.get('AI_PROFILE_SLOWEST', 20))
+
+PROCESS_STARTED_AT = time.time()
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = (f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """One metric family; values are kept per tuple of label values"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_label_text(self.labels, key)} {_number(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Cumulative buckets, _sum and _count per label set, as Prometheus expects"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            for bound, cumulative in zip(self.buckets + (float('inf'),), itertools.accumulate(counts)):
+                labels = _label_text(self.labels + ('le',), key + (_number(float(bound)),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_label_text(self.labels, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_label_text(self.labels, key)} {count}')
+        return lines
+
+
+class Registry:
+    """
+    Metric families plus collectors: callables run at scrape time that return
+    [(name, kind, help, [(labels dict, value)])] for values owned by other objects.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"⚠ Metrics collector failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.extend([f'# HELP {name} {help}', f'# TYPE {name} {kind}'])
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f'{name}{_label_text(tuple(labels), tuple(labels.values()))} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = Counter('ai_requests_total', 'Requests handled, by route and status code', ('endpoint', 'status'))
+REQUEST_SECONDS = Histogram('ai_request_duration_seconds', 'Request latency, by route', ('endpoint',))
+IN_FLIGHT = Gauge('ai_requests_in_flight', 'Requests being handled, by route', ('endpoint',))
+STAGE_SECONDS = Histogram('ai_stage_duration_seconds',
+                          'Time per processing stage (decode, yolo_*, features, serialize, ...)', ('stage',))
+BATCH_SIZE = Histogram('ai_batch_size', 'Images per batched forward pass, by batcher', ('batcher',),
+                       buckets=BATCH_SIZE_BUCKETS)
+
+
+def rss_bytes():
+    """Current resident set size (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def process_metrics():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return [
+        ('process_resident_memory_bytes', 'gauge', 'Resident memory of this worker process', [({}, rss_bytes())]),
+        ('process_cpu_seconds_total', 'counter', 'User and system CPU time of this worker process',
+         [({}, round(usage.ru_utime + usage.ru_stime, 3))]),
+        ('process_start_time_seconds', 'gauge', 'Start time of this worker process (unix seconds)',
+         [({}, round(PROCESS_STARTED_AT, 3))]),
+        ('process_threads', 'gauge', 'Threads in this worker process', [({}, threading.active_count())]),
+        ('ai_worker_info', 'gauge', 'Always 1; the pid tells gunicorn workers apart', [({'pid': os.getpid()}, 1)])
+    ]
+
+
+REGISTRY.add_collector(process_metrics)
+
+
+# ---- spans ------------------------------------------------------------------------
+
+_local = threading.local()
+
+
+def record(stage, seconds):
+    """Count a stage duration measured elsewhere (e.g. ultralytics result.speed)"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans.append((stage, round(seconds * 1000, 3)))
+
+
+@contextmanager
+def span(stage):
+    """Time a block as one processing stage; also kept on the current request's trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+# ---- sampling profiler ------------------------------------------------------------
+
+def collapse(frame):
+    """Stack of a frame, root first, as one line of the folded flame-graph format"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    While enabled, a background thread samples the stack of every thread that is handling a
+    request every interval_ms. When a request ends its samples are kept if it is among the
+    slowest `keep` seen since the last reset; folded() dumps them for flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS, keep=PROFILE_SLOWEST, enabled=PROFILE_ENABLED):
+        self.interval = max(0.001, interval_ms / 1000.0)
+        self.keep = keep
+        self.enabled = enabled
+        self._active = {}
+        self._slowest = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+        self.samples = 0
+
+    def configure(self, enabled=None, keep=None, interval_ms=None, reset=False):
+        with self._lock:
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            if keep is not None:
+                self.keep = max(1, int(keep))
+                self._slowest = heapq.nlargest(self.keep, self._slowest)
+                heapq.heapify(self._slowest)
+            if interval_ms is not None:
+                self.interval = max(0.001, float(interval_ms) / 1000.0)
+            if reset:
+                self._slowest = []
+                self.samples = 0
+        return self.stats()
+
+    def begin(self, label):
+        """Start sampling the calling thread; returns a token for end() (None while disabled)"""
+        if not self.enabled:
+            return None
+        entry = {'label': label, 'started': time.time(), 'stacks': {}}
+        with self._lock:
+            self._ensure_thread()
+            self._active[threading.get_ident()] = entry
+        return entry
+
+    def end(self, entry, seconds, spans=None):
+        if entry is None:
+            return
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            entry['duration_ms'] = round(seconds * 1000, 2)
+            entry['spans'] = spans or []
+            item = (seconds, next(self._seq), entry)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, item)
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def _ensure_thread(self):
+        # Threads do not survive fork(), so each gunicorn worker starts its own sampler
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        self._thread = threading.Thread(target=self._loop, name='profiler', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while self.enabled:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, entry in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    stack = collapse(frame)
+                    entry['stacks'][stack] = entry['stacks'].get(stack, 0) + 1
+                    self.samples += 1
+                del frames
+
+    def slowest(self):
+        """Kept requests, slowest first"""
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._slowest, key=lambda item: -item[0])]
+
+    def folded(self):
+        """Folded stacks, one root per kept request ('<label> <ms>ms;frame;frame count')"""
+        lines = []
+        for entry in self.slowest():
+            root = f"{entry['label']} {entry['duration_ms']:.0f}ms".replace(';', ',')
+            for stack, count in sorted(entry['stacks'].items()):
+                lines.append(f'{root};{stack} {count}')
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'interval_ms': round(self.interval * 1000, 3),
+            'keep': self.keep,
+            'kept': len(self._slowest),
+            'samples': self.samples
+        }
+
+
+profiler = SamplingProfiler()
+
+
+# ---- Flask wiring -----------------------------------------------------------------
+
+def instrument(app, unprofiled=()):
+    """
+    Count, time and (when the profiler is on) sample every request of a Flask app, except
+    that routes in unprofiled are never sampled. Call before registering other before_request
+    hooks, so rejected requests are timed too.
+    """
+    from flask import g, request
+
+    def route():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_route = route()
+        g.metrics_started = time.perf_counter()
+        g.metrics_status = 500
+        IN_FLIGHT.inc(endpoint=g.metrics_route)
+        _local.spans = []
+        if g.metrics_route not in unprofiled:
+            g.metrics_profile = profiler.begin(f'{request.method} {g.metrics_route}')
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        endpoint = g.pop('metrics_route')
+        IN_FLIGHT.dec(endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=500 if exc is not None else g.pop('metrics_status', 500))
+        REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+        profiler.end(g.pop('metrics_profile', None), seconds, getattr(_local, 'spans', None))
+        _local.spans = None
@@ -0,0 +1,345 @@
+"""
+Model registry
+Known detector versions (model_versions columns + weights_path/variant), loaded on demand,
+hot-swapped in the background and evicted when idle or over the memory cap
+"""
+
+import os
+import csv
+import json
+import time
+import glob
+import hashlib
+import threading
+from datetime import datetime, timezone
+from ai_engine import AIEngine, DEFAULT_MODEL_PATH
+from result_cache import ResultCache
+
+
+REGISTRY_DIR = os.environ.get('AI_MODEL_REGISTRY_DIR', 'models')
+# Training output folders scanned for <run>/weights/best.pt (comma-separated)
+SCAN_DIRS = [d for d in os.environ.get('AI_MODEL_SCAN_DIRS', 'runs,../runs').split(',') if d]
+MEMORY_CAP_MB = float(os.environ.get('AI_MODEL_MEMORY_MB', 2048))
+IDLE_SECONDS = float(os.environ.get('AI_MODEL_IDLE_SECONDS', 900))
+
+# Resident memory of a loaded model relative to its weights file (fused copy, workspace)
+MEMORY_FACTOR = 3.0
+
+# Other processes (gunicorn workers) notice an activation within this many seconds
+ACTIVE_POLL_SECONDS = 1.0
+
+MODEL_FIELDS = ['id', 'version', 'accuracy', 'precision_score', 'recall_score', 'f1_score', 'sample_count',
+                'training_date', 'status', 'created_at', 'weights_path', 'variant']
+
+BUILTIN_MODELS = [
+    {'version': os.path.splitext(os.path.basename(DEFAULT_MODEL_PATH))[0], 'weights_path': DEFAULT_MODEL_PATH,
+     'variant': 'm', 'status': 'active'},
+    {'version': 'yolov8n', 'weights_path': 'yolov8n.pt', 'variant': 'n', 'status': 'available'}
+]
+
+
+def _entry(**fields):
+    """A model_versions row with every column present"""
+    entry = {field: None for field in MODEL_FIELDS}
+    entry.update(fields)
+    if not entry['id']:
+        entry['id'] = hashlib.sha1(f"{entry['version']}|{entry['weights_path']}".encode()).hexdigest()[:12]
+    return entry
+
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat()
+
+
+def _float(row, key):
+    try:
+        return float(row[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def read_training_metrics(results_csv):
+    """Final-epoch validation metrics from an ultralytics results.csv"""
+    try:
+        with open(results_csv, newline='') as f:
+            rows = [{k.strip(): v for k, v in row.items() if k} for row in csv.DictReader(f)]
+    except OSError:
+        return {}
+    if not rows:
+        return {}
+    last = rows[-1]
+    precision = _float(last, 'metrics/precision(B)')
+    recall = _float(last, 'metrics/recall(B)')
+    f1 = 2 * precision * recall / (precision + recall) if precision and recall else None
+    return {
+        'accuracy': _float(last, 'metrics/mAP50(B)'),
+        'precision_score': precision,
+        'recall_score': recall,
+        'f1_score': round(f1, 5) if f1 is not None else None
+    }
+
+
+def scan_training_runs(scan_dirs=SCAN_DIRS):
+    """Fine-tuned weights under <scan_dir>/**/weights/best.pt, named after their run folder"""
+    entries = []
+    for scan_dir in scan_dirs:
+        for weights in sorted(glob.glob(os.path.join(scan_dir, '**', 'weights', 'best.pt'), recursive=True)):
+            run_dir = os.path.dirname(os.path.dirname(weights))
+            modified = os.path.getmtime(weights)
+            entries.append(_entry(version=os.path.basename(run_dir), weights_path=weights, status='available',
+                                  training_date=_timestamp(modified), created_at=_timestamp(modified),
+                                  **read_training_metrics(os.path.join(run_dir, 'results.csv'))))
+    return entries
+
+
+def load_catalogue(registry_dir=REGISTRY_DIR, scan_dirs=SCAN_DIRS):
+    """Built-ins, <registry_dir>/models.json and the training output folders, by version name"""
+    entries = [_entry(**m) for m in BUILTIN_MODELS]
+    path = os.path.join(registry_dir, 'models.json')
+    try:
+        with open(path) as f:
+            entries += [_entry(**{k: v for k, v in m.items() if k in MODEL_FIELDS}) for m in json.load(f)]
+    except FileNotFoundError:
+        pass
+    except (ValueError, TypeError) as e:
+        print(f"⚠ Ignoring invalid {path}: {e}")
+    entries += scan_training_runs(scan_dirs)
+    # Later sources override earlier ones with the same version name
+    return {entry['version']: entry for entry in entries}
+
+
+def served_entry(registry_dir=REGISTRY_DIR, scan_dirs=SCAN_DIRS):
+    """Catalogue entry of the version the service currently serves (active.json, else status 'active')"""
+    entries = load_catalogue(registry_dir, scan_dirs)
+    try:
+        with open(os.path.join(registry_dir, 'active.json')) as f:
+            version = json.load(f).get('version')
+        if version in entries:
+            return entries[version]
+    except (OSError, ValueError):
+        pass
+    active = [e for e in entries.values() if e['status'] == 'active']
+    return active[-1] if active else next(iter(entries.values()))
+
+
+def register_version(registry_dir=REGISTRY_DIR, **fields):
+    """Append a model_versions row to <registry_dir>/models.json; /models/refresh picks it up"""
+    path = os.path.join(registry_dir, 'models.json')
+    try:
+        with open(path) as f:
+            models = json.load(f)
+    except FileNotFoundError:
+        models = []
+    entry = _entry(**fields)
+    models = [m for m in models if m.get('version') != entry['version']] + [entry]
+    os.makedirs(registry_dir, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(models, f, indent=2)
+    os.replace(tmp, path)
+    return entry
+
+
+class ModelRegistry:
+    """
+    Maps version names (or variants such as 'n' / 'm') to AIEngine instances, one
+    batcher per model. The active version lives in <registry_dir>/active.json so
+    every worker process switches together.
+    """
+
+    def __init__(self, registry_dir=REGISTRY_DIR, scan_dirs=SCAN_DIRS, lazy=True, warmup=False,
+                 memory_cap_mb=MEMORY_CAP_MB, idle_seconds=IDLE_SECONDS):
+        self.registry_dir = registry_dir
+        self.scan_dirs = scan_dirs
+        self.lazy = lazy
+        self.warmup = warmup
+        self.memory_cap = memory_cap_mb * 1024 * 1024
+        self.idle_seconds = idle_seconds
+        # Results are keyed by model version, so all engines can share one cache budget
+        self.cache = ResultCache()
+
+        self._entries = {}
+        self._engines = {}
+        self._last_used = {}
+        self._in_flight = {}
+        self._swaps = {}
+        self._lock = threading.RLock()
+        self._active_checked = 0.0
+        self._active_mtime = None
+        self.active_version = None
+
+        self.refresh()
+        self.active_version = self._read_active() or self._default_version()
+        self._load(self.active_version, background=lazy)
+
+    # ---- catalogue ---------------------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.registry_dir, name)
+
+    def refresh(self):
+        """Rebuild the catalogue from built-ins, models.json and the training output folders"""
+        entries = load_catalogue(self.registry_dir, self.scan_dirs)
+        with self._lock:
+            self._entries = entries
+        return self.entries()
+
+    def entries(self):
+        with self._lock:
+            return [dict(entry, status='active' if version == self.active_version else
+                         ('loaded' if version in self._engines else entry['status'] or 'available'))
+                    for version, entry in self._entries.items()]
+
+    def _default_version(self):
+        active = [v for v, e in self._entries.items() if e['status'] == 'active']
+        return active[-1] if active else next(iter(self._entries))
+
+    def resolve(self, name=None):
+        """Version name for a request: None -> active, else a version or a variant letter"""
+        with self._lock:
+            self._sync_active()
+            if not name:
+                return self.active_version
+            if name in self._entries:
+                return name
+            variants = [v for v, e in self._entries.items() if e['variant'] == name]
+            if variants:
+                return self.active_version if self.active_version in variants else variants[0]
+        raise KeyError(f"Unknown model '{name}'")
+
+    # ---- active version ---------------------------------------------------------
+
+    def _read_active(self):
+        try:
+            with open(self._path('active.json')) as f:
+                version = json.load(f).get('version')
+            self._active_mtime = os.path.getmtime(self._path('active.json'))
+        except (OSError, ValueError):
+            return None
+        return version if version in self._entries else None
+
+    def _sync_active(self):
+        """Follow activations made by other worker processes"""
+        now = time.monotonic()
+        if now - self._active_checked < ACTIVE_POLL_SECONDS:
+            return
+        self._active_checked = now
+        try:
+            mtime = os.path.getmtime(self._path('active.json'))
+        except OSError:
+            return
+        if mtime != self._active_mtime:
+            version = self._read_active()
+            if version and version != self.active_version:
+                self._start_swap(version, publish=False)
+
+    def activate(self, version):
+        """Load version in the background and make it the default once it is ready"""
+        version = self.resolve(version)
+        with self._lock:
+            if version == self.active_version:
+                return {'version': version, 'status': 'active'}
+            self._start_swap(version, publish=True)
+        return {'version': version, 'status': 'loading'}
+
+    def _start_swap(self, version, publish):
+        with self._lock:
+            if version in self._swaps:
+                return
+            engine = self._load(version, background=True)
+            self._swaps[version] = threading.Thread(target=self._swap_when_ready, args=(version, engine, publish),
+                                                    name=f'model-swap-{version}', daemon=True)
+            self._swaps[version].start()
+
+    def _swap_when_ready(self, version, engine, publish):
+        """Switch the default once the new engine is ready; publish tells the other workers"""
+        try:
+            engine.wait_until_ready()
+            if engine.state != 'ready':
+                print(f"⚠ Model {version} failed to load; keeping {self.active_version}")
+                return
+            if publish:
+                os.makedirs(self.registry_dir, exist_ok=True)
+                tmp = self._path('active.json.tmp')
+                with open(tmp, 'w') as f:
+                    json.dump({'version': version, 'activated_at': _timestamp(time.time())}, f)
+                os.replace(tmp, self._path('active.json'))
+            with self._lock:
+                # In-flight requests keep the engine they started with; new ones see the new version
+                self.active_version = version
+                if publish:
+                    self._active_mtime = os.path.getmtime(self._path('active.json'))
+            print(f"✓ Active model switched to {version}")
+        finally:
+            with self._lock:
+                self._swaps.pop(version, None)
+
+    # ---- loading and eviction ---------------------------------------------------
+
+    def _load(self, version, background):
+        with self._lock:
+            engine = self._engines.get(version)
+            if engine is None:
+                entry = self._entries[version]
+                engine = AIEngine(entry['weights_path'], load=False, cache=self.cache)
+                self._engines[version] = engine
+                if background:
+                    engine.start_loading(warmup=self.warmup)
+                else:
+                    engine.load_model()
+            self._last_used[version] = time.monotonic()
+        self._evict(keep=version)
+        return engine
+
+    def get(self, name=None):
+        """Engine for a model (loading it in the background if needed); KeyError if unknown"""
+        return self._load(self.resolve(name), background=True)
+
+    def acquire(self, name=None):
+        """get() that also pins the engine against eviction until release()"""
+        with self._lock:
+            version = self.resolve(name)
+            engine = self._load(version, background=True)
+            self._in_flight[version] = self._in_flight.get(version, 0) + 1
+        return version, engine
+
+    def release(self, version):
+        with self._lock:
+            self._in_flight[version] = max(0, self._in_flight.get(version, 0) - 1)
+            self._last_used[version] = time.monotonic()
+
+    def _footprint(self, version):
+        try:
+            return os.path.getsize(self._entries[version]['weights_path']) * MEMORY_FACTOR
+        except (KeyError, OSError):
+            return 0
+
+    def _evict(self, keep=None):
+        """Drop idle models, then least-recently-used ones while over the memory cap"""
+        with self._lock:
+            now = time.monotonic()
+            candidates = sorted((v for v in self._engines
+                                 if v not in (self.active_version, keep) and not self._in_flight.get(v)
+                                 and v not in self._swaps and self._engines[v].state != 'loading'),
+                                key=lambda v: self._last_used.get(v, 0))
+            total = sum(self._footprint(v) for v in self._engines)
+            for version in candidates:
+                idle = now - self._last_used.get(version, 0) > self.idle_seconds
+                if not idle and total <= self.memory_cap:
+                    continue
+                total -= self._footprint(version)
+                self._engines.pop(version).close()
+                print(f"Evicted model {version} ({'idle' if idle else 'memory cap'})")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self.active_version,
+                'loaded': {v: {'state': e.state, 'model_version': e.model_version,
+                               'in_flight': self._in_flight.get(v, 0),
+                               'memory_mb_estimate': round(self._footprint(v) / (1024 * 1024), 1),
+                               'batching': e.batcher.stats()}
+                           for v, e in self._engines.items()},
+                'memory_cap_mb': round(self.memory_cap / (1024 * 1024), 1),
+                'idle_seconds': self.idle_seconds
+            }
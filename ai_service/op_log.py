@@ -0,0 +1,86 @@
+"""
+Shared operation logs
+Append-only JSON-lines files that several preforked workers replay to keep in-memory state in step
+"""
+
+import os
+import json
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+
+class OpLog:
+    """
+    Append-only JSON-lines log of add/remove operations, shared by preforked workers.
+    Writers hold an flock; every process tails the file from its last offset, and
+    a rewrite (compaction) is noticed by the file's identity changing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._offset = 0
+        self._identity = None
+
+    def _writer_lock(self):
+        handle = open(self.path + '.lock', 'a')
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def read(self):
+        """(ops, reset): operations appended since the last call; reset means replay from scratch"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return [], False
+        identity = (stat.st_dev, stat.st_ino)
+        reset = identity != self._identity or stat.st_size < self._offset
+        if reset:
+            self._identity, self._offset = identity, 0
+
+        ops = []
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # partially written line
+                self._offset += len(line)
+                ops.append(json.loads(line))
+        return ops, reset
+
+    def append(self, op):
+        """Append op; returns (ops, reset) including anything other processes appended first"""
+        with self._writer_lock():
+            ops, reset = self.read()
+            with open(self.path, 'ab') as f:
+                f.write((json.dumps(op) + '\n').encode())
+                f.flush()
+                os.fsync(f.fileno())
+            stat = os.stat(self.path)
+            self._identity, self._offset = (stat.st_dev, stat.st_ino), stat.st_size
+            ops.append(op)
+            return ops, reset
+
+    def compact(self, apply, snapshot):
+        """
+        Replace the log atomically with snapshot(), the add ops of the live items. Under the
+        writer lock, ops other processes appended first go through apply(ops, reset) before the
+        snapshot is taken, so no concurrent add or remove is lost by the rewrite.
+        """
+        with self._writer_lock():
+            apply(*self.read())
+            ops = snapshot()
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                for op in ops:
+                    f.write((json.dumps(op) + '\n').encode())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            stat = os.stat(self.path)
+            self._identity, self._offset = (stat.st_dev, stat.st_ino), stat.st_size
+            return ops
@@ -0,0 +1,151 @@
+"""
+Perceptual image hashing
+Compact hashes that survive re-encoding, resizing and small edits
+"""
+
+from array import array
+import numpy as np
+import cv2
+
+
+def dhash(img, hash_size=8):
+    """Difference hash of an RGB array as a (hash_size * hash_size)-bit integer"""
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count('1')
+
+
+# Below this spread of low-frequency DCT terms an image is flat and its pHash is noise
+PHASH_MIN_SPREAD = 1.0
+
+
+def phash(img):
+    """
+    64-bit DCT hash of an RGB array: the 8x8 lowest frequencies of a 32x32 thumbnail above their
+    median. None for flat images (blank frames, solid colours), which would all collide.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    if np.ptp(low.ravel()[1:]) < PHASH_MIN_SPREAD:
+        return None
+    bits = (low > np.median(low)).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+# Set bits per byte value, for popcounts over uint64 arrays
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def hamming_many(values, query):
+    """Hamming distance from query to each value of a uint64 array"""
+    diff = np.bitwise_xor(values, np.uint64(query))
+    return _POPCOUNT8[diff.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int32)
+
+
+class HammingIndex:
+    """
+    Multi-index hashing over 64-bit hashes (Norouzi et al.). Each hash is split into four
+    16-bit chunks with one table per chunk. Two hashes within distance r agree to within
+    r // 4 bits on at least one chunk, so a query probes only the buckets that close to its
+    own chunks and verifies the few rows found with a vectorised popcount.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+    # Replaced and removed rows are tombstones; the tables are rebuilt once there are this many
+    # and at least as many as live rows, so re-hashing the same keys cannot grow them without bound
+    COMPACT_MIN_DEAD = 1000
+
+    def __init__(self):
+        self._probe_masks = {}
+        self._clear()
+
+    def _clear(self):
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._live = np.zeros(1024, dtype=bool)
+        self._keys = []
+        self._rows = {}
+        self._tables = [{} for _ in range(self.CHUNKS)]
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _chunks(self, value):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (self.CHUNK_BITS * i)) & mask for i in range(self.CHUNKS)]
+
+    def _masks(self, radius):
+        """XOR masks of every 16-bit pattern with at most radius bits set"""
+        masks = self._probe_masks.get(radius)
+        if masks is None:
+            masks = [m for m in range(1 << self.CHUNK_BITS) if bin(m).count('1') <= radius]
+            self._probe_masks[radius] = masks
+        return masks
+
+    def add(self, key, value):
+        """Insert or replace the hash stored for key"""
+        row = self._rows.get(key)
+        if row is not None and int(self._hashes[row]) == value:
+            return
+        self.remove(key)
+        row = len(self._keys)
+        if row == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros(row, dtype=np.uint64)])
+            self._live = np.concatenate([self._live, np.zeros(row, dtype=bool)])
+        self._hashes[row] = value
+        self._live[row] = True
+        self._keys.append(key)
+        self._rows[key] = row
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            bucket = table.get(chunk)
+            if bucket is None:
+                table[chunk] = bucket = array('I')
+            bucket.append(row)
+
+    def remove(self, key):
+        """Tombstone key's row; False if key is not indexed"""
+        row = self._rows.pop(key, None)
+        if row is None:
+            return False
+        self._live[row] = False
+        self._dead += 1
+        if self._dead >= max(self.COMPACT_MIN_DEAD, len(self._rows)):
+            self.compact()
+        return True
+
+    def compact(self):
+        """Rebuild the rows and tables from the live hashes only"""
+        live = [(key, int(self._hashes[row])) for key, row in self._rows.items()]
+        self._clear()
+        for key, value in live:
+            self.add(key, value)
+
+    def search(self, value, max_distance):
+        """[(key, distance)] of every hash within max_distance bits, nearest first"""
+        masks = self._masks(max_distance // self.CHUNKS)
+        buckets = []
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if bucket is not None:
+                    buckets.append(np.frombuffer(bucket, dtype=np.uint32))
+        if not buckets:
+            return []
+        rows = np.unique(np.concatenate(buckets))
+        rows = rows[self._live[rows]]
+        distances = hamming_many(self._hashes[rows], value)
+        near = np.flatnonzero(distances <= max_distance)
+        near = near[np.argsort(distances[near], kind='stable')]
+        return [(self._keys[rows[i]], int(distances[i])) for i in near]
+
+    def stats(self):
+        return {'size': len(self._rows), 'rows': len(self._keys), 'dead': self._dead,
+                'buckets': sum(len(table) for table in self._tables)}
@@ -0,0 +1,196 @@
+"""
+Content-addressed result cache
+LRU + TTL cache of inference results keyed on image bytes and model version
+"""
+
+import io
+import os
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+DEFAULT_MAX_BYTES = int(os.environ.get('AI_CACHE_MAX_MB', 64)) * 1024 * 1024
+DEFAULT_TTL_SECONDS = float(os.environ.get('AI_CACHE_TTL_SECONDS', 3600))
+DEFAULT_DISK_DIR = os.environ.get('AI_CACHE_DIR') or None
+DEFAULT_USE_PHASH = os.environ.get('AI_CACHE_PHASH', '0') == '1'
+
+
+HASH_CHUNK = 1024 * 1024
+
+
+def content_hash(data):
+    """SHA-256 of the raw uploaded bytes; streams are hashed in place and rewound"""
+    if not hasattr(data, 'read'):
+        return hashlib.sha256(data).hexdigest()
+
+    digest = hashlib.sha256()
+    position = data.tell()
+    if isinstance(data, io.BytesIO):
+        with data.getbuffer() as view:
+            digest.update(view[position:])
+    else:
+        for chunk in iter(lambda: data.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    data.seek(position)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """In-memory LRU with per-entry TTL, a byte budget and an optional disk tier"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 disk_dir=DEFAULT_DISK_DIR, use_phash=DEFAULT_USE_PHASH):
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.disk_dir = disk_dir
+        self.use_phash = use_phash
+
+        self._entries = OrderedDict()   # key -> (expires_at, size, payload)
+        self._phash_keys = {}           # (model_version, phash) -> key
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.phash_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model_version, digest):
+        """The model version is part of every key so a swap never serves stale results"""
+        return f'{model_version}:{digest}'
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        value, tier = self._lookup(key)
+        with self._lock:
+            if tier == 'memory':
+                self.hits += 1
+            elif tier == 'disk':
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        return value
+
+    def get_by_phash(self, model_version, phash):
+        """Look up a result stored for a perceptually identical image"""
+        with self._lock:
+            key = self._phash_keys.get((model_version, phash))
+        if key is None:
+            return None
+        value, tier = self._lookup(key)
+        if value is not None:
+            # The byte-level lookup already counted a miss that this rescued
+            with self._lock:
+                self.phash_hits += 1
+                self.misses -= 1
+        return value
+
+    def _lookup(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return pickle.loads(entry[2]), 'memory'
+                self._drop(key)
+                self.expired += 1
+
+        value = self._disk_get(key, now)
+        if value is None:
+            return None, None
+        self.put(key, value, write_through=False)
+        return value, 'disk'
+
+    def put(self, key, value, phash=None, model_version=None, write_through=True):
+        """Store value under key, evicting least recently used entries over budget"""
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        expires_at = time.time() + self.ttl
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires_at, size, payload)
+            self._bytes += size
+            if phash is not None and model_version is not None:
+                self._phash_keys[(model_version, phash)] = key
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+        if write_through:
+            self._disk_put(key, expires_at, payload)
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        if len(self._phash_keys) > len(self._entries) * 2:
+            live = self._entries.keys()
+            self._phash_keys = {k: v for k, v in self._phash_keys.items() if v in live}
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode()).hexdigest() + '.pkl')
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, expires_at, payload = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading cache entry {path}: {str(e)}")
+            return None
+        if stored_key != key or expires_at <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return pickle.loads(payload)
+
+    def _disk_put(self, key, expires_at, payload):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((key, expires_at, payload), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing cache entry {path}: {str(e)}")
+
+    def stats(self):
+        """Hit/miss counters and memory usage"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'phash_hits': self.phash_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0,
+                'disk_tier': bool(self.disk_dir),
+                'phash': self.use_phash
+            }
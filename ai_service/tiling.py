@@ -0,0 +1,94 @@
+"""
+Sliced (tiled) inference
+Small items in large photos are cut into overlapping model-sized tiles, detected in the
+same batch as the whole image, and merged back into image coordinates
+"""
+
+import math
+import os
+import numpy as np
+from backends import nms
+
+
+# 'off', 'auto' (tile only images much larger than the model input) or 'on'
+TILING_MODES = ('off', 'auto', 'on')
+TILING_MODE = os.environ.get('AI_TILING', 'off')
+
+# Tile side in decoded pixels; the detector sees each tile at (about) its native size
+TILE_SIZE = int(os.environ.get('AI_TILE_SIZE', 640))
+TILE_OVERLAP = float(os.environ.get('AI_TILE_OVERLAP', 0.2))
+# Tiles per image on top of the whole-image pass; keeps tiles + 1 within one micro-batch
+MAX_TILES = int(os.environ.get('AI_MAX_TILES', 6))
+# 'auto' tiles when the original image is at least this many times the model input
+TILE_MIN_RATIO = float(os.environ.get('AI_TILE_MIN_RATIO', 2.0))
+# Uploads are decoded up to this side when tiling may apply (instead of ~640)
+TILE_DECODE_SIDE = int(os.environ.get('AI_TILE_DECODE_SIDE', 1920))
+
+# A box covering this much of a smaller same-class box absorbs it
+MERGE_IOS = 0.6
+
+# Tiles grow by this factor until the grid fits in MAX_TILES
+TILE_GROWTH = 1.15
+
+
+def should_tile(mode, original_side, input_size=TILE_SIZE):
+    """Whether an upload whose longest original side is original_side gets tiled"""
+    if mode == 'on':
+        return True
+    return mode == 'auto' and original_side >= TILE_MIN_RATIO * input_size
+
+
+def _starts(length, tile, count):
+    """count evenly spaced tile origins covering [0, length)"""
+    if count <= 1:
+        return [0]
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def tile_windows(shape, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=MAX_TILES):
+    """
+    Overlapping (x0, y0, x1, y1) windows covering an image of shape (h, w).
+    Tiles are enlarged (and so downscaled by the detector) rather than exceed max_tiles.
+    Returns [] when a single tile would cover the image.
+    """
+    h, w = shape[:2]
+    tile = float(tile_size)
+    while True:
+        if tile >= max(h, w):
+            return []
+        side = int(round(tile))
+        stride = side * (1 - overlap)
+        cols = 1 if w <= side else math.ceil((w - side) / stride) + 1
+        rows = 1 if h <= side else math.ceil((h - side) / stride) + 1
+        if cols * rows <= max_tiles:
+            break
+        tile *= TILE_GROWTH
+
+    tile_w, tile_h = min(side, w), min(side, h)
+    return [(x, y, x + tile_w, y + tile_h)
+            for y in _starts(h, tile_h, rows) for x in _starts(w, tile_w, cols)]
+
+
+def merge_tiles(full_raw, tile_raws, windows, ios_threshold=MERGE_IOS):
+    """
+    Shift tile detections into image coordinates and merge them with the
+    whole-image detections, class by class (a whole object suppresses its tile fragments).
+    """
+    boxes = [full_raw['boxes']]
+    scores = [full_raw['scores']]
+    class_ids = [full_raw['class_ids']]
+    for raw, (x0, y0, _, _) in zip(tile_raws, windows):
+        boxes.append(raw['boxes'] + np.array([x0, y0, x0, y0], dtype=np.float32))
+        scores.append(raw['scores'])
+        class_ids.append(raw['class_ids'])
+
+    boxes = np.concatenate(boxes).astype(np.float32)
+    scores = np.concatenate(scores).astype(np.float32)
+    class_ids = np.concatenate(class_ids).astype(np.int32)
+    if len(boxes) == 0:
+        return {'boxes': boxes, 'scores': scores, 'class_ids': class_ids}
+
+    # Offset each class past the largest coordinate so NMS never compares across classes
+    offsets = class_ids[:, None].astype(np.float32) * (float(boxes.max()) + 1)
+    kept = nms(boxes + offsets, scores, ios_threshold, metric='ios')
+    return {'boxes': boxes[kept], 'scores': scores[kept], 'class_ids': class_ids[kept]}
@@ -0,0 +1,301 @@
+"""
+In-process vector similarity index
+Brute-force float32 matmul for small sets, IVF (k-means inverted lists) past a size threshold
+"""
+
+import os
+import threading
+import numpy as np
+from embedding_store import MemoryStore
+
+
+DEFAULT_ANN_THRESHOLD = int(os.environ.get('AI_INDEX_ANN_THRESHOLD', 20000))
+DEFAULT_NPROBE = int(os.environ.get('AI_INDEX_NPROBE', 8))
+
+# Compact once this fraction of rows are tombstones
+DEFAULT_COMPACT_RATIO = float(os.environ.get('AI_INDEX_COMPACT_RATIO', 0.25))
+COMPACT_MIN_DEAD = 256
+
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 50000
+ASSIGN_CHUNK = 65536
+
+
+def _kmeans(vectors, k, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on normalized vectors; returns (k, dim) centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(k):
+            members = vectors[assign == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+            else:
+                centroids[c] = vectors[rng.integers(len(vectors))]
+    return centroids
+
+
+class VectorIndex:
+    """
+    Cosine-similarity index over L2-normalized vectors with category/type filters.
+    Rows live in a store (MemoryStore, or the mmap-backed EmbeddingStore); removals
+    are tombstones that a background compaction eventually drops.
+    """
+
+    def __init__(self, store=None, ann_threshold=DEFAULT_ANN_THRESHOLD, nprobe=DEFAULT_NPROBE,
+                 compact_ratio=DEFAULT_COMPACT_RATIO):
+        self.store = store if store is not None else MemoryStore()
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self.compact_ratio = compact_ratio
+
+        self._labels = {}
+        self._label_names = []
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._reset()
+        self.sync()
+
+    def _reset(self):
+        self._matrix = self.store.matrix()
+        self._count = 0
+        self._size = 0
+        self._ids = []
+        self._rows = {}
+        self._live = np.zeros(0, dtype=bool)
+        self._categories = np.zeros(0, dtype=np.int32)
+        self._types = np.zeros(0, dtype=np.int32)
+
+        # IVF state, built once the index outgrows brute force
+        self._centroids = None
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._lists = []
+        self._pending_assign = []
+        self._trained_size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def dim(self):
+        return self.store.dim
+
+    def _label(self, name):
+        code = self._labels.get(name)
+        if code is None:
+            code = len(self._label_names)
+            self._labels[name] = code
+            self._label_names.append(name)
+        return code
+
+    def _grow(self, needed):
+        capacity = len(self._live)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        for attr in ('_live', '_categories', '_types', '_assign'):
+            old = getattr(self, attr)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._count] = old[:self._count]
+            setattr(self, attr, new)
+
+    def _apply(self, ops, reset):
+        """Mirror store operations into the in-memory row metadata"""
+        if reset:
+            self._reset()
+        for op in ops:
+            row = op['row']
+            if op['op'] == 'add':
+                self._grow(row + 1)
+                self._ids.extend([None] * (row + 1 - len(self._ids)))
+                previous = self._rows.get(op['id'])
+                if previous is not None:
+                    self._kill(previous)
+                self._ids[row] = op['id']
+                self._rows[op['id']] = row
+                self._live[row] = True
+                self._categories[row] = self._label(op.get('category'))
+                self._types[row] = self._label(op.get('type'))
+                self._count = max(self._count, row + 1)
+                self._size += 1
+                if self._centroids is not None:
+                    self._pending_assign.append(row)
+            elif row < self._count and self._live[row]:
+                if self._rows.get(self._ids[row]) == row:
+                    del self._rows[self._ids[row]]
+                self._kill(row)
+
+        if ops or reset:
+            self._matrix = self.store.matrix()
+            self._assign_pending()
+            self._maybe_train()
+
+    def _kill(self, row):
+        self._live[row] = False
+        self._size -= 1
+        if self._centroids is not None:
+            self._lists[self._assign[row]].discard(row)
+
+    def _assign_pending(self):
+        pending, self._pending_assign = self._pending_assign, []
+        if self._centroids is None or not pending:
+            return
+        rows = np.asarray(pending)
+        cells = np.argmax(self._matrix[rows] @ self._centroids.T, axis=1)
+        for row, cell in zip(pending, cells.tolist()):
+            if self._live[row]:
+                self._assign[row] = cell
+                self._lists[cell].add(row)
+
+    def sync(self):
+        """Pick up rows appended or removed by other processes sharing the store"""
+        with self._lock:
+            self._apply(*self.store.sync())
+
+    def add(self, item_id, vector, category=None, item_type=None):
+        """Insert or replace the vector stored for item_id"""
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+        with self._lock:
+            previous = self._rows.get(item_id)
+            ops, reset = self.store.append(vector, item_id, category, item_type)
+            if previous is not None and not reset:
+                ops += self.store.tombstone(previous)[0]
+            self._apply(ops, reset)
+        self._maybe_compact()
+
+    def remove(self, item_id):
+        """Delete item_id; returns False if it was not indexed"""
+        with self._lock:
+            self.sync()
+            row = self._rows.get(item_id)
+            if row is None:
+                return False
+            self._apply(*self.store.tombstone(row))
+        self._maybe_compact()
+        return True
+
+    def _maybe_compact(self):
+        dead = self._count - self._size
+        if self._compacting or dead < COMPACT_MIN_DEAD or dead < self.compact_ratio * self._count:
+            return
+        self._compacting = True
+        threading.Thread(target=self.compact, name='index-compaction', daemon=True).start()
+
+    def compact(self):
+        """Rewrite the store without tombstones and rebuild row metadata"""
+        try:
+            # Row numbers change, so appends must not interleave with the rewrite
+            with self._lock:
+                self._apply(*self.store.compact())
+        except Exception as e:
+            print(f"Error compacting index: {str(e)}")
+        finally:
+            self._compacting = False
+
+    def _maybe_train(self):
+        # (Re)build the inverted lists when crossing the threshold and whenever the index doubles
+        if self._size < self.ann_threshold or self._size < 2 * max(self._trained_size, self.ann_threshold // 2):
+            return
+        self.train()
+
+    def train(self):
+        """Cluster the live vectors into sqrt(n) inverted lists"""
+        with self._lock:
+            live_rows = np.flatnonzero(self._live[:self._count])
+            n = len(live_rows)
+            if n == 0:
+                return
+            nlist = max(1, int(np.sqrt(n)))
+            sample_rows = live_rows
+            if n > KMEANS_SAMPLE:
+                sample_rows = np.sort(np.random.default_rng(0).choice(live_rows, KMEANS_SAMPLE, replace=False))
+            self._centroids = _kmeans(np.asarray(self._matrix[sample_rows]), min(nlist, len(sample_rows)))
+            self._lists = [set() for _ in range(len(self._centroids))]
+            for start in range(0, n, ASSIGN_CHUNK):
+                rows = live_rows[start:start + ASSIGN_CHUNK]
+                cells = np.argmax(self._matrix[rows] @ self._centroids.T, axis=1)
+                self._assign[rows] = cells
+                for row, cell in zip(rows.tolist(), cells.tolist()):
+                    self._lists[cell].add(row)
+            self._pending_assign = []
+            self._trained_size = n
+
+    def search(self, vector, k=10, category=None, item_type=None):
+        """Return the top-k matches as dicts, optionally filtered by category and type"""
+        query = np.asarray(vector, dtype=np.float32).ravel()
+        with self._lock:
+            self.sync()
+            if self._size == 0:
+                return []
+            if query.shape[0] != self.dim:
+                raise ValueError(f'Expected a {self.dim}-d vector, got {query.shape[0]}-d')
+            query = query / max(np.linalg.norm(query), 1e-12)
+
+            n = self._count
+            mask = self._live[:n].copy()
+            if category is not None:
+                mask &= self._categories[:n] == self._labels.get(category, -1)
+            if item_type is not None:
+                mask &= self._types[:n] == self._labels.get(item_type, -1)
+
+            if self._centroids is not None:
+                cells = np.argsort(-(self._centroids @ query))[:self.nprobe]
+                rows = np.fromiter((r for c in cells for r in self._lists[c]), dtype=np.int64)
+                rows = rows[mask[rows]]
+                scores = self._matrix[rows] @ query
+            else:
+                rows = np.flatnonzero(mask)
+                # A dense scan beats a gather when most rows survive the filter
+                if len(rows) > n // 2:
+                    scores = (self._matrix[:n] @ query)[rows]
+                else:
+                    scores = self._matrix[rows] @ query
+
+            if len(rows) == 0:
+                return []
+            k = min(k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            return [{
+                'item_id': self._ids[rows[i]],
+                'score': float(scores[i]),
+                'category': self._label_names[self._categories[rows[i]]],
+                'type': self._label_names[self._types[rows[i]]]
+            } for i in top]
+
+    def similarities(self, vector, item_ids):
+        """Cosine similarity of vector to each of item_ids; NaN where an id is not indexed"""
+        query = np.asarray(vector, dtype=np.float32).ravel()
+        with self._lock:
+            self.sync()
+            scores = np.full(len(item_ids), np.nan, dtype=np.float32)
+            if self._size == 0 or query.shape[0] != self.dim:
+                return scores
+            query = query / max(np.linalg.norm(query), 1e-12)
+            slots, rows = [], []
+            for i, item_id in enumerate(item_ids):
+                row = self._rows.get(item_id)
+                if row is not None:
+                    slots.append(i)
+                    rows.append(row)
+            if rows:
+                scores[slots] = self._matrix[np.asarray(rows)] @ query
+            return scores
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self._size,
+                'tombstones': self._count - self._size,
+                'dim': self.dim,
+                'mode': 'ivf' if self._centroids is not None else 'brute_force',
+                'ann_threshold': self.ann_threshold,
+                'nlist': len(self._lists),
+                'nprobe': self.nprobe,
+                'store': self.store.stats()
+            }
@@ -0,0 +1,399 @@
+"""
+Multi-frame capture: one inventory of items from a video or a stream of frames
+Near-identical frames are dropped by a dHash gate, keyframes share batched forward passes,
+and an IoU tracker (compensating camera pans) merges sightings of the same object, also
+when the camera comes back to it after it left the frame
+"""
+
+import os
+import math
+import time
+import struct
+import tempfile
+import numpy as np
+import cv2
+from image_io import ImageRejected, MAX_UPLOAD_BYTES, DECODE_TARGET_SIDE, decode_image, crop_jpeg
+from perceptual_hash import dhash, hamming
+from color_features import analyze_features
+from ai_engine import DETECT_CONFIDENCE, CROP_MAX_SIDE
+from metrics import span
+
+
+# Frames taken from a video per second of footage (a phone pan needs a few, not 30)
+SAMPLE_FPS = float(os.environ.get('AI_VIDEO_SAMPLE_FPS', 6))
+# A frame whose dHash is this close to the last keyframe's adds nothing and is skipped
+GATE_DISTANCE = int(os.environ.get('AI_VIDEO_GATE_DISTANCE', 4))
+# Keyframes queued together, so they share forward passes
+KEYFRAME_BATCH = int(os.environ.get('AI_VIDEO_BATCH', 8))
+# Sampled frames per request; the rest of a longer clip is ignored (truncated: true)
+MAX_FRAMES = int(os.environ.get('AI_VIDEO_MAX_FRAMES', 600))
+MAX_VIDEO_BYTES = int(os.environ.get('AI_MAX_VIDEO_MB', 200)) * 1024 * 1024
+# Items kept per inventory; beyond it the least certain ones are dropped
+MAX_ITEMS = int(os.environ.get('AI_VIDEO_MAX_ITEMS', 100))
+
+# A detection continues a track when their boxes (after camera motion) overlap this much
+TRACK_IOU = 0.3
+# Keyframes a track may go unseen before it is closed
+TRACK_MAX_AGE = 3
+# Sightings needed for an item; a one-keyframe detection is usually noise
+MIN_TRACK_HITS = 2
+
+# Width of the grayscale thumbnails used to estimate camera motion between keyframes
+MOTION_WIDTH = 160
+# Below this phase-correlation peak the shift estimate is unreliable and ignored
+MOTION_MIN_RESPONSE = 0.1
+
+# Length-prefixed frame stream: each frame is a 4-byte big-endian length, then an encoded image
+FRAME_STREAM_MIMETYPE = 'application/x-frame-stream'
+FRAME_HEADER = struct.Struct('>I')
+
+CHUNK_BYTES = 1024 * 1024
+
+
+def spool_upload(stream, suffix='', max_bytes=MAX_VIDEO_BYTES):
+    """
+    Copy an upload to a temporary file in chunks (containers such as MP4 need seeking to decode).
+    Returns the path; the caller deletes it.
+    """
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        total = 0
+        try:
+            while True:
+                chunk = stream.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    raise ImageRejected(f'Video exceeds {max_bytes // (1024 * 1024)} MB')
+                f.write(chunk)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    if not total:
+        os.unlink(f.name)
+        raise ImageRejected('Empty video', status_code=400)
+    return f.name
+
+
+def _shrink(bgr, target_side):
+    """BGR video frame -> (RGB array with longest side at most target_side, scale to original)"""
+    h, w = bgr.shape[:2]
+    scale = max(h, w) / target_side if target_side and max(h, w) > target_side else 1.0
+    if scale > 1.0:
+        bgr = cv2.resize(bgr, (max(1, round(w / scale)), max(1, round(h / scale))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), scale
+
+
+def video_frames(path, sample_fps=SAMPLE_FPS, target_side=DECODE_TARGET_SIDE):
+    """
+    (frame number, seconds, RGB array, scale) for sample_fps frames per second of a video file.
+    Frames in between are grabbed but never decoded to pixels.
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        capture.release()
+        raise ImageRejected('Not a readable video', status_code=400)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    fps = fps if 0 < fps <= 240 else 30.0  # unknown or bogus rates: assume a phone's
+    step = max(1, round(fps / sample_fps)) if sample_fps > 0 else 1
+    n = 0
+    try:
+        while capture.grab():
+            if n % step == 0:
+                ok, bgr = capture.retrieve()
+                if ok:
+                    img, scale = _shrink(bgr, target_side)
+                    yield n, round(n / fps, 3), img, scale
+            n += 1
+    finally:
+        capture.release()
+
+
+def _read_exact(stream, size):
+    parts = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        parts.append(chunk)
+        size -= len(chunk)
+    return b''.join(parts)
+
+
+def stream_frames(stream, fps=None, target_side=DECODE_TARGET_SIDE):
+    """
+    (frame number, seconds or None, RGB array, scale) per frame of a length-prefixed stream,
+    decoded as it arrives, so a chunked upload is processed while it is still being sent
+    """
+    n = 0
+    while True:
+        header = _read_exact(stream, FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < FRAME_HEADER.size:
+            raise ImageRejected('Truncated frame header', status_code=400)
+        (length,) = FRAME_HEADER.unpack(header)
+        if length > MAX_UPLOAD_BYTES:
+            raise ImageRejected(f'Frame exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB')
+        data = _read_exact(stream, length)
+        if len(data) < length:
+            raise ImageRejected('Truncated frame', status_code=400)
+        img, scale = decode_image(data, target_side)
+        yield n, round(n / fps, 3) if fps else None, img, scale
+        n += 1
+
+
+def iou_matrix(a, b):
+    """Pairwise IoU of two (n, 4) and (m, 4) xyxy box arrays"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def crop_quality(detection, frame_shape, scale):
+    """
+    How good a crop a detection makes: confidence, favouring larger boxes and
+    penalising boxes cut by the frame edge (the object is probably partly outside)
+    """
+    h, w = frame_shape[:2]
+    width, height = w * scale, h * scale
+    x1, y1, x2, y2 = detection['bbox']
+    area = max(0, x2 - x1) * max(0, y2 - y1) / (width * height)
+    quality = detection['confidence'] * min(1.0, math.sqrt(area) / 0.5)
+    margin = 0.01 * max(width, height)
+    if x1 <= margin or y1 <= margin or x2 >= width - margin or y2 >= height - margin:
+        quality *= 0.5
+    return quality
+
+
+class VideoInventory:
+    """
+    Consumes frames, keeps one track per physical object and returns the merged inventory.
+    Memory is bounded by the keyframe batch, the open tracks and MAX_ITEMS closed ones
+    (each holding one small JPEG crop), however long the clip.
+    """
+
+    def __init__(self, engine, gate_distance=GATE_DISTANCE, batch_size=KEYFRAME_BATCH,
+                 max_frames=MAX_FRAMES, max_items=MAX_ITEMS, threshold=DETECT_CONFIDENCE):
+        self.engine = engine
+        self.gate_distance = gate_distance
+        self.batch_size = max(1, batch_size)
+        self.max_frames = max_frames
+        self.max_items = max_items
+        self.threshold = threshold
+
+        self._tracks = []
+        self._closed = []
+        self._next_id = 0
+        self._last_hash = None
+        self._last_motion = None
+        # Content shift accumulated over all keyframes: scene position = frame position - offset
+        self._offset = (0.0, 0.0)
+        self.frames = {'sampled': 0, 'skipped': 0, 'keyframes': 0, 'truncated': False}
+        self.duration = None
+        self.fallback = False
+
+    def consume(self, frames):
+        """Run a frame iterator through the gate, the detector and the tracker"""
+        pending = []
+        for frame in frames:
+            if self.frames['sampled'] >= self.max_frames:
+                self.frames['truncated'] = True
+                break
+            self.frames['sampled'] += 1
+            if frame[1] is not None:
+                self.duration = frame[1]
+            with span('video_gate'):
+                value = dhash(frame[2])
+            if self._last_hash is not None and hamming(value, self._last_hash) <= self.gate_distance:
+                self.frames['skipped'] += 1
+                continue
+            self._last_hash = value
+            pending.append(frame)
+            if len(pending) >= self.batch_size:
+                self._detect(pending)
+                pending = []
+        if pending:
+            self._detect(pending)
+
+    def _detect(self, frames):
+        raws = self.engine.analyze_many([img for _, _, img, _ in frames], with_features=False,
+                                        scales=[scale for *_, scale in frames])
+        self.frames['keyframes'] += len(frames)
+        with span('video_track'):
+            for frame, raw in zip(frames, raws):
+                self.fallback = self.fallback or raw['fallback']
+                # Fallback detections are fixed boxes that do not move with the scene
+                self._update(frame, self.engine.detections(raw, self.threshold), compensate=not raw['fallback'])
+
+    def _camera_shift(self, img, scale):
+        """Content shift since the previous keyframe, in original pixels (phase correlation)"""
+        h, w = img.shape[:2]
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        small = cv2.resize(gray, (MOTION_WIDTH, max(1, round(h * MOTION_WIDTH / w))),
+                           interpolation=cv2.INTER_AREA).astype(np.float32)
+        previous, self._last_motion = self._last_motion, small
+        if previous is None or previous.shape != small.shape:
+            return 0.0, 0.0
+        window = cv2.createHanningWindow(small.shape[::-1], cv2.CV_32F)
+        (dx, dy), response = cv2.phaseCorrelate(previous, small, window)
+        if response < MOTION_MIN_RESPONSE:
+            return 0.0, 0.0
+        factor = w / MOTION_WIDTH * scale
+        return dx * factor, dy * factor
+
+    def _update(self, frame, detections, compensate=True):
+        n, seconds, img, scale = frame
+        dx, dy = self._camera_shift(img, scale) if compensate else (0.0, 0.0)
+        self._offset = (self._offset[0] + dx, self._offset[1] + dy)
+        for track in self._tracks:
+            x1, y1, x2, y2 = track['bbox']
+            track['bbox'] = [x1 + dx, y1 + dy, x2 + dx, y2 + dy]
+
+        matched = set()
+        if self._tracks and detections:
+            overlap = iou_matrix(np.asarray([t['bbox'] for t in self._tracks], dtype=np.float64),
+                                 np.asarray([d['bbox'] for d in detections], dtype=np.float64))
+            # Detector labels flicker between related classes; the category has to agree
+            for i, track in enumerate(self._tracks):
+                for j, detection in enumerate(detections):
+                    if track['category'] != detection['category']:
+                        overlap[i, j] = 0
+            # Greedy assignment, best overlap first
+            for flat in np.argsort(-overlap, axis=None):
+                i, j = divmod(int(flat), overlap.shape[1])
+                if overlap[i, j] < TRACK_IOU:
+                    break
+                track = self._tracks[i]
+                if track['last_frame'] == n or j in matched:
+                    continue
+                matched.add(j)
+                self._extend(track, detections[j], frame)
+
+        for j, detection in enumerate(detections):
+            if j in matched:
+                continue
+            track = self._reopen(detection)
+            if track is not None:
+                self._extend(track, detection, frame)
+                self._tracks.append(track)
+            else:
+                self._tracks.append(self._start(detection, frame))
+
+        still_open = []
+        for track in self._tracks:
+            if track['last_frame'] != n:
+                track['missed'] += 1
+            if track['missed'] > TRACK_MAX_AGE:
+                self._close(track, MIN_TRACK_HITS)
+            else:
+                still_open.append(track)
+        self._tracks = still_open
+
+    def _scene_box(self, bbox):
+        ox, oy = self._offset
+        return [bbox[0] - ox, bbox[1] - oy, bbox[2] - ox, bbox[3] - oy]
+
+    def _reopen(self, detection):
+        """Closed track of the same category at the detection's scene position (the camera came back)"""
+        candidates = [t for t in self._closed if t['category'] == detection['category']]
+        if not candidates:
+            return None
+        overlap = iou_matrix(np.asarray([self._scene_box(detection['bbox'])], dtype=np.float64),
+                             np.asarray([t['scene_bbox'] for t in candidates], dtype=np.float64))[0]
+        best = int(np.argmax(overlap))
+        if overlap[best] < TRACK_IOU:
+            return None
+        self._closed.remove(candidates[best])
+        return candidates[best]
+
+    def _start(self, detection, frame):
+        n, seconds, img, scale = frame
+        self._next_id += 1
+        track = {
+            'id': self._next_id, 'category': detection['category'], 'classes': {},
+            'bbox': [float(v) for v in detection['bbox']], 'hits': 0, 'missed': 0,
+            'confidence': 0.0, 'confidence_sum': 0.0, 'first_frame': n, 'first_seen': seconds,
+            'last_frame': n, 'last_seen': seconds, 'quality': -1.0, 'crop': None,
+            'best_frame': n, 'best_bbox': detection['bbox']
+        }
+        self._extend(track, detection, frame)
+        return track
+
+    def _extend(self, track, detection, frame):
+        n, seconds, img, scale = frame
+        track['bbox'] = [float(v) for v in detection['bbox']]
+        track['hits'] += 1
+        track['missed'] = 0
+        track['last_frame'], track['last_seen'] = n, seconds
+        track['confidence'] = max(track['confidence'], detection['confidence'])
+        track['confidence_sum'] += detection['confidence']
+        track['classes'][detection['class']] = track['classes'].get(detection['class'], 0.0) + detection['confidence']
+
+        quality = crop_quality(detection, img.shape, scale)
+        if quality > track['quality']:
+            # Detection boxes are in original pixels; the decoded frame is smaller by scale
+            crop = crop_jpeg(img, [v / scale for v in detection['bbox']], CROP_MAX_SIDE)
+            if crop is not None:
+                track['quality'], track['crop'] = quality, crop
+                track['best_frame'], track['best_bbox'] = n, detection['bbox']
+
+    def _close(self, track, min_hits):
+        """Keep a finished track as an item if it was seen often enough (and is among the best MAX_ITEMS)"""
+        if track['hits'] < min_hits or track['crop'] is None:
+            return
+        track['scene_bbox'] = self._scene_box(track['bbox'])
+        self._closed.append(track)
+        if len(self._closed) > self.max_items:
+            self._closed.remove(min(self._closed, key=lambda t: (t['hits'], t['confidence'])))
+
+    def result(self):
+        """Close the open tracks and return the response body"""
+        # A clip with a single keyframe cannot see anything twice
+        min_hits = min(MIN_TRACK_HITS, max(1, self.frames['keyframes']))
+        for track in self._tracks:
+            self._close(track, min_hits)
+        self._tracks = []
+
+        items = []
+        for track in sorted(self._closed, key=lambda t: (t['first_frame'], t['id'])):
+            with span('features'):
+                features = analyze_features(decode_image(track['crop'], None)[0])
+            items.append({
+                'class': max(track['classes'], key=track['classes'].get),
+                'category': track['category'],
+                'confidence': track['confidence'],
+                'mean_confidence': round(track['confidence_sum'] / track['hits'], 2),
+                'sightings': track['hits'],
+                'first_frame': track['first_frame'],
+                'last_frame': track['last_frame'],
+                'first_seen_s': track['first_seen'],
+                'last_seen_s': track['last_seen'],
+                'best_frame': track['best_frame'],
+                'bbox': track['best_bbox'],
+                'features': features,
+                'crop': track['crop']
+            })
+        return {
+            'items': items,
+            'count': len(items),
+            'frames': dict(self.frames),
+            'duration_s': self.duration,
+            'fallback': self.fallback,
+            'status': 'SUCCESS' if items else 'NO_ITEMS'
+        }
+
+
+def inventory(engine, frames, **options):
+    """Inventory body for a frame iterator (see video_frames / stream_frames)"""
+    started = time.perf_counter()
+    tracker = VideoInventory(engine, **options)
+    tracker.consume(frames)
+    body = tracker.result()
+    body['processing_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return body
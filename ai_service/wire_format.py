@@ -0,0 +1,71 @@
+"""
+Response encoding for /analyze and /video
+JSON by default; msgpack (when installed) carries embeddings and crops as raw bytes
+"""
+
+import base64
+import json
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # JSON only
+    msgpack = None
+
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def wants_msgpack(request):
+    """True when the request asks for msgpack by ?format=msgpack or the Accept header"""
+    if request.values.get('format') == 'msgpack':
+        return True
+    best = request.accept_mimetypes.best_match(('application/json',) + MSGPACK_MIMETYPES)
+    return best in MSGPACK_MIMETYPES
+
+
+def to_json(body):
+    """JSON text; embeddings become float lists and crops base64 strings"""
+    body = dict(body)
+    if 'embedding' in body:
+        body['embedding'] = body['embedding'].tolist()
+        body['dimensions'] = len(body['embedding'])
+    if 'detections' in body:
+        body['detections'] = [_encode_embedding(d, lambda v: v.tolist()) for d in body['detections']]
+    if 'crops' in body:
+        body['crops'] = [base64.b64encode(c).decode('ascii') if c else None for c in body['crops']]
+    if 'items' in body:
+        body['items'] = [dict(item, crop=base64.b64encode(item['crop']).decode('ascii')) if item.get('crop') else item
+                         for item in body['items']]
+    return json.dumps(body)
+
+
+def to_msgpack(body):
+    """
+    msgpack bytes; embeddings (also per detection) are little-endian float32 bytes
+    (4 bytes per dimension, embedding_dtype says so) and crops (also per item) stay JPEG bytes.
+    """
+    body = dict(body)
+    if 'embedding' in body:
+        embedding = body['embedding']
+        body['embedding'] = embedding.astype('<f4').tobytes()
+        body['embedding_dtype'] = 'float32'
+        body['dimensions'] = int(embedding.size)
+    if 'detections' in body:
+        body['detections'] = [_encode_embedding(d, lambda v: v.astype('<f4').tobytes()) for d in body['detections']]
+    return msgpack.packb(body, use_bin_type=True, default=_plain)
+
+
+def _encode_embedding(detection, encode):
+    """Copy of a detection whose per-detection embedding (if any) is encoded"""
+    embedding = detection.get('embedding')
+    if embedding is None:
+        return detection
+    return dict(detection, embedding=encode(np.asarray(embedding, dtype=np.float32)))
+
+
+def _plain(value):
+    """numpy scalars left in a body (confidences) as Python numbers"""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
@@ -0,0 +1,349 @@
+"""
+Pre-decoded training cache: YOLO datasets as fixed-size, letterboxed uint8 shards on disk.
+
+    python scripts/dataset_cache.py build --data datasets/lost_items/data.yaml --out datasets/lost_items_cache
+    python scripts/dataset_cache.py build --images datasets/lost_items/images/train --split train --out datasets/lost_items_cache
+    python scripts/dataset_cache.py bench --out datasets/lost_items_cache --split train --workers 4
+
+Layout of <out>/<split>/:
+  shard_000.npy ...  (n, imgsz, imgsz, 3) uint8 BGR, letterboxed like ultralytics (pad 114)
+  geometry.npy       (N, 5) float32: original h, w, resize ratio, pad x, pad y
+  labels.npy         (M, 5) float32: class, cx, cy, w, h normalized to the letterboxed frame
+  label_offsets.npy  (N + 1,) int64: labels of image i are labels[offsets[i]:offsets[i + 1]]
+  index.json         imgsz, augment, shard sizes and the source file of every image
+
+The train split is resized as ultralytics loads augmented images (INTER_LINEAR); other splits
+as it loads unaugmented ones (INTER_AREA when shrinking), so cached pixels match either way.
+
+Shards are plain .npy files opened with mmap_mode='r', so every DataLoader worker maps the
+same page-cache pages instead of decoding JPEGs: CachedDataset returns read-only views.
+Training with ultralytics: call install_ultralytics_hook(<out>) before model.train(); images
+found in the cache are then served from it (copied, because augmentations write in place).
+Disk cost is imgsz * imgsz * 3 bytes per image (1.2 MB at 640).
+"""
+
+import os
+import sys
+import json
+import math
+import glob
+import time
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service')))
+from backends import LETTERBOX_COLOR
+
+IMAGE_EXTENSIONS = ('*.jpg', '*.jpeg', '*.png', '*.webp', '*.bmp')
+SHARD_SIZE = 1024
+
+
+def image_files(folder):
+    return sorted(p for pattern in IMAGE_EXTENSIONS for p in glob.glob(os.path.join(folder, '**', pattern), recursive=True))
+
+
+def label_file(image_path):
+    """YOLO convention: .../images/x.jpg -> .../labels/x.txt"""
+    head, tail = os.path.split(image_path)
+    parts = head.split(os.sep)
+    if 'images' in parts:
+        parts[len(parts) - 1 - parts[::-1].index('images')] = 'labels'
+    return os.path.join(os.sep.join(parts), os.path.splitext(tail)[0] + '.txt')
+
+
+def read_labels(path):
+    try:
+        with open(path) as f:
+            rows = [list(map(float, line.split()[:5])) for line in f if len(line.split()) >= 5]
+    except OSError:
+        return np.zeros((0, 5), dtype=np.float32)
+    return np.array(rows, dtype=np.float32).reshape(-1, 5)
+
+
+def resized_shape(h, w, imgsz):
+    """(h, w) with the longest side at imgsz, rounded up as ultralytics' BaseDataset.load_image() does"""
+    ratio = imgsz / max(h, w)
+    if ratio == 1:
+        return h, w
+    return min(math.ceil(h * ratio), imgsz), min(math.ceil(w * ratio), imgsz)
+
+
+def interpolation(augment, ratio):
+    """ultralytics' choice: INTER_AREA to shrink an image that will not be augmented, else INTER_LINEAR"""
+    return cv2.INTER_LINEAR if augment or ratio > 1 else cv2.INTER_AREA
+
+
+def load_example(args):
+    """Decode, letterbox and relabel one image (runs in a worker process)"""
+    path, imgsz, augment = args
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return path, None, None, None
+    h, w = img.shape[:2]
+    new_h, new_w = resized_shape(h, w, imgsz)
+    if (new_h, new_w) != (h, w):
+        img = cv2.resize(img, (new_w, new_h), interpolation=interpolation(augment, imgsz / max(h, w)))
+    pad_y, pad_x = int(round((imgsz - new_h) / 2 - 0.1)), int(round((imgsz - new_w) / 2 - 0.1))
+    boxed = cv2.copyMakeBorder(img, pad_y, imgsz - new_h - pad_y, pad_x, imgsz - new_w - pad_x,
+                               cv2.BORDER_CONSTANT, value=(LETTERBOX_COLOR,) * 3)
+    labels = read_labels(label_file(path))
+    if len(labels):
+        labels[:, 1] = (labels[:, 1] * new_w + pad_x) / imgsz
+        labels[:, 2] = (labels[:, 2] * new_h + pad_y) / imgsz
+        labels[:, 3] *= new_w / imgsz
+        labels[:, 4] *= new_h / imgsz
+    ratio = imgsz / max(h, w)
+    return path, boxed, np.array([h, w, ratio, pad_x, pad_y], dtype=np.float32), labels
+
+
+def build_split(paths, out_dir, imgsz, shard_size=SHARD_SIZE, workers=None, augment=True):
+    """
+    Write one split; unreadable images are skipped and reported. augment says whether the
+    split is loaded for augmented training (train) or not (val/test), which sets the resize.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    shard_sizes = [min(shard_size, len(paths) - start) for start in range(0, len(paths), shard_size)]
+    shards = [np.lib.format.open_memmap(os.path.join(out_dir, f'shard_{i:03d}.npy'), mode='w+',
+                                        dtype=np.uint8, shape=(n, imgsz, imgsz, 3))
+              for i, n in enumerate(shard_sizes)]
+
+    files, geometry, labels, offsets, skipped = [], [], [], [0], []
+    started = time.perf_counter()
+    with Pool(workers) as pool:
+        for path, boxed, geo, boxes in pool.imap(load_example, ((p, imgsz, augment) for p in paths), chunksize=16):
+            if boxed is None:
+                skipped.append(path)
+                continue
+            n = len(files)
+            shards[n // shard_size][n % shard_size] = boxed
+            files.append(os.path.abspath(path))
+            geometry.append(geo)
+            labels.append(boxes)
+            offsets.append(offsets[-1] + len(boxes))
+            if len(files) % 1000 == 0:
+                print(f"  {len(files)}/{len(paths)} images, {len(files) / (time.perf_counter() - started):.0f} img/s")
+
+    for shard in shards:
+        shard.flush()
+    del shards
+    # Skipped images leave unused slots at the end; shrink the last shard's recorded size
+    counts = [max(0, min(shard_size, len(files) - i * shard_size)) for i in range(len(shard_sizes))]
+
+    np.save(os.path.join(out_dir, 'geometry.npy'), np.array(geometry, dtype=np.float32).reshape(-1, 5))
+    np.save(os.path.join(out_dir, 'labels.npy'), np.concatenate(labels) if labels else np.zeros((0, 5), np.float32))
+    np.save(os.path.join(out_dir, 'label_offsets.npy'), np.array(offsets, dtype=np.int64))
+    with open(os.path.join(out_dir, 'index.json'), 'w') as f:
+        json.dump({'imgsz': imgsz, 'channels': 'bgr', 'resize': 'ceil', 'augment': augment,
+                   'shard_size': shard_size, 'shard_counts': counts, 'files': files, 'skipped': skipped}, f)
+    print(f"✓ {out_dir}: {len(files)} images in {len(shard_sizes)} shards "
+          f"({time.perf_counter() - started:.1f}s, {len(skipped)} unreadable)")
+
+
+class CachedDataset:
+    """
+    Random access to a built split. Shards are memory-mapped lazily in each process,
+    so the object can be handed to forked or spawned DataLoader workers.
+    """
+
+    def __init__(self, root, split='train'):
+        self.dir = os.path.join(root, split)
+        with open(os.path.join(self.dir, 'index.json')) as f:
+            index = json.load(f)
+        self.imgsz = index['imgsz']
+        # Caches written before resizing matched ultralytics (rounded, not ceil'd) are 'round'
+        self.resize = index.get('resize', 'round')
+        self.augment = index.get('augment', True)
+        self.shard_size = index['shard_size']
+        self.shard_counts = index['shard_counts']
+        self.files = index['files']
+        self.geometry = np.load(os.path.join(self.dir, 'geometry.npy'))
+        self.labels = np.load(os.path.join(self.dir, 'labels.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(self.dir, 'label_offsets.npy'))
+        self._shards = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_shards'] = None  # maps are re-opened in the worker, never pickled
+        return state
+
+    def _shard(self, n):
+        if self._shards is None or self._pid != os.getpid():
+            self._shards = [np.load(os.path.join(self.dir, f'shard_{i:03d}.npy'), mmap_mode='r')
+                            for i in range(len(self.shard_counts))]
+            self._pid = os.getpid()
+        return self._shards[n]
+
+    def __len__(self):
+        return len(self.files)
+
+    def image(self, i):
+        """Letterboxed (imgsz, imgsz, 3) BGR view; read-only, no copy"""
+        return self._shard(i // self.shard_size)[i % self.shard_size]
+
+    def resized(self, i):
+        """The image without padding, i.e. resized to imgsz on its longest side (still a view)"""
+        h, w, _, pad_x, pad_y = self.geometry[i]
+        x, y = int(pad_x), int(pad_y)
+        if self.resize == 'ceil':
+            new_h, new_w = resized_shape(int(h), int(w), self.imgsz)
+        else:
+            ratio = self.imgsz / max(h, w)
+            new_h, new_w = int(round(h * ratio)), int(round(w * ratio))
+        return self.image(i)[y:y + new_h, x:x + new_w]
+
+    def targets(self, i):
+        """(k, 5) class, cx, cy, w, h normalized to the letterboxed frame"""
+        return self.labels[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i):
+        return self.image(i), self.targets(i)
+
+
+def install_ultralytics_hook(root):
+    """
+    Serve ultralytics' BaseDataset.load_image() from the cache for every cached file
+    (matching imgsz, rect_mode, and augment, which decides the resize interpolation);
+    other images fall through to the normal loader.
+    With augmentation on, served images go through the same RAM buffer as loaded ones,
+    which Mosaic and MixUp draw their extra images from.
+    """
+    from ultralytics.data.base import BaseDataset
+
+    lookup = {}
+    for split in sorted(os.listdir(root)):
+        if os.path.exists(os.path.join(root, split, 'index.json')):
+            dataset = CachedDataset(root, split)
+            if dataset.resize != 'ceil':
+                print(f"⚠ {root}/{split} was built with an older resize; rebuild it to use it for training")
+                continue
+            lookup.update({(path, dataset.augment): (dataset, i) for i, path in enumerate(dataset.files)})
+    original = BaseDataset.load_image
+
+    def load_image(self, i, rect_mode=True):
+        key = (os.path.abspath(self.im_files[i]), bool(self.augment))
+        hit = lookup.get(key) if rect_mode and self.ims[i] is None else None
+        if hit is None or hit[0].imgsz != self.imgsz:
+            return original(self, i, rect_mode)
+        dataset, n = hit
+        h, w = dataset.geometry[n][:2]
+        # Copy: HSV and flip augmentations modify the image in place
+        im = np.array(dataset.resized(n))
+        hw0 = (int(h), int(w))
+        if self.augment:
+            # Same bookkeeping as BaseDataset.load_image(): Mosaic samples from self.buffer
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, hw0, im.shape[:2]
+            self.buffer.append(i)
+            if len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, hw0, im.shape[:2]
+
+    BaseDataset.load_image = load_image
+    print(f"✓ ultralytics will read {len(lookup)} images from {root}")
+
+
+def splits_from_yaml(data_yaml):
+    import yaml
+    with open(data_yaml) as f:
+        data = yaml.safe_load(f)
+    base = data.get('path') or os.path.dirname(os.path.abspath(data_yaml))
+    if not os.path.isabs(base):
+        base = os.path.join(os.path.dirname(os.path.abspath(data_yaml)), base)
+    splits = {}
+    for split in ('train', 'val', 'test'):
+        folders = data.get(split)
+        if not folders:
+            continue
+        for folder in folders if isinstance(folders, list) else [folders]:
+            splits.setdefault(split, []).extend(image_files(os.path.join(base, folder)))
+    return splits
+
+
+def bench(root, split, limit, workers):
+    """images/s for the raw-folder path (imread + letterbox) vs the cache, single and multi-process"""
+    dataset = CachedDataset(root, split)
+    indices = list(range(min(limit, len(dataset))))
+    paths = [dataset.files[i] for i in indices]
+
+    def timed(label, fn, n):
+        started = time.perf_counter()
+        fn()
+        rate = n / (time.perf_counter() - started)
+        print(f"{label:<40}{rate:>12.0f} img/s")
+        return rate
+
+    def collate():
+        # What a loader does with the views: copy them into a batch
+        batch = np.empty((16, dataset.imgsz, dataset.imgsz, 3), dtype=np.uint8)
+        for n, i in enumerate(indices):
+            batch[n % len(batch)] = dataset.image(i)
+
+    print(f"{len(indices)} images from {root}/{split}, {workers} workers\n")
+    raw = timed('raw folder (imread + letterbox)', lambda: [load_example((p, dataset.imgsz, dataset.augment)) for p in paths], len(paths))
+    cached = timed('cache, into a batch', collate, len(indices))
+    timed('cache, copy (ultralytics hook)', lambda: [np.array(dataset.resized(i)) for i in indices], len(indices))
+    if workers > 1:
+        with Pool(workers) as pool:
+            timed(f'raw folder, {workers} processes', lambda: pool.map(_raw_worker, [(p, dataset.imgsz, dataset.augment) for p in paths], chunksize=8), len(paths))
+            timed(f'cache, {workers} processes', lambda: pool.map(_cache_worker, [(root, split, i) for i in indices], chunksize=64), len(indices))
+    print(f"\ncache speed-up (single process): {cached / raw:.1f}x")
+
+
+def _raw_worker(args):
+    return load_example(args)[1].shape
+
+
+_worker_datasets = {}
+
+
+def _cache_worker(args):
+    root, split, i = args
+    dataset = _worker_datasets.get((root, split))
+    if dataset is None:
+        dataset = _worker_datasets[(root, split)] = CachedDataset(root, split)
+    return np.array(dataset.resized(i)).shape
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or benchmark the pre-decoded training cache')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build')
+    build.add_argument('--data', help='ultralytics data.yaml (all of its splits)')
+    build.add_argument('--images', help='a single image folder (labels in the sibling labels/ folder)')
+    build.add_argument('--split', default='train', help='split name for --images')
+    build.add_argument('--out', required=True)
+    build.add_argument('--imgsz', type=int, default=640)
+    build.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    build.add_argument('--workers', type=int, default=os.cpu_count())
+    benchmark = sub.add_parser('bench')
+    benchmark.add_argument('--out', required=True)
+    benchmark.add_argument('--split', default='train')
+    benchmark.add_argument('--limit', type=int, default=2000)
+    benchmark.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        bench(args.out, args.split, args.limit, args.workers)
+        return 0
+
+    if args.data:
+        splits = splits_from_yaml(args.data)
+    elif args.images:
+        splits = {args.split: image_files(args.images)}
+    else:
+        parser.error('give --data or --images')
+    for split, paths in splits.items():
+        if not paths:
+            print(f"⚠ No images for split {split}")
+            continue
+        print(f"Building {split}: {len(paths)} images at {args.imgsz}px")
+        build_split(paths, os.path.join(args.out, split), args.imgsz, args.shard_size, args.workers,
+                    augment=split == 'train')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Export YOLO weights to ONNX for the AI service's onnx backend, optionally quantized to INT8.
+
+    python scripts/export_onnx.py --weights yolov8m.pt
+    python scripts/export_onnx.py --weights runs/detect/runs/detect/lost_items_model/weights/best.pt --quantize dynamic
+    python scripts/export_onnx.py --weights yolov8m.pt --quantize static --calibration-dir test_images
+
+Serve the result with AI_MODEL_PATH=<file>.onnx (the backend is picked from the extension).
+Requires: ultralytics, onnx, onnxruntime.
+"""
+
+import os
+import sys
+import glob
+import argparse
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service'))
+from backends import to_input_tensor
+
+CALIBRATION_EXTENSIONS = ('*.jpg', '*.jpeg', '*.png', '*.webp', '*.bmp')
+
+
+def export_fp32(weights, imgsz):
+    from ultralytics import YOLO
+    # dynamic=True keeps the batch axis free so the micro-batcher can send any batch size
+    path = YOLO(weights).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    print(f"✓ Exported FP32 model: {path}")
+    return path
+
+
+def copy_metadata(source, target):
+    """Quantization drops metadata_props; the backend reads class names and imgsz from them"""
+    import onnx
+    source_model = onnx.load(source, load_external_data=False)
+    target_model = onnx.load(target)
+    del target_model.metadata_props[:]
+    target_model.metadata_props.extend(source_model.metadata_props)
+    onnx.save(target_model, target)
+
+
+def quantize_dynamic(fp32_path, output):
+    from onnxruntime.quantization import quantize_dynamic as ort_quantize_dynamic, QuantType
+    ort_quantize_dynamic(fp32_path, output, weight_type=QuantType.QUInt8)
+    copy_metadata(fp32_path, output)
+    print(f"✓ Dynamic INT8 model: {output}")
+
+
+class FolderCalibrationReader:
+    """Feeds letterboxed images from a folder, preprocessed exactly as the onnx backend does"""
+
+    def __init__(self, folder, input_name, imgsz, limit):
+        paths = sorted(p for pattern in CALIBRATION_EXTENSIONS for p in glob.glob(os.path.join(folder, '**', pattern), recursive=True))
+        if not paths:
+            raise SystemExit(f"No calibration images found in {folder}")
+        self.paths = iter(paths[:limit])
+        self.input_name = input_name
+        self.imgsz = imgsz
+        print(f"Calibrating on {min(len(paths), limit)} images from {folder}")
+
+    def get_next(self):
+        path = next(self.paths, None)
+        if path is None:
+            return None
+        img = np.array(Image.open(path).convert('RGB'))
+        batch, _ = to_input_tensor([img], self.imgsz)
+        return {self.input_name: batch}
+
+
+def quantize_static(fp32_path, output, calibration_dir, imgsz, limit):
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_static as ort_quantize_static, QuantFormat, QuantType, CalibrationMethod
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepared = fp32_path.replace('.onnx', '.prep.onnx')
+    quant_pre_process(fp32_path, prepared)
+    input_name = ort.InferenceSession(prepared, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    reader = FolderCalibrationReader(calibration_dir, input_name, imgsz, limit)
+    ort_quantize_static(prepared, output, reader,
+                        quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8,
+                        per_channel=True,
+                        calibrate_method=CalibrationMethod.MinMax)
+    os.remove(prepared)
+    copy_metadata(fp32_path, output)
+    print(f"✓ Static INT8 model: {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export YOLO weights to (quantized) ONNX')
+    parser.add_argument('--weights', default='yolov8m.pt')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--quantize', choices=['none', 'dynamic', 'static'], default='none')
+    parser.add_argument('--calibration-dir', default='test_images')
+    parser.add_argument('--calibration-size', type=int, default=200)
+    parser.add_argument('--output', help='quantized model path (default: <weights>.int8-<mode>.onnx)')
+    args = parser.parse_args()
+
+    fp32_path = export_fp32(args.weights, args.imgsz)
+    if args.quantize == 'none':
+        return
+
+    output = args.output or fp32_path.replace('.onnx', f'.int8-{args.quantize}.onnx')
+    if args.quantize == 'dynamic':
+        quantize_dynamic(fp32_path, output)
+    else:
+        quantize_static(fp32_path, output, args.calibration_dir, args.imgsz, args.calibration_size)
+
+
+if __name__ == '__main__':
+    main()
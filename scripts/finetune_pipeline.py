@@ -0,0 +1,506 @@
+"""
+Incremental fine-tuning from user corrections (approved training_samples and ai_feedback).
+
+    python scripts/finetune_pipeline.py --source local:data/supabase_export --device cpu
+    python scripts/finetune_pipeline.py --source supabase --epochs 5
+    python scripts/finetune_pipeline.py --source local:data/supabase_export --stages fetch,shard
+
+Stages (progress is kept in <work>/state.json, so a failed run resumes where it stopped):
+  fetch     corrections created since the last shard was built
+  shard     drop exact (SHA-256) and near (dHash) duplicates, decode each image once at --imgsz,
+            box it with the served model and write a YOLO shard; about 1 in --holdout-every
+            images with a human-drawn box (training_samples.bbox, chosen by content hash) goes
+            to the fixed holdout set instead, labelled with that box
+  finetune  train from the currently served weights on every shard for --epochs (only once the
+            holdout has MIN_HOLDOUT images, so no training run is wasted on an unusable check)
+  evaluate  served and candidate weights on the holdout
+  register  add the candidate to <registry>/models.json (and model_versions for --source supabase)
+            only if its holdout mAP50-95 beats the served model by --min-gain
+
+The holdout never holds the served model's own boxes: scoring against them would favour it.
+
+The local source stands in for Supabase: <folder>/training_samples.json, ai_feedback.json and
+items.json hold table rows, and relative image_url values are resolved under <folder>.
+Requires ultralytics; everything runs on CPU.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from collections import namedtuple
+from datetime import datetime, timezone
+import numpy as np
+import cv2
+from PIL import Image
+
+SERVICE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service'))
+sys.path.insert(0, SERVICE_DIR)
+from ai_engine import AIEngine, map_to_category
+from image_io import decode_image, ImageRejected
+from model_registry import REGISTRY_DIR, SCAN_DIRS, MODEL_FIELDS, served_entry, register_version
+from perceptual_hash import dhash, hamming
+from result_cache import content_hash
+
+STAGES = ['fetch', 'shard', 'finetune', 'evaluate', 'register']
+# dHash distance at or below which two images count as the same photo
+NEAR_DUPLICATE_BITS = 4
+# Fewer holdout images than this cannot tell two models apart
+MIN_HOLDOUT = 20
+
+# box: a human-drawn [x1, y1, x2, y2] in original image pixels, or None (boxed by the served model)
+Sample = namedtuple('Sample', ['id', 'table', 'image_url', 'category', 'created_at', 'box'], defaults=(None,))
+
+
+def parse_box(value):
+    """training_samples.bbox as [x1, y1, x2, y2] floats; None when absent or malformed"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    if isinstance(value, dict):
+        value = [value.get(k) for k in ('x1', 'y1', 'x2', 'y2')]
+    try:
+        x1, y1, x2, y2 = (float(v) for v in value)
+    except (TypeError, ValueError):
+        return None
+    return [x1, y1, x2, y2] if x2 > x1 and y2 > y1 else None
+
+
+def corrections(training_samples, feedback, items, since=None):
+    """Samples from approved training_samples rows and ai_feedback rows carrying a corrected category"""
+    samples = []
+    for row in training_samples:
+        category = row.get('corrected_category') or row.get('original_category')
+        if row.get('status') == 'approved' and category and row.get('image_url'):
+            samples.append(Sample(row['id'], 'training_samples', row['image_url'], category, row.get('created_at') or '',
+                                  parse_box(row.get('bbox'))))
+    items = {item['id']: item for item in items}
+    for row in feedback:
+        item = items.get(row.get('item_id')) or {}
+        if row.get('correct_category') and item.get('image_url'):
+            samples.append(Sample(row['id'], 'ai_feedback', item['image_url'], row['correct_category'],
+                                  row.get('created_at') or ''))
+    return sorted((s for s in samples if not since or s.created_at > since), key=lambda s: s.created_at)
+
+
+class LocalSource:
+    """Table rows exported as JSON files plus an image folder"""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _rows(self, table):
+        try:
+            with open(os.path.join(self.folder, f'{table}.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def samples(self, since=None):
+        return corrections(self._rows('training_samples'), self._rows('ai_feedback'), self._rows('items'), since)
+
+    def read_image(self, url):
+        relative = url.split('://', 1)[-1].lstrip('/')
+        for path in (os.path.join(self.folder, relative), os.path.join(self.folder, os.path.basename(relative))):
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    return f.read()
+        return None
+
+    def add_model_version(self, row):
+        pass
+
+
+class SupabaseSource:
+    """PostgREST access with the service-role key (SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY)"""
+
+    PAGE = 1000
+
+    def __init__(self, url, key, image_root):
+        import requests
+        self.session = requests.Session()
+        self.session.headers.update({'apikey': key, 'Authorization': f'Bearer {key}'})
+        self.url = url.rstrip('/')
+        self.image_root = image_root
+
+    def _rows(self, table, since=None, **filters):
+        params = dict(filters, select='*', order='created_at')
+        if since:
+            params['created_at'] = f'gt.{since}'
+        rows = []
+        while True:
+            response = self.session.get(f'{self.url}/rest/v1/{table}', params=dict(params, offset=len(rows), limit=self.PAGE))
+            response.raise_for_status()
+            page = response.json()
+            rows += page
+            if len(page) < self.PAGE:
+                return rows
+
+    def samples(self, since=None):
+        feedback = self._rows('ai_feedback', since, correct_category='not.is.null')
+        item_ids = sorted({row['item_id'] for row in feedback if row.get('item_id')})
+        items = self._rows('items', id=f'in.({",".join(item_ids)})') if item_ids else []
+        return corrections(self._rows('training_samples', since, status='eq.approved'), feedback, items)
+
+    def read_image(self, url):
+        if url.startswith(('http://', 'https://')):
+            response = self.session.get(url, timeout=30)
+            return response.content if response.ok else None
+        path = os.path.join(self.image_root, url.lstrip('/'))
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def add_model_version(self, row):
+        columns = {k: v for k, v in row.items() if k not in ('id', 'weights_path', 'variant')}
+        self.session.post(f'{self.url}/rest/v1/model_versions', json=columns).raise_for_status()
+
+
+def open_source(spec, image_root):
+    if spec.startswith('local:'):
+        return LocalSource(spec[len('local:'):])
+    if spec == 'supabase':
+        url, key = os.environ.get('SUPABASE_URL'), os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
+        if not url or not key:
+            raise SystemExit('SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set for --source supabase')
+        return SupabaseSource(url, key, image_root)
+    raise SystemExit(f"Unknown source '{spec}' (expected local:<folder> or supabase)")
+
+
+class PseudoLabeler:
+    """
+    Most corrections carry a category, not a box. For training, the box is the served model's
+    most confident detection whose class belongs to the corrected category; failing that, its
+    most confident detection relabelled, or the whole frame (item photos are mostly single-object).
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.names = engine.names
+
+    def class_for(self, category):
+        for cls, name in self.names.items():
+            if name == category:
+                return cls
+        return next((cls for cls, name in self.names.items() if map_to_category(name) == category), None)
+
+    def __call__(self, img, category):
+        cls = self.class_for(category)
+        if cls is None:
+            return None
+        raw = self.engine.analyze(img, with_features=False)
+        if raw['fallback'] or not len(raw['scores']):
+            h, w = img.shape[:2]
+            return cls, [0, 0, w, h]
+        order = np.argsort(-raw['scores'])
+        matching = [i for i in order if map_to_category(self.names[int(raw['class_ids'][i])]) == category]
+        if matching:
+            best = matching[0]
+            cls = int(raw['class_ids'][best])
+        else:
+            best = order[0]
+        return cls, raw['boxes'][best].tolist()
+
+
+class DedupIndex:
+    """Hashes of every image already in a shard or the holdout, across runs"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {'sha256': [], 'dhash': []}
+        self.digests = set(data['sha256'])
+        self.dhashes = [int(h, 16) for h in data['dhash']]
+
+    def seen(self, digest, phash=None):
+        if digest in self.digests:
+            return True
+        return phash is not None and any(hamming(phash, h) <= NEAR_DUPLICATE_BITS for h in self.dhashes)
+
+    def add(self, digest, phash):
+        self.digests.add(digest)
+        self.dhashes.append(phash)
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({'sha256': sorted(self.digests), 'dhash': [f'{h:016x}' for h in self.dhashes]}, f)
+
+
+def resize_longest(img, side):
+    h, w = img.shape[:2]
+    ratio = side / max(h, w)
+    if ratio >= 1:
+        return img
+    return cv2.resize(img, (max(1, round(w * ratio)), max(1, round(h * ratio))), interpolation=cv2.INTER_AREA)
+
+
+def write_example(split_dir, name, img, cls, box):
+    """Save one pre-resized JPEG and its YOLO label"""
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = box
+    os.makedirs(os.path.join(split_dir, 'images'), exist_ok=True)
+    os.makedirs(os.path.join(split_dir, 'labels'), exist_ok=True)
+    Image.fromarray(img).save(os.path.join(split_dir, 'images', f'{name}.jpg'), quality=95)
+    with open(os.path.join(split_dir, 'labels', f'{name}.txt'), 'w') as f:
+        f.write(f'{cls} {(x1 + x2) / 2 / w:.6f} {(y1 + y2) / 2 / h:.6f} {(x2 - x1) / w:.6f} {(y2 - y1) / h:.6f}\n')
+
+
+def build_shard(samples, source, labeler, work_dir, shard_name, imgsz, holdout_every):
+    """Write new samples into shards/<shard_name> (or the holdout); returns per-outcome counts"""
+    index = DedupIndex(os.path.join(work_dir, 'dedup.json'))
+    shard_dir = os.path.join(work_dir, 'shards', shard_name)
+    holdout_dir = os.path.join(work_dir, 'holdout')
+    counts = {'train': 0, 'holdout': 0, 'duplicate': 0, 'missing': 0, 'unreadable': 0, 'unmapped': 0}
+
+    for sample in samples:
+        data = source.read_image(sample.image_url)
+        if data is None:
+            counts['missing'] += 1
+            continue
+        digest = content_hash(data)
+        if index.seen(digest):
+            counts['duplicate'] += 1
+            continue
+        try:
+            decoded, scale = decode_image(data, imgsz)
+        except ImageRejected:
+            counts['unreadable'] += 1
+            continue
+        # Stored at training resolution, so the trainer never decodes the full photo again
+        img = resize_longest(decoded, imgsz)
+        phash = dhash(img)
+        if index.seen(digest, phash):
+            counts['duplicate'] += 1
+            continue
+
+        # Only human-boxed images may be held out, labelled with the human box
+        split = 'holdout' if sample.box is not None and int(digest[:8], 16) % holdout_every == 0 else 'train'
+        if split == 'holdout':
+            cls = labeler.class_for(sample.category)
+            factor = img.shape[1] / (decoded.shape[1] * scale)
+            label = None if cls is None else (cls, [v * factor for v in sample.box])
+        else:
+            label = labeler(img, sample.category)
+        if label is None:
+            counts['unmapped'] += 1
+            continue
+
+        write_example(holdout_dir if split == 'holdout' else shard_dir, digest[:16], img, *label)
+        index.add(digest, phash)
+        counts[split] += 1
+
+    index.save()
+    return counts
+
+
+def holdout_size(work_dir):
+    holdout = os.path.join(work_dir, 'holdout', 'images')
+    return len(os.listdir(holdout)) if os.path.isdir(holdout) else 0
+
+
+def retire_pseudo_holdout(work_dir, state):
+    """
+    Holdouts built before only human boxes were held out contain the served model's own
+    labels; move them into a training shard, once, and start the holdout afresh
+    """
+    if state.get('holdout') == 'human':
+        return
+    holdout = os.path.join(work_dir, 'holdout')
+    if holdout_size(work_dir):
+        shutil.move(holdout, os.path.join(work_dir, 'shards', 'pseudo-holdout'))
+        state['shards'].append('pseudo-holdout')
+        state['candidate'] = state['evaluation'] = None
+        print("Moved the pseudo-labelled holdout into training shard pseudo-holdout")
+    state['holdout'] = 'human'
+    save_state(work_dir, state)
+
+
+def write_data_yaml(work_dir, shards, names):
+    """ultralytics dataset file over every shard; JSON is valid YAML"""
+    path = os.path.join(work_dir, 'data.yaml')
+    with open(path, 'w') as f:
+        json.dump({'path': os.path.abspath(work_dir),
+                   'train': [os.path.join('shards', shard, 'images') for shard in shards],
+                   'val': os.path.join('holdout', 'images'),
+                   'names': {int(k): v for k, v in names.items()}}, f, indent=2)
+    return path
+
+
+def finetune(weights, data_yaml, work_dir, run_name, args):
+    from ultralytics import YOLO
+    model = YOLO(weights)
+    # Small learning rate and a frozen backbone: adapt the head to the corrections, keep the rest
+    model.train(data=data_yaml, epochs=args.epochs, imgsz=args.imgsz, device=args.device, batch=args.batch,
+                workers=args.workers, cache=args.cache, freeze=args.freeze, lr0=args.lr0, warmup_epochs=0,
+                project=os.path.abspath(os.path.join(work_dir, 'runs')), name=run_name, plots=False)
+    return os.path.join(str(model.trainer.save_dir), 'weights', 'best.pt')
+
+
+def evaluate(weights, data_yaml, args):
+    """Holdout metrics in model_versions terms plus mAP50-95"""
+    from ultralytics import YOLO
+    box = YOLO(weights).val(data=data_yaml, split='val', imgsz=args.imgsz, device=args.device,
+                            batch=args.batch, plots=False, verbose=False).box
+    f1 = 2 * box.mp * box.mr / (box.mp + box.mr) if box.mp + box.mr else 0.0
+    return {'accuracy': float(box.map50), 'map50_95': float(box.map), 'precision_score': float(box.mp),
+            'recall_score': float(box.mr), 'f1_score': round(float(f1), 5)}
+
+
+def resolve_weights(path):
+    """Catalogue weights paths are relative to ai_service/, where the service runs"""
+    return path if os.path.isabs(path) else os.path.join(SERVICE_DIR, path)
+
+
+def service_path(path):
+    """Inverse of resolve_weights() for files inside ai_service/; absolute otherwise"""
+    path = os.path.abspath(path)
+    return os.path.relpath(path, SERVICE_DIR) if path.startswith(SERVICE_DIR + os.sep) else path
+
+
+def load_state(work_dir):
+    try:
+        with open(os.path.join(work_dir, 'state.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'since': None, 'pending': [], 'shards': [], 'names': None, 'candidate': None, 'evaluation': None,
+                'holdout': 'human'}
+
+
+def save_state(work_dir, state):
+    tmp = os.path.join(work_dir, 'state.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, os.path.join(work_dir, 'state.json'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fine-tune the served detector on user corrections')
+    parser.add_argument('--source', default='local:data/supabase_export', help='local:<folder> or supabase')
+    parser.add_argument('--image-root', default='uploads', help='folder for relative image_url values (supabase source)')
+    parser.add_argument('--work-dir', default=os.path.join('data', 'finetune'))
+    parser.add_argument('--registry-dir', default=os.path.join(SERVICE_DIR, REGISTRY_DIR))
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--cache', default='ram', help="ultralytics image cache: 'ram', 'disk' or 'false'")
+    parser.add_argument('--freeze', type=int, default=10, help='backbone layers kept frozen')
+    parser.add_argument('--lr0', type=float, default=0.001)
+    parser.add_argument('--holdout-every', type=int, default=10)
+    parser.add_argument('--min-gain', type=float, default=0.0, help='mAP50-95 the candidate must add to be registered')
+    parser.add_argument('--force', action='store_true', help='train even without new samples')
+    args = parser.parse_args()
+    args.cache = False if args.cache == 'false' else args.cache
+
+    stages = [s for s in args.stages.split(',') if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    state = load_state(args.work_dir)
+    retire_pseudo_holdout(args.work_dir, state)
+    source = open_source(args.source, args.image_root)
+    scan_dirs = [os.path.join(SERVICE_DIR, d) for d in SCAN_DIRS]
+    served = served_entry(args.registry_dir, scan_dirs)
+    served_weights = resolve_weights(served['weights_path'])
+    print(f"Served model: {served['version']} ({served_weights})")
+
+    if 'fetch' in stages:
+        known = {tuple(p[:2]) for p in state['pending']}
+        new = [s for s in source.samples(state['since']) if (s.id, s.table) not in known]
+        state['pending'] += [list(s) for s in new]
+        save_state(args.work_dir, state)
+        print(f"fetch: {len(new)} new corrections, {len(state['pending'])} pending")
+
+    if 'shard' in stages and state['pending']:
+        engine = AIEngine(served_weights)
+        if not engine.model_loaded:
+            raise SystemExit("The served model could not be loaded; it is needed to box the samples")
+        samples = [Sample(*p) for p in state['pending']]
+        shard_name = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        started = time.perf_counter()
+        counts = build_shard(samples, source, PseudoLabeler(engine), args.work_dir, shard_name,
+                             args.imgsz, args.holdout_every)
+        if counts['train']:
+            state['shards'].append(shard_name)
+            # A new shard invalidates the previous candidate
+            state['candidate'] = state['evaluation'] = None
+        state['names'] = {str(k): v for k, v in engine.names.items()}
+        state['since'] = max([state['since'] or ''] + [s.created_at for s in samples]) or None
+        state['pending'] = []
+        save_state(args.work_dir, state)
+        print(f"shard {shard_name}: {counts} in {time.perf_counter() - started:.1f}s")
+
+    if state['candidate'] and state['evaluation'] and 'registered' in state['evaluation'] and not args.force:
+        print("No new training data since the last candidate; nothing to do (use --force to retrain)")
+        return 0
+    if not state['shards'] or not state.get('names'):
+        print("No training shards yet")
+        return 0
+    data_yaml = write_data_yaml(args.work_dir, state['shards'], state['names'])
+
+    if 'finetune' in stages and (state['candidate'] is None or args.force):
+        # Checked before training: without a usable holdout the candidate could never be promoted
+        size = holdout_size(args.work_dir)
+        if size < MIN_HOLDOUT:
+            raise SystemExit(f"Holdout has {size} human-boxed images (need {MIN_HOLDOUT}); "
+                             "collect more boxed corrections before training")
+        run_name = f"finetune-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}"
+        weights = finetune(served_weights, data_yaml, args.work_dir, run_name, args)
+        state['candidate'] = {'version': run_name, 'weights': weights, 'base': served['version'],
+                              'sample_count': sum(len(os.listdir(os.path.join(args.work_dir, 'shards', s, 'images')))
+                                                  for s in state['shards'])}
+        state['evaluation'] = None
+        save_state(args.work_dir, state)
+
+    if 'evaluate' in stages and state['candidate'] and state['evaluation'] is None:
+        size = holdout_size(args.work_dir)
+        if size < MIN_HOLDOUT:
+            raise SystemExit(f"Holdout has {size} images (need {MIN_HOLDOUT}); collect more corrections first")
+        state['evaluation'] = {'holdout_size': size,
+                               'incumbent': evaluate(served_weights, data_yaml, args),
+                               'candidate': evaluate(state['candidate']['weights'], data_yaml, args)}
+        save_state(args.work_dir, state)
+        for name in ('incumbent', 'candidate'):
+            metrics = state['evaluation'][name]
+            print(f"{name:<10} mAP50={metrics['accuracy']:.4f} mAP50-95={metrics['map50_95']:.4f} "
+                  f"P={metrics['precision_score']:.3f} R={metrics['recall_score']:.3f}")
+
+    evaluation = state['evaluation']
+    if 'register' in stages and evaluation and 'registered' not in evaluation:
+        candidate = state['candidate']
+        gain = evaluation['candidate']['map50_95'] - evaluation['incumbent']['map50_95']
+        evaluation['registered'] = gain > args.min_gain
+        if evaluation['registered']:
+            # Keep the weights with the registry, independent of the work folder
+            target = os.path.join(args.registry_dir, 'weights', f"{candidate['version']}.pt")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(candidate['weights'], target)
+            now = datetime.now(timezone.utc).isoformat()
+            metrics = {k: v for k, v in evaluation['candidate'].items() if k in MODEL_FIELDS}
+            entry = register_version(args.registry_dir, version=candidate['version'],
+                                     weights_path=service_path(target), variant=served['variant'],
+                                     sample_count=candidate['sample_count'], training_date=now, created_at=now,
+                                     status='available', **metrics)
+            source.add_model_version(entry)
+            print(f"✓ Registered {candidate['version']} (mAP50-95 {gain:+.4f}); activate it with POST /models/activate")
+        else:
+            print(f"Not registered: mAP50-95 {gain:+.4f} vs {served['version']} (needs > {args.min_gain:+.4f})")
+        save_state(args.work_dir, state)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+"""
+Supervise a YOLO training run: follow results.csv as epochs finish and stop the trainer at
+an epoch boundary once a target epoch, an mAP50-95 plateau or a wall-clock budget is reached.
+
+    python scripts/training_supervisor.py --target-epoch 7 -- python train_electronics.py
+    python scripts/training_supervisor.py --patience 5 --max-hours 10 -- yolo train data=data.yaml model=yolov8m.pt
+    python scripts/training_supervisor.py --results runs/detect/train3/results.csv --pid 12345 --target-epoch 30
+
+Runs on Linux, macOS and Windows. The trainer is either started here (everything after --)
+or attached to with --pid. results.csv is tailed from a byte offset, so each poll reads
+only the rows appended since the last one. Rows already in the file when the supervisor starts
+(a run attached to, or resumed) are never acted on; they only set the best mAP50-95 to beat.
+
+Stopping: ultralytics writes a results.csv row and then saves weights/last.pt. The
+supervisor waits for that checkpoint and then interrupts the trainer (SIGINT, or
+CTRL_BREAK on Windows), escalating to terminate/kill if it does not exit.
+`yolo train resume=True model=<run>/weights/last.pt` (or resume_training.py) continues from there.
+
+Per-epoch wall time (from the `time` column) and, with --images-per-epoch, images/s are
+printed and written to <run>/supervisor.json for capacity planning.
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import signal
+import argparse
+import subprocess
+
+MAP_COLUMN = 'metrics/mAP50-95(B)'
+POLL_SECONDS = 2.0
+# How long to wait for last.pt after the epoch's row appears before stopping anyway
+CHECKPOINT_WAIT_SECONDS = 120
+# Grace period after the interrupt before terminate, and again before kill
+EXIT_GRACE_SECONDS = 60
+
+
+class CsvTail:
+    """Incremental reader of an append-only CSV: only bytes past the last offset are read"""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.header = None
+        self._partial = b''
+
+    def rows(self, until=None):
+        """New complete rows as dicts (stripped keys and values), read up to byte until if given; [] if nothing was appended"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset:
+            # Truncated or replaced (a new run in the same folder): start over
+            self.offset, self.header, self._partial = 0, None, b''
+        if until is not None:
+            size = min(size, until)
+        if size == self.offset:
+            return []
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read(size - self.offset)
+        self.offset += len(chunk)
+
+        lines = (self._partial + chunk).split(b'\n')
+        # A row still being written has no newline yet; keep it for the next poll
+        self._partial = lines.pop()
+        rows = []
+        for line in lines:
+            values = [v.strip() for v in line.decode('utf-8', 'replace').split(',')]
+            if not any(values):
+                continue
+            if self.header is None:
+                self.header = values
+                continue
+            rows.append(dict(zip(self.header, values)))
+        return rows
+
+
+def _float(row, key):
+    try:
+        return float(row[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class StopPolicy:
+    """Decides after each epoch whether training should stop, and why"""
+
+    def __init__(self, target_epoch=None, patience=None, min_delta=0.0, max_seconds=None):
+        self.target_epoch = target_epoch
+        self.patience = patience
+        self.min_delta = min_delta
+        self.max_seconds = max_seconds
+        self.best = None
+        self.best_epoch = None
+
+    def seed(self, epoch, score):
+        """
+        Take an epoch finished before supervision began: its score raises the bar for
+        improvement, but patience counts from the latest such epoch, and nothing is stopped
+        """
+        if score is not None and (self.best is None or score > self.best):
+            self.best = score
+        if self.best is not None:
+            self.best_epoch = epoch
+
+    def check(self, epoch, score, elapsed, epoch_seconds):
+        """Reason to stop after this epoch, or None"""
+        if score is not None and (self.best is None or score > self.best + self.min_delta):
+            self.best, self.best_epoch = score, epoch
+
+        if self.target_epoch is not None and epoch >= self.target_epoch:
+            return f'reached target epoch {self.target_epoch}'
+        if self.patience and self.best_epoch is not None and epoch - self.best_epoch >= self.patience:
+            return f'{MAP_COLUMN} plateaued at {self.best:.4f} (epoch {self.best_epoch}, patience {self.patience})'
+        # Stop at this boundary if another epoch would overrun the budget
+        if self.max_seconds is not None and epoch_seconds and elapsed + epoch_seconds > self.max_seconds:
+            return f'wall-clock budget of {self.max_seconds / 3600:.2f} h would be exceeded by the next epoch'
+        return None
+
+
+class Trainer:
+    """The supervised training process, started here or attached to by PID"""
+
+    def __init__(self, command=None, pid=None):
+        self.process = None
+        if command:
+            # A separate process group lets Windows deliver CTRL_BREAK to the trainer only
+            flags = subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0
+            self.process = subprocess.Popen(command, creationflags=flags)
+            self.pid = self.process.pid
+        else:
+            self.pid = pid
+
+    def running(self):
+        if self.process is not None:
+            return self.process.poll() is None
+        if self.pid is None:
+            return True
+        try:
+            os.kill(self.pid, 0)
+        except PermissionError:
+            return True
+        except OSError:
+            return False
+        return True
+
+    def interrupt(self):
+        """Ask the trainer to stop the way a user at its console would"""
+        if self.pid is None:
+            return
+        if os.name == 'nt' and self.process is not None:
+            self.process.send_signal(signal.CTRL_BREAK_EVENT)
+        elif os.name == 'nt':
+            os.kill(self.pid, signal.SIGTERM)
+        else:
+            os.kill(self.pid, signal.SIGINT)
+
+    def stop(self, grace=EXIT_GRACE_SECONDS):
+        """Interrupt, then terminate, then kill, waiting up to grace seconds between steps"""
+        if self.pid is None:
+            print("No trainer process to stop (use --pid or pass the command after --)")
+            return
+        for step, action in (('interrupt', self.interrupt), ('terminate', self._terminate), ('kill', self._kill)):
+            if not self.running():
+                return
+            print(f"Sending {step} to trainer (pid {self.pid})")
+            try:
+                action()
+            except OSError as e:
+                print(f"⚠ {step} failed: {e}")
+            deadline = time.monotonic() + grace
+            while self.running() and time.monotonic() < deadline:
+                time.sleep(0.5)
+
+    def _terminate(self):
+        if self.process is not None:
+            self.process.terminate()
+        else:
+            os.kill(self.pid, signal.SIGTERM)
+
+    def _kill(self):
+        if self.process is not None:
+            self.process.kill()
+        else:
+            os.kill(self.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+
+
+def results_files(root='runs'):
+    """{path: size in bytes} of every results.csv under root"""
+    sizes = {}
+    for path in glob.glob(os.path.join(root, '**', 'results.csv'), recursive=True):
+        try:
+            sizes[path] = os.path.getsize(path)
+        except OSError:
+            pass
+    return sizes
+
+
+def latest_results(root='runs'):
+    """Most recently modified results.csv under root"""
+    paths = glob.glob(os.path.join(root, '**', 'results.csv'), recursive=True)
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def follow(path, policy, until=None):
+    """
+    (CsvTail positioned after the rows already in path, cumulative time of the last of them).
+    Reading stops at byte until when given (the file's size when the supervisor started).
+    Those rows, e.g. of a resumed run, only seed the plateau policy; an epoch finished before
+    supervision never stops the trainer and never counts as one epoch's wall time.
+    """
+    tail = CsvTail(path)
+    history = tail.rows(until)
+    previous_time = None
+    for row in history:
+        policy.seed(int(_float(row, 'epoch') or 0), _float(row, MAP_COLUMN))
+        previous_time = _float(row, 'time')
+    if history:
+        print(f"{path}: {len(history)} earlier epochs (up to epoch {history[-1].get('epoch')}) are not checked")
+    return tail, previous_time
+
+
+def wait_for_checkpoint(run_dir, since, timeout=CHECKPOINT_WAIT_SECONDS):
+    """Wait until weights/last.pt is at least as new as since (when the epoch's row was written)"""
+    last = os.path.join(run_dir, 'weights', 'last.pt')
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if os.path.getmtime(last) >= since:
+                # Give the writer a moment to finish the file
+                time.sleep(0.5)
+                return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stop YOLO training on a target epoch, an mAP plateau or a time budget')
+    parser.add_argument('--results', help='results.csv to follow (default: newest under runs/ once training starts)')
+    parser.add_argument('--pid', type=int, help='attach to an already running trainer')
+    parser.add_argument('--target-epoch', type=int)
+    parser.add_argument('--patience', type=int, help=f'epochs without {MAP_COLUMN} improvement before stopping')
+    parser.add_argument('--min-delta', type=float, default=0.001, help='smallest mAP50-95 gain that counts as improvement')
+    parser.add_argument('--max-hours', type=float, help='wall-clock budget from supervisor start')
+    parser.add_argument('--images-per-epoch', type=int, help='training images per epoch, for images/s')
+    parser.add_argument('--poll', type=float, default=POLL_SECONDS)
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='-- trainer command to start and supervise')
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not (args.target_epoch or args.patience or args.max_hours):
+        parser.error('give at least one of --target-epoch, --patience, --max-hours')
+
+    started = time.time()
+    max_seconds = args.max_hours * 3600 if args.max_hours else None
+    policy = StopPolicy(args.target_epoch, args.patience, args.min_delta, max_seconds)
+    # Rows already on disk (a resumed run appends to its results.csv) are history, not new epochs
+    existing = results_files()
+    results = args.results
+    tail, previous_time = follow(results, policy) if results else (None, None)
+    trainer = Trainer(command, args.pid)
+
+    summary = {'results': results, 'epochs': [], 'stopped': None}
+    reason = None
+
+    try:
+        while reason is None:
+            if tail is None:
+                # A freshly started trainer creates its run folder after start-up
+                found = latest_results()
+                if found and os.path.getmtime(found) >= started:
+                    results = found
+                    tail, previous_time = follow(found, policy, existing.get(found, 0))
+                    summary['results'] = results
+                    print(f"Following {results}")
+
+            rows = tail.rows() if tail else []
+            # last.pt is saved just after the row, so it is at least as new as the csv
+            written = os.path.getmtime(results) if rows else None
+            for row in rows:
+                epoch = int(_float(row, 'epoch') or 0)
+                cumulative = _float(row, 'time')
+                epoch_seconds = cumulative - previous_time if cumulative is not None and previous_time is not None else cumulative
+                epoch_seconds = round(epoch_seconds, 1) if epoch_seconds is not None else None
+                previous_time = cumulative
+                score = _float(row, MAP_COLUMN)
+
+                record = {'epoch': epoch, 'epoch_seconds': epoch_seconds, MAP_COLUMN: score}
+                line = f"epoch {epoch}: {MAP_COLUMN}={score if score is not None else '-'}"
+                if epoch_seconds:
+                    line += f", {epoch_seconds:.0f}s"
+                    if args.images_per_epoch:
+                        record['images_per_second'] = round(args.images_per_epoch / epoch_seconds, 2)
+                        line += f" ({record['images_per_second']} img/s)"
+                print(f"[{time.strftime('%H:%M:%S')}] {line}")
+                summary['epochs'].append(record)
+
+                reason = policy.check(epoch, score, time.time() - started, epoch_seconds)
+                if reason:
+                    summary['stopped'] = {'epoch': epoch, 'reason': reason}
+                    print(f"Stopping: {reason}")
+                    if not wait_for_checkpoint(os.path.dirname(results), written):
+                        print("⚠ last.pt was not updated; stopping anyway")
+                    break
+
+            if reason is None:
+                if max_seconds is not None and time.time() - started > max_seconds:
+                    reason = 'wall-clock budget exhausted mid-epoch'
+                    summary['stopped'] = {'epoch': None, 'reason': reason}
+                    print(f"Stopping: {reason}")
+                elif not trainer.running():
+                    print("Trainer exited")
+                    break
+                else:
+                    time.sleep(args.poll)
+
+        if reason:
+            trainer.stop()
+    except KeyboardInterrupt:
+        print("Interrupted; stopping trainer")
+        summary['stopped'] = {'epoch': None, 'reason': 'supervisor interrupted'}
+        trainer.stop()
+    finally:
+        epochs = [e['epoch_seconds'] for e in summary['epochs'] if e['epoch_seconds']]
+        if epochs:
+            summary['mean_epoch_seconds'] = round(sum(epochs) / len(epochs), 1)
+            print(f"Mean epoch time: {summary['mean_epoch_seconds']}s over {len(epochs)} epochs")
+        if results:
+            with open(os.path.join(os.path.dirname(results), 'supervisor.json'), 'w') as f:
+                json.dump(summary, f, indent=2)
+
+    if reason or trainer.process is None:
+        return 0
+    return trainer.process.returncode or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+// Client for the Python AI service: pooled keep-alive connections, per-call deadlines,
+// coalescing of identical in-flight uploads, a circuit breaker and latency histograms.
+import http from 'http';
+import https from 'https';
+import crypto from 'crypto';
+import fs from 'fs';
+
+const DEFAULT_TIMEOUT_MS = Number(process.env.AI_TIMEOUT_MS || 15000);
+const MAX_SOCKETS = Number(process.env.AI_MAX_SOCKETS || 16);
+// Consecutive failures that open the breaker, and how long it stays open before a probe
+const BREAKER_THRESHOLD = Number(process.env.AI_BREAKER_THRESHOLD || 5);
+const BREAKER_RESET_MS = Number(process.env.AI_BREAKER_RESET_MS || 30000);
+
+// Upper bounds (ms) of the latency histogram buckets; the last bucket is +Inf
+const LATENCY_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000];
+
+export class AIServiceError extends Error {
+    // code: CIRCUIT_OPEN | TIMEOUT | UNREACHABLE | BAD_RESPONSE | HTTP_ERROR
+    constructor(message, code, status = null, body = null) {
+        super(message);
+        this.name = 'AIServiceError';
+        this.code = code;
+        this.status = status;
+        this.body = body;
+    }
+}
+
+class LatencyHistogram {
+    constructor() {
+        this.counts = new Array(LATENCY_BUCKETS.length + 1).fill(0);
+        this.count = 0;
+        this.sum = 0;
+    }
+
+    observe(ms) {
+        const i = LATENCY_BUCKETS.findIndex(bound => ms <= bound);
+        this.counts[i === -1 ? LATENCY_BUCKETS.length : i] += 1;
+        this.count += 1;
+        this.sum += ms;
+    }
+
+    // Upper bound of the bucket holding the q-th quantile
+    quantile(q) {
+        if (!this.count) return null;
+        let seen = 0;
+        for (let i = 0; i < this.counts.length; i++) {
+            seen += this.counts[i];
+            if (seen >= q * this.count) return i < LATENCY_BUCKETS.length ? LATENCY_BUCKETS[i] : Infinity;
+        }
+        return Infinity;
+    }
+
+    snapshot() {
+        let cumulative = 0;
+        const buckets = {};
+        LATENCY_BUCKETS.forEach((bound, i) => {
+            cumulative += this.counts[i];
+            buckets[bound] = cumulative;
+        });
+        buckets['+Inf'] = this.count;
+        return {
+            count: this.count,
+            avg_ms: this.count ? Math.round(this.sum / this.count) : null,
+            p50_ms: this.quantile(0.5),
+            p95_ms: this.quantile(0.95),
+            p99_ms: this.quantile(0.99),
+            buckets
+        };
+    }
+}
+
+class CircuitBreaker {
+    constructor(threshold, resetMs) {
+        this.threshold = threshold;
+        this.resetMs = resetMs;
+        this.state = 'closed';
+        this.failures = 0;
+        this.openedAt = 0;
+        this.probing = false;
+        this.trips = 0;
+    }
+
+    // closed: everything passes; open: nothing until resetMs; half_open: a single probe
+    allow() {
+        if (this.state === 'open' && Date.now() - this.openedAt >= this.resetMs) {
+            this.state = 'half_open';
+        }
+        if (this.state === 'half_open' && !this.probing) {
+            this.probing = true;
+            return true;
+        }
+        return this.state === 'closed';
+    }
+
+    success() {
+        this.state = 'closed';
+        this.failures = 0;
+        this.probing = false;
+    }
+
+    failure() {
+        this.failures += 1;
+        this.probing = false;
+        if (this.state === 'half_open' || this.failures >= this.threshold) {
+            if (this.state !== 'open') this.trips += 1;
+            this.state = 'open';
+            this.openedAt = Date.now();
+        }
+    }
+
+    snapshot() {
+        return {
+            state: this.state,
+            consecutive_failures: this.failures,
+            trips: this.trips,
+            retry_in_ms: this.state === 'open' ? Math.max(0, this.resetMs - (Date.now() - this.openedAt)) : 0
+        };
+    }
+}
+
+function multipartBody(fields, file, buffer) {
+    const boundary = `----lostfound${crypto.randomBytes(12).toString('hex')}`;
+    const parts = [];
+    for (const [name, value] of Object.entries(fields)) {
+        if (value === undefined || value === null) continue;
+        parts.push(Buffer.from(`--${boundary}\r\nContent-Disposition: form-data; name="${name}"\r\n\r\n${value}\r\n`));
+    }
+    const filename = (file.originalname || 'image.jpg').replace(/"/g, '');
+    parts.push(Buffer.from(`--${boundary}\r\nContent-Disposition: form-data; name="image"; filename="${filename}"\r\n` +
+        `Content-Type: ${file.mimetype || 'application/octet-stream'}\r\n\r\n`));
+    parts.push(buffer);
+    parts.push(Buffer.from(`\r\n--${boundary}--\r\n`));
+    return { body: Buffer.concat(parts), contentType: `multipart/form-data; boundary=${boundary}` };
+}
+
+export class AIClient {
+    constructor(baseUrl, { timeoutMs = DEFAULT_TIMEOUT_MS, maxSockets = MAX_SOCKETS,
+        breakerThreshold = BREAKER_THRESHOLD, breakerResetMs = BREAKER_RESET_MS } = {}) {
+        this.baseUrl = baseUrl ? new URL(baseUrl) : null;
+        this.timeoutMs = timeoutMs;
+        const transport = this.baseUrl?.protocol === 'https:' ? https : http;
+        this.transport = transport;
+        this.agent = new transport.Agent({ keepAlive: true, maxSockets, maxFreeSockets: maxSockets });
+        this.breaker = new CircuitBreaker(breakerThreshold, breakerResetMs);
+        this.inFlight = new Map();
+        this.histograms = new Map();
+        this.counters = { requests: 0, coalesced: 0, failures: 0, rejected_open: 0, timeouts: 0 };
+    }
+
+    get configured() {
+        return this.baseUrl !== null;
+    }
+
+    // POST an uploaded image (multer disk file or { buffer, mimetype, originalname }) as multipart
+    async postImage(endpoint, file, { fields = {}, headers = {}, timeoutMs } = {}) {
+        const buffer = file.buffer || await fs.promises.readFile(file.path);
+        const digest = crypto.createHash('sha256').update(buffer).digest('hex');
+        // Identical uploads with identical options share one call to the service
+        const key = `${endpoint}|${digest}|${JSON.stringify(fields)}|${JSON.stringify(headers)}`;
+        const pending = this.inFlight.get(key);
+        if (pending) {
+            this.counters.coalesced += 1;
+            return pending;
+        }
+        const { body, contentType } = multipartBody(fields, file, buffer);
+        const call = this.request('POST', endpoint, body, { ...headers, 'Content-Type': contentType }, timeoutMs)
+            .finally(() => this.inFlight.delete(key));
+        this.inFlight.set(key, call);
+        return call;
+    }
+
+    // POST a multer disk file as the raw request body, streamed from disk (videos are too big to buffer)
+    async postFile(endpoint, file, { headers = {}, timeoutMs } = {}) {
+        const { size } = await fs.promises.stat(file.path);
+        const body = { length: size, stream: () => fs.createReadStream(file.path) };
+        return this.request('POST', endpoint, body,
+            { ...headers, 'Content-Type': file.mimetype || 'application/octet-stream' }, timeoutMs);
+    }
+
+    async postJSON(endpoint, payload, { headers = {}, timeoutMs } = {}) {
+        return this.request('POST', endpoint, Buffer.from(JSON.stringify(payload)),
+            { ...headers, 'Content-Type': 'application/json' }, timeoutMs);
+    }
+
+    // Resolves { status, headers, body } for any HTTP answer below 500 and for 503 (LOADING / DEGRADED);
+    // rejects with AIServiceError when the service is unreachable, slow, broken or the breaker is open
+    async request(method, endpoint, body, headers = {}, timeoutMs = this.timeoutMs) {
+        if (!this.configured) throw new AIServiceError('AI_SERVICE_URL is not set', 'UNREACHABLE');
+        if (!this.breaker.allow()) {
+            this.counters.rejected_open += 1;
+            throw new AIServiceError('AI service circuit is open', 'CIRCUIT_OPEN');
+        }
+        this.counters.requests += 1;
+        const started = process.hrtime.bigint();
+        try {
+            const response = await this.send(method, endpoint, body, headers, timeoutMs);
+            // 503 is the service answering "loading" or "shedding load": healthy enough, not a failure
+            if (response.status >= 500 && response.status !== 503) {
+                throw new AIServiceError(`AI service returned ${response.status}`, 'HTTP_ERROR', response.status, response.body);
+            }
+            this.breaker.success();
+            return response;
+        } catch (error) {
+            this.counters.failures += 1;
+            if (error.code === 'TIMEOUT') this.counters.timeouts += 1;
+            this.breaker.failure();
+            throw error;
+        } finally {
+            this.histogram(endpoint).observe(Number(process.hrtime.bigint() - started) / 1e6);
+        }
+    }
+
+    send(method, endpoint, body, headers, timeoutMs) {
+        return new Promise((resolve, reject) => {
+            const url = new URL(endpoint, this.baseUrl);
+            const req = this.transport.request(url, {
+                method,
+                agent: this.agent,
+                headers: { ...headers, 'Content-Length': body ? body.length : 0, Accept: 'application/json' }
+            }, res => {
+                const chunks = [];
+                res.on('data', chunk => chunks.push(chunk));
+                res.on('error', error => reject(new AIServiceError(error.message, 'UNREACHABLE')));
+                res.on('end', () => {
+                    clearTimeout(deadline);
+                    const text = Buffer.concat(chunks).toString('utf8');
+                    let parsed = text;
+                    if ((res.headers['content-type'] || '').includes('application/json')) {
+                        try {
+                            parsed = JSON.parse(text);
+                        } catch {
+                            return reject(new AIServiceError('AI service sent invalid JSON', 'BAD_RESPONSE', res.statusCode));
+                        }
+                    }
+                    resolve({ status: res.statusCode, headers: res.headers, body: parsed });
+                });
+            });
+            // One deadline for the whole call: connect, upload, inference and download
+            const deadline = setTimeout(() => {
+                req.destroy(new AIServiceError(`AI service did not answer within ${timeoutMs} ms`, 'TIMEOUT'));
+            }, timeoutMs);
+            req.on('error', error => {
+                clearTimeout(deadline);
+                reject(error instanceof AIServiceError ? error : new AIServiceError(error.message, 'UNREACHABLE'));
+            });
+            if (body?.stream) {
+                body.stream()
+                    .on('error', error => req.destroy(new AIServiceError(error.message, 'UNREACHABLE')))
+                    .pipe(req);
+            } else {
+                if (body) req.write(body);
+                req.end();
+            }
+        });
+    }
+
+    histogram(endpoint) {
+        let histogram = this.histograms.get(endpoint);
+        if (!histogram) {
+            histogram = new LatencyHistogram();
+            this.histograms.set(endpoint, histogram);
+        }
+        return histogram;
+    }
+
+    metrics() {
+        const sockets = Object.values(this.agent.sockets).reduce((n, list) => n + list.length, 0);
+        const idle = Object.values(this.agent.freeSockets).reduce((n, list) => n + list.length, 0);
+        return {
+            ...this.counters,
+            in_flight: this.inFlight.size,
+            sockets: { active: sockets, idle, max: this.agent.maxSockets },
+            breaker: this.breaker.snapshot(),
+            latency_ms: Object.fromEntries([...this.histograms].map(([endpoint, h]) => [endpoint, h.snapshot()]))
+        };
+    }
+}
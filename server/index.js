@@ -7,7 +7,9 @@ import { createClient } from '@supabase/supabase-js';
 import multer from 'multer';
 import { v4 as uuidv4 } from 'uuid';
 import path from 'path';
+import fs from 'fs';
 import { fileURLToPath } from 'url';
+import { AIClient, AIServiceError } from './aiClient.js';
 
 dotenv.config();
 
@@ -54,6 +56,18 @@ const upload = multer({
     }
 });
 
+// Short clips for the multi-frame inventory (POST /api/ai/video); spooled to disk, never buffered
+const videoUpload = multer({
+    storage,
+    limits: { fileSize: Number(process.env.AI_VIDEO_MAX_MB || 100) * 1024 * 1024 },
+    fileFilter: (req, file, cb) => {
+        if (/^video\//.test(file.mimetype)) {
+            return cb(null, true);
+        }
+        cb(new Error('Only video files are allowed'));
+    }
+});
+
 // Supabase client
 const supabaseUrl = process.env.SUPABASE_URL;
 const supabaseKey = process.env.SUPABASE_SERVICE_ROLE_KEY;
@@ -64,6 +78,163 @@ const AI_SERVICE_URL = process.env.AI_SERVICE_URL;
 if (!AI_SERVICE_URL) {
     console.warn('⚠️  WARNING: AI_SERVICE_URL environment variable is not set. AI features will not work.');
 }
+const aiClient = new AIClient(AI_SERVICE_URL);
+const DUPLICATE_CHECK_TIMEOUT_MS = Number(process.env.AI_DUPLICATE_CHECK_TIMEOUT_MS || 2000);
+// A clip is decoded and run through the detector frame by frame: allow far longer than a still
+const VIDEO_TIMEOUT_MS = Number(process.env.AI_VIDEO_TIMEOUT_MS || 120000);
+
+// A new item reaches the match engine even if the AI service is loading (503 LOADING during a
+// cold start or model hot-swap), shedding load or briefly down: retried with backoff, honouring Retry-After
+const MATCH_RETRY_ATTEMPTS = Number(process.env.AI_MATCH_RETRY_ATTEMPTS || 8);
+const MATCH_RETRY_BASE_MS = Number(process.env.AI_MATCH_RETRY_BASE_MS || 2000);
+const MATCH_RETRY_MAX_MS = 5 * 60 * 1000;
+const RETRYABLE_CODES = new Set(['CIRCUIT_OPEN', 'TIMEOUT', 'UNREACHABLE', 'HTTP_ERROR']);
+
+function retryDelayMs(attempt, retryAfter) {
+    const seconds = Number(retryAfter);
+    const backoff = Number.isFinite(seconds) && seconds > 0 ? seconds * 1000 : MATCH_RETRY_BASE_MS * 2 ** attempt;
+    // Jitter, so items queued during one outage do not all come back at once
+    return Math.min(MATCH_RETRY_MAX_MS, backoff) * (1 + Math.random() * 0.2);
+}
+
+// Register a new item with the AI service's match engine (which also indexes its image) and
+// notify both owners of every likely lost<->found match. Fire-and-forget: item creation never waits.
+async function matchNewItem(item, file, attempt = 0) {
+    if (!aiClient.configured || !item) return;
+    const fields = {
+        item_id: item.id, type: item.type, category: item.category || undefined,
+        title: item.title || undefined, description: item.description || undefined,
+        location: item.location || undefined, created_at: item.created_at || undefined,
+        user_id: item.user_id || undefined
+    };
+    let response;
+    try {
+        response = file
+            ? await aiClient.postImage('/match/add', file, { fields, timeoutMs: 30000 })
+            : await aiClient.postJSON('/match/add', fields);
+    } catch (error) {
+        if (!(error instanceof AIServiceError) || !RETRYABLE_CODES.has(error.code)) {
+            console.error(`AI match failed for item ${item.id}:`, error.message);
+            return;
+        }
+        response = { status: error.status || 503, headers: {}, error: error.message };
+    }
+
+    if (response.status === 503 || response.status === 429 || response.error) {
+        if (attempt + 1 >= MATCH_RETRY_ATTEMPTS) {
+            console.error(`AI match gave up on item ${item.id} after ${attempt + 1} attempts:`,
+                response.error || `AI service returned ${response.status}`);
+            return;
+        }
+        const delay = retryDelayMs(attempt, response.headers['retry-after']);
+        console.warn(`AI match for item ${item.id} deferred (${response.error || response.status}); retrying in ${Math.round(delay / 1000)}s`);
+        setTimeout(() => matchNewItem(item, file, attempt + 1), delay).unref();
+        return;
+    }
+    if (response.status >= 400) {
+        console.error(`AI match rejected item ${item.id}: AI service returned ${response.status}`);
+        return;
+    }
+    try {
+        await notifyMatches(item, response.body.matches || []);
+    } catch (error) {
+        console.error(`Match notifications failed for item ${item.id}:`, error.message);
+    }
+}
+
+async function notifyMatches(item, matches) {
+    const rows = [];
+    for (const match of matches) {
+        const percent = Math.round(match.score * 100);
+        if (item.user_id) {
+            rows.push({
+                user_id: item.user_id,
+                title: `Possible match for your ${item.type} item`,
+                message: `"${match.title || 'An item'}" was reported ${match.type} and looks like your "${item.title}" (${percent}% match).`
+            });
+        }
+        if (match.user_id && match.user_id !== item.user_id) {
+            rows.push({
+                user_id: match.user_id,
+                title: `Possible match for your ${match.type} item`,
+                message: `"${item.title}" was just reported ${item.type} and looks like your "${match.title || 'item'}" (${percent}% match).`
+            });
+        }
+    }
+    if (!rows.length) return;
+    const { error } = await supabase.from('notifications').insert(rows);
+    if (error) throw error;
+}
+
+// Items whose photo is a near-duplicate of this upload; a quick check, skipped if the service is slow or down
+async function findDuplicates(file) {
+    if (!aiClient.configured || !file) return [];
+    try {
+        const response = await aiClient.postImage('/duplicates', file, { timeoutMs: DUPLICATE_CHECK_TIMEOUT_MS });
+        return response.status === 200 ? response.body.duplicates || [] : [];
+    } catch (error) {
+        console.error('Duplicate check failed:', error.message);
+        return [];
+    }
+}
+
+async function removeFromMatching(itemId) {
+    if (!aiClient.configured) return;
+    try {
+        const response = await aiClient.postJSON('/match/remove', { item_id: itemId });
+        if (response.status >= 400) throw new Error(`AI service returned ${response.status}`);
+    } catch (error) {
+        console.error('AI match remove failed:', error.message);
+    }
+}
+
+// Pass the caller's latency budget and model choice through to the AI service
+function aiRequestHeaders(req) {
+    const headers = {};
+    const budget = req.get('X-Latency-Budget-Ms') || req.body?.latency_budget_ms;
+    if (budget) headers['X-Latency-Budget-Ms'] = String(budget);
+    if (req.body?.model) headers['X-Model'] = String(req.body.model);
+    return headers;
+}
+
+// Fields of the upload form forwarded as-is (see ai_service/main.py)
+function aiRequestFields(req) {
+    const fields = {};
+    for (const name of ['tiling', 'outputs']) {
+        if (req.body?.[name]) fields[name] = String(req.body[name]);
+    }
+    return fields;
+}
+
+// Relay the service's answer: results, client errors and 503 LOADING / DEGRADED alike
+function relayAIResponse(response, res) {
+    const retryAfter = response.headers['retry-after'];
+    if (retryAfter) res.set('Retry-After', retryAfter);
+    const tier = response.headers['x-inference-tier'];
+    if (tier) res.set('X-Inference-Tier', tier);
+    return res.status(response.status).json(response.body);
+}
+
+// The service could not answer (down, timed out, circuit open): say so instead of inventing detections
+function aiFallback(res, error, extra = {}) {
+    const reason = error instanceof AIServiceError ? error.code : 'ERROR';
+    console.error(`AI request failed (${reason}):`, error.message);
+    res.set('X-AI-Fallback', reason);
+    return res.json({
+        detections: [],
+        count: 0,
+        ...extra,
+        status: 'FALLBACK',
+        fallback: true,
+        reason,
+        message: 'AI service unavailable; no automatic classification'
+    });
+}
+
+// Uploads to the AI routes are only forwarded, never kept
+function discardUpload(file) {
+    if (file) fs.promises.unlink(file.path).catch(() => {});
+}
 
 // ==================== API ROUTER ====================
 const apiRouter = express.Router();
@@ -186,12 +357,15 @@ apiRouter.post('/items/lost', upload.single('image'), async (req, res) => {
     try {
         const { title, description, category, location, user_id, contact_email } = req.body;
         const imageUrl = req.file ? `/uploads/${req.file.filename}` : null;
+        // Flag (not block) re-posts of an already reported photo
+        const duplicates = await findDuplicates(req.file);
         const { data, error } = await supabase.from('items').insert({
             title, description, category, location, type: 'lost', status: 'open',
             image_url: imageUrl, user_id: user_id || null, contact_email: contact_email || null
         }).select().single();
         if (error) throw error;
-        res.status(201).json(data);
+        matchNewItem(data, req.file);
+        res.status(201).json(duplicates.length ? { ...data, possible_duplicates: duplicates } : data);
     } catch (error) {
         res.status(500).json({ success: false, error: error.message });
     }
@@ -201,12 +375,15 @@ apiRouter.post('/items/found', upload.single('image'), async (req, res) => {
     try {
         const { title, description, category, location, user_id, contact_email } = req.body;
         const imageUrl = req.file ? `/uploads/${req.file.filename}` : null;
+        // Flag (not block) re-posts of an already reported photo
+        const duplicates = await findDuplicates(req.file);
         const { data, error } = await supabase.from('items').insert({
             title, description, category, location, type: 'found', status: 'open',
             image_url: imageUrl, user_id: user_id || null, contact_email: contact_email || null
         }).select().single();
         if (error) throw error;
-        res.status(201).json(data);
+        matchNewItem(data, req.file);
+        res.status(201).json(duplicates.length ? { ...data, possible_duplicates: duplicates } : data);
     } catch (error) {
         res.status(500).json({ success: false, error: error.message });
     }
@@ -219,6 +396,7 @@ apiRouter.put('/items/:id', async (req, res) => {
         const { data, error } = await supabase.from('items').update({ ...updates, updated_at: new Date() })
             .eq('id', id).select().single();
         if (error) throw error;
+        if (updates.status && !['open', 'active'].includes(updates.status)) removeFromMatching(id);
         res.json(data);
     } catch (error) {
         res.status(500).json({ success: false, error: error.message });
@@ -230,6 +408,7 @@ apiRouter.delete('/items/:id', async (req, res) => {
         const { id } = req.params;
         const { error } = await supabase.from('items').delete().eq('id', id);
         if (error) throw error;
+        removeFromMatching(id);
         res.json({ success: true, message: 'Item deleted' });
     } catch (error) {
         res.status(500).json({ success: false, error: error.message });
@@ -237,65 +416,65 @@ apiRouter.delete('/items/:id', async (req, res) => {
 });
 
 // --- AI ROUTES ---
+// One upload for detections, features, tags, embedding and crops ('outputs' selects; see ai_service/main.py)
+apiRouter.post('/ai/analyze', upload.single('image'), async (req, res) => {
+    if (!req.file) return res.status(400).json({ error: 'No image provided' });
+    try {
+        const response = await aiClient.postImage('/analyze', req.file,
+            { fields: aiRequestFields(req), headers: aiRequestHeaders(req) });
+        relayAIResponse(response, res);
+    } catch (error) {
+        aiFallback(res, error, { category: 'other', features: [], secondary_tags: [], confidence: 0 });
+    } finally {
+        discardUpload(req.file);
+    }
+});
+
 apiRouter.post('/ai/detect', upload.single('image'), async (req, res) => {
+    if (!req.file) return res.status(400).json({ error: 'No image provided' });
     try {
-        if (!req.file) return res.status(400).json({ error: 'No image provided' });
-        const formData = new FormData();
-        const blob = new Blob([req.file.buffer], { type: req.file.mimetype });
-        formData.append('image', blob, req.file.originalname);
-        const response = await fetch(`${AI_SERVICE_URL}/detect`, { method: 'POST', body: formData });
-        if (!response.ok) throw new Error('AI service failed');
-        const data = await response.json();
-        res.json(data);
+        const response = await aiClient.postImage('/detect', req.file,
+            { fields: aiRequestFields(req), headers: aiRequestHeaders(req) });
+        relayAIResponse(response, res);
     } catch (error) {
-        res.json({
-            detections: [
-                { class: 'bag', confidence: 0.85, bbox: [0, 0, 100, 100] },
-                { class: 'electronics', confidence: 0.72, bbox: [50, 50, 150, 150] }
-            ],
-            status: 'SUCCESS'
-        });
+        aiFallback(res, error);
+    } finally {
+        discardUpload(req.file);
     }
 });
 
 apiRouter.post('/ai/analyze-hybrid', upload.single('image'), async (req, res) => {
+    if (!req.file) return res.status(400).json({ error: 'No image provided' });
     try {
-        if (!req.file) return res.status(400).json({ error: 'No image provided' });
-        const formData = new FormData();
-        const blob = new Blob([req.file.buffer], { type: req.file.mimetype });
-        formData.append('image', blob, req.file.originalname);
-        const response = await fetch(`${AI_SERVICE_URL}/analyze-hybrid`, { method: 'POST', body: formData });
-        if (!response.ok) {
-            // Return fallback data when AI service is unavailable
-            return res.json({
-                detections: [{ class: 'electronics', category: 'electronics', confidence: 0.78, bbox: [50, 50, 200, 200] }],
-                category: 'electronics',
-                features: ['black', 'metallic'],
-                secondary_tags: ['valuable'],
-                status: 'SUCCESS',
-                confidence: 0.78,
-                fallback: true,
-                message: 'Using fallback classification'
-            });
-        }
-        const data = await response.json();
-        res.json(data);
+        const response = await aiClient.postImage('/analyze-hybrid', req.file,
+            { fields: aiRequestFields(req), headers: aiRequestHeaders(req) });
+        relayAIResponse(response, res);
     } catch (error) {
-        console.error('AI analysis error:', error);
-        // Return fallback data on error
-        res.json({
-            detections: [{ class: 'electronics', category: 'electronics', confidence: 0.78, bbox: [50, 50, 200, 200] }],
-            category: 'electronics',
-            features: ['black', 'metallic'],
-            secondary_tags: ['valuable'],
-            status: 'SUCCESS',
-            confidence: 0.78,
-            fallback: true,
-            message: 'Using fallback classification due to error'
-        });
+        aiFallback(res, error, { category: 'other', features: [], secondary_tags: [], confidence: 0 });
+    } finally {
+        discardUpload(req.file);
+    }
+});
+
+// Pan the camera along a shelf: one inventory of the items in the clip, each with its best crop
+apiRouter.post('/ai/video', videoUpload.single('video'), async (req, res) => {
+    if (!req.file) return res.status(400).json({ error: 'No video provided' });
+    try {
+        const response = await aiClient.postFile('/video', req.file,
+            { headers: aiRequestHeaders(req), timeoutMs: VIDEO_TIMEOUT_MS });
+        relayAIResponse(response, res);
+    } catch (error) {
+        aiFallback(res, error, { items: [] });
+    } finally {
+        discardUpload(req.file);
     }
 });
 
+// Connection pool, breaker state, coalescing counters and per-endpoint latency histograms
+apiRouter.get('/ai/metrics', (req, res) => {
+    res.json(aiClient.metrics());
+});
+
 apiRouter.post('/ai/chat', async (req, res) => {
     try {
         const { message } = req.body;
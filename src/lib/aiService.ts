@@ -1,4 +1,4 @@
-import { AIClassification, Item, Match, ChatbotResponse, UserFeedback, Notification } from '@/types';
+import { AIClassification, Item, Match, ChatbotResponse, UserFeedback, Notification, VideoInventory } from '@/types';
 import { API_BASE_URL } from '@/lib/api';
 
 // Enhanced image classification using Backend API
@@ -12,10 +12,12 @@ export async function classifyImage(imageUrl: string): Promise<AIClassification>
     // Prepare FormData
     const formData = new FormData();
     formData.append('image', file);
+    // Detections, tags and the embedding come back from a single upload and inference
+    formData.append('outputs', 'detections,features,secondary_tags,embedding');
 
     // Call Backend API
     // Note: strict-mode in React might cause double invocation, but that's fine for now
-    const apiResponse = await fetch(`${API_BASE_URL}/ai/analyze-hybrid`, {
+    const apiResponse = await fetch(`${API_BASE_URL}/ai/analyze`, {
       method: 'POST',
       body: formData,
     });
@@ -95,6 +97,28 @@ export async function classifyImage(imageUrl: string): Promise<AIClassification>
   }
 }
 
+// Inventory of the items in a short clip panned across a shelf, one entry (and best crop) per item
+export async function inventoryFromVideo(video: File): Promise<VideoInventory> {
+  try {
+    const formData = new FormData();
+    formData.append('video', video);
+
+    const apiResponse = await fetch(`${API_BASE_URL}/ai/video`, {
+      method: 'POST',
+      body: formData,
+    });
+
+    if (!apiResponse.ok) {
+      throw new Error(`AI Service Error: ${apiResponse.statusText}`);
+    }
+    const data = await apiResponse.json();
+    return { ...data, items: data.items || [], count: data.count || 0 };
+  } catch (error) {
+    console.error('Video inventory error:', error);
+    return { items: [], count: 0, status: 'FALLBACK', fallback: true };
+  }
+}
+
 // Helper to map specific classes to broader categories
 function mapClassToCategory(className: string): string {
   const electronics = ['smart phone', 'laptop_computer', 'laptop', 'mouse', 'keyboard', 'monitor', 'tv', 'earphone', 'headphone', 'tablet', 'watch', 'calculator', 'joy stick', 'printer', 'remote'];
@@ -31,6 +31,32 @@ export interface AIClassification {
   embedding?: number[];
 }
 
+// One physical item found in a shelf video (POST /api/ai/video), merged across frames
+export interface VideoInventoryItem {
+  class: string;
+  category: string;
+  confidence: number;
+  mean_confidence: number;
+  sightings: number;
+  first_frame: number;
+  last_frame: number;
+  first_seen_s: number | null;
+  last_seen_s: number | null;
+  best_frame: number;
+  bbox: number[];
+  features: string[];
+  crop: string; // base64 JPEG of the best view
+}
+
+export interface VideoInventory {
+  items: VideoInventoryItem[];
+  count: number;
+  frames?: { sampled: number; skipped: number; keyframes: number; truncated: boolean };
+  duration_s?: number | null;
+  status: string;
+  fallback?: boolean;
+}
+
 export interface Item {
   id: string;
   title: string;
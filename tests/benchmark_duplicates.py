@@ -0,0 +1,77 @@
+"""
+Near-duplicate lookup (perceptual_hash.HammingIndex) at 1M hashes.
+
+    python tests/benchmark_duplicates.py
+    python tests/benchmark_duplicates.py --hashes 1000000 --queries 20000 --max-distance 8
+
+Half of the queries are indexed hashes with up to --max-distance bits flipped (re-encoded
+re-posts), half are unseen hashes. Reports per-query latency, and recall against a brute-force
+scan for a sample of queries.
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service')))
+
+from perceptual_hash import HammingIndex, hamming_many
+
+
+def random_hashes(rng, n):
+    return rng.integers(0, 2 ** 32, n, dtype=np.uint64) << np.uint64(32) | rng.integers(0, 2 ** 32, n, dtype=np.uint64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Hamming-distance duplicate lookup')
+    parser.add_argument('--hashes', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=10000)
+    parser.add_argument('--max-distance', type=int, default=6)
+    parser.add_argument('--verify', type=int, default=200, help='queries checked against a brute-force scan')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    hashes = random_hashes(rng, args.hashes)
+    index = HammingIndex()
+    start = time.perf_counter()
+    for i, value in enumerate(hashes.tolist()):
+        index.add(i, value)
+    print(f"Indexed {len(index)} hashes in {time.perf_counter() - start:.1f}s")
+
+    queries = []
+    for i in range(args.queries):
+        if i % 2:
+            queries.append(int(rng.integers(0, 2 ** 63)) | int(rng.integers(0, 2)) << 63)
+        else:
+            value = int(hashes[rng.integers(args.hashes)])
+            for bit in rng.choice(64, rng.integers(0, args.max_distance + 1), replace=False):
+                value ^= 1 << int(bit)
+            queries.append(value)
+
+    index.search(queries[0], args.max_distance)  # builds the probe masks
+    latencies, found = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        found += bool(index.search(query, args.max_distance))
+        latencies.append((time.perf_counter() - start) * 1e6)
+    latencies = np.asarray(latencies)
+    print(f"\n{args.queries} queries, max distance {args.max_distance}")
+    print(f"  latency us  p50 {np.percentile(latencies, 50):.0f}  p95 {np.percentile(latencies, 95):.0f}"
+          f"  p99 {np.percentile(latencies, 99):.0f}  max {latencies.max():.0f}")
+    print(f"  queries with a duplicate: {found / len(queries):.1%}")
+
+    missed = expected = 0
+    for query in queries[:args.verify]:
+        truth = set(np.flatnonzero(hamming_many(hashes, query) <= args.max_distance).tolist())
+        got = {key for key, _ in index.search(query, args.max_distance)}
+        expected += len(truth)
+        missed += len(truth - got)
+    if expected:
+        print(f"  recall vs brute force: {1 - missed / expected:.2%} ({expected} true duplicates in {args.verify} queries)")
+
+
+if __name__ == '__main__':
+    main()
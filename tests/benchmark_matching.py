@@ -0,0 +1,108 @@
+"""
+Lost <-> found matching (ai_service/match_engine.py) at scale, on a synthetic open-item population.
+
+    python tests/benchmark_matching.py
+    python tests/benchmark_matching.py --open-items 100000 --queries 2000 --window-days 30
+
+Loads --open-items items (no matching), then reports latency of --queries incremental adds,
+each of which blocks, scores and ranks its candidates. Also reported: how many open items the
+blocking step leaves to score, and the resident memory of the engine plus the vector index.
+"""
+
+import os
+import sys
+import time
+import argparse
+import resource
+import numpy as np
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service')))
+
+from ai_engine import VALID_CATEGORIES
+from vector_index import VectorIndex
+from match_engine import MatchEngine
+
+DAYS = 180
+DIM = 128
+PLACES = ['library', 'cafeteria', 'gym', 'main hall', 'parking lot', 'bus stop', 'lab building',
+          'dorm a', 'dorm b', 'stadium', 'bookstore', 'student center', 'pool', 'auditorium']
+COLOURS = ['red', 'blue', 'green', 'black', 'white', 'gray', 'brown', 'yellow', 'bright', 'dark', 'vibrant']
+WORDS = ['black', 'blue', 'leather', 'small', 'large', 'phone', 'wallet', 'keys', 'bag', 'jacket', 'bottle',
+         'laptop', 'charger', 'card', 'student', 'id', 'book', 'notebook', 'umbrella', 'watch', 'ring',
+         'glasses', 'case', 'headphones', 'scarf', 'hat', 'sticker', 'silver', 'gold', 'zipper']
+
+
+def synthetic_item(rng, centroids, i, now):
+    """One random open item: category, time, place, text, colours and a clustered embedding"""
+    category = VALID_CATEGORIES[rng.integers(len(VALID_CATEGORIES))]
+    cluster = rng.integers(len(centroids))
+    embedding = centroids[cluster] + rng.normal(0, 0.35, DIM).astype(np.float32)
+    return {
+        'item_id': f'item-{i}',
+        'item_type': 'lost' if rng.random() < 0.5 else 'found',
+        'category': category,
+        'title': ' '.join(rng.choice(WORDS, 3)),
+        'description': ' '.join(rng.choice(WORDS, 8)),
+        'location': PLACES[rng.integers(len(PLACES))] if rng.random() < 0.8 else '',
+        'created_at': now - rng.random() * DAYS * 86400,
+        'features': list(rng.choice(COLOURS, 3, replace=False)),
+        'embedding': embedding / np.linalg.norm(embedding)
+    }
+
+
+def rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark incremental lost/found matching')
+    parser.add_argument('--open-items', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--window-days', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centroids = rng.normal(0, 1, (64, DIM)).astype(np.float32)
+    now = time.time()
+    baseline_mb = rss_mb()
+
+    # IVF training is irrelevant here: matching gathers candidate rows by id
+    index = VectorIndex(ann_threshold=10 ** 9)
+    engine = MatchEngine(index, window_days=args.window_days)
+
+    start = time.perf_counter()
+    for i in range(args.open_items):
+        item = synthetic_item(rng, centroids, i, now)
+        embedding = item.pop('embedding')
+        index.add(item['item_id'], embedding, item['category'], item['item_type'])
+        engine.add(**item, embedding=embedding, match=False)
+    load_seconds = time.perf_counter() - start
+    print(f"Loaded {len(engine)} open items in {load_seconds:.1f}s "
+          f"({len(engine) / load_seconds:.0f} items/s), {rss_mb() - baseline_mb:.0f} MB")
+
+    latencies, scored, matched = [], [], []
+    for i in range(args.queries):
+        item = synthetic_item(rng, centroids, args.open_items + i, now)
+        embedding = item.pop('embedding')
+        start = time.perf_counter()
+        matches = engine.add(**item, embedding=embedding)
+        index.add(item['item_id'], embedding, item['category'], item['item_type'])
+        latencies.append((time.perf_counter() - start) * 1000)
+        scored.append(engine.stats()['last_add']['scored'])
+        matched.append(len(matches))
+
+    latencies = np.asarray(latencies)
+    print(f"\n{args.queries} incremental adds against {args.open_items} open items (window {args.window_days:g} days)")
+    print(f"  latency ms      p50 {np.percentile(latencies, 50):.2f}  p95 {np.percentile(latencies, 95):.2f}"
+          f"  p99 {np.percentile(latencies, 99):.2f}  max {latencies.max():.2f}")
+    print(f"  scored per add  mean {np.mean(scored):.0f}  max {max(scored)}"
+          f"  ({np.mean(scored) / len(engine):.2%} of open items survive blocking)")
+    print(f"  matches per add mean {np.mean(matched):.2f}")
+    print(f"  peak RSS        {rss_mb():.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
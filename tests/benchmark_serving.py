@@ -0,0 +1,100 @@
+"""
+Serving-mode benchmark for the AI service.
+
+Start the service one way, run this, then restart it the other way and run it again:
+    cd ai_service && python main.py                                  # single-process dev server
+    cd ai_service && gunicorn -c gunicorn.conf.py main:app           # preforked workers
+    python tests/benchmark_serving.py --url http://localhost:5000 --concurrency 16 --requests 400
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import requests
+
+
+DEFAULT_IMAGE = os.path.join('test_images', 'laptop_test.jpg')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def run(url, endpoint, image_bytes, concurrency, total, unique=False):
+    latencies = []
+    errors = [0]
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            # Trailing bytes after the JPEG end marker change the hash but not the pixels
+            body = image_bytes + f'{time.time_ns()}-{n}'.encode() if unique else image_bytes
+            start = time.perf_counter()
+            try:
+                response = session.post(f'{url}{endpoint}', files={'image': ('image.jpg', body, 'image/jpeg')})
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'p50_ms': round(percentile(latencies, 50), 1),
+        'p95_ms': round(percentile(latencies, 95), 1),
+        'p99_ms': round(percentile(latencies, 99), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Closed-loop throughput/latency benchmark')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--endpoint', default='/analyze-hybrid')
+    parser.add_argument('--image', default=DEFAULT_IMAGE)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--unique', action='store_true',
+                        help='append a counter to each upload so the result cache is bypassed')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        image_bytes = f.read()
+
+    health = requests.get(f'{args.url}/health').json()
+    print(f"Service: model_loaded={health.get('model_loaded')} version={health.get('model_version')}")
+
+    # Warm-up so lazy initialisation is not measured
+    run(args.url, args.endpoint, image_bytes, min(args.concurrency, 4), min(args.requests, 8), args.unique)
+    result = run(args.url, args.endpoint, image_bytes, args.concurrency, args.requests, args.unique)
+    for key, value in result.items():
+        print(f'{key:>16}: {value}')
+    return 0 if result['errors'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
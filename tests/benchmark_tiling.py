@@ -0,0 +1,115 @@
+"""
+Cost/benefit of sliced inference (ai_service/tiling.py) on large photos.
+
+    python tests/benchmark_tiling.py --images test_images
+    python tests/benchmark_tiling.py --images data/shelves --labels data/shelves/labels --max-tiles 4 6 8
+
+Each image is decoded once, then analyzed once per configuration in-process (no result cache).
+Reported: latency, tiles and forward-pass batch size per image, detections, and small
+detections (< 1% of the image area). With --labels, also recall of small labelled objects at IoU 0.5.
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service')))
+
+import tiling
+from ai_engine import AIEngine, DETECT_CONFIDENCE
+from image_io import decode_image
+
+IMAGE_EXTENSIONS = ('*.jpg', '*.jpeg', '*.png', '*.webp', '*.bmp')
+SMALL_AREA = 0.01
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def small_labels(labels_dir, image_path):
+    """Normalized YOLO boxes under SMALL_AREA as (cx, cy, w, h)"""
+    path = os.path.join(labels_dir, os.path.splitext(os.path.basename(image_path))[0] + '.txt')
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        boxes = [tuple(map(float, line.split()[1:5])) for line in f if len(line.split()) >= 5]
+    return [b for b in boxes if b[2] * b[3] < SMALL_AREA]
+
+
+def run(engine, images, mode, max_tiles, labels):
+    """Analyze every (path, img, scale) once; mode is 'off', 'auto' or 'on'"""
+    before = engine.batcher.stats()
+    latencies, tiles, found, small, hits, truths = [], [], 0, 0, 0, 0
+    for path, img, scale in images:
+        start = time.perf_counter()
+        if tiling.should_tile(mode, max(img.shape[:2]) * scale):
+            raw = engine.analyze_tiled(img, with_features=False, scale=scale, max_tiles=max_tiles)
+        else:
+            raw = engine.analyze(img, with_features=False, scale=scale)
+        latencies.append((time.perf_counter() - start) * 1000)
+        tiles.append(raw.get('tiles', 0))
+
+        detections = engine.detections(raw, DETECT_CONFIDENCE)
+        h, w = (round(d * scale) for d in img.shape[:2])
+        boxes = [d['bbox'] for d in detections]
+        found += len(boxes)
+        small += sum((b[2] - b[0]) * (b[3] - b[1]) < SMALL_AREA * w * h for b in boxes)
+        if labels:
+            for cx, cy, bw, bh in small_labels(labels, path):
+                truth = [(cx - bw / 2) * w, (cy - bh / 2) * h, (cx + bw / 2) * w, (cy + bh / 2) * h]
+                truths += 1
+                hits += any(iou(truth, b) >= 0.5 for b in boxes)
+
+    after = engine.batcher.stats()
+    batches = after['batches'] - before['batches']
+    return {
+        'p50': float(np.median(latencies)), 'p95': float(np.percentile(latencies, 95)),
+        'tiles': float(np.mean(tiles)),
+        'batch': (after['requests'] - before['requests']) / batches if batches else 0.0,
+        'found': found, 'small': small, 'recall': hits / truths if truths else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tiled inference against whole-image inference')
+    parser.add_argument('--weights', default=os.environ.get('AI_MODEL_PATH', 'yolov8m.pt'))
+    parser.add_argument('--images', default='test_images')
+    parser.add_argument('--labels', help='YOLO-format label folder for small-object recall')
+    parser.add_argument('--max-tiles', type=int, nargs='+', default=[tiling.MAX_TILES])
+    args = parser.parse_args()
+
+    paths = sorted(p for pattern in IMAGE_EXTENSIONS for p in glob.glob(os.path.join(args.images, pattern)))
+    if not paths:
+        raise SystemExit(f"No images found in {args.images}")
+    engine = AIEngine(args.weights)
+    if not engine.model_loaded:
+        raise SystemExit("Model not available; the benchmark needs real weights")
+    engine.warm_up()
+
+    # Decoded once at the tiling resolution, so decode time is not part of the comparison
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append((path, *decode_image(f, tiling.TILE_DECODE_SIDE)))
+    print(f"{len(images)} images from {args.images}, tile {tiling.TILE_SIZE}px, overlap {tiling.TILE_OVERLAP:.0%}")
+
+    configs = [('off', 0)] + [(mode, n) for n in args.max_tiles for mode in ('auto', 'on')]
+    print(f"\n{'mode':<14}{'p50 ms':>10}{'p95 ms':>10}{'tiles':>8}{'batch':>8}{'found':>8}{'small':>8}{'recall':>9}")
+    for mode, max_tiles in configs:
+        result = run(engine, images, mode, max_tiles, args.labels)
+        recall = f"{result['recall']:.1%}" if result['recall'] is not None else '-'
+        label = f'{mode}/{max_tiles}' if max_tiles else mode
+        print(f"{label:<14}{result['p50']:>10.1f}{result['p95']:>10.1f}{result['tiles']:>8.1f}"
+              f"{result['batch']:>8.1f}{result['found']:>8}{result['small']:>8}{recall:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Multi-frame inventory (ai_service/video_inventory.py) on synthetic shelf pans of growing length.
+
+    python tests/benchmark_video.py
+    python tests/benchmark_video.py --passes 1 4 16 --sample-fps 6 --max-frames 100000
+
+Each clip pans a 640x480 window back and forth across a wide synthetic shelf, --passes times.
+The engine runs without weights (fallback detections), so this measures everything around the
+forward pass: decoding, the dHash gate, motion estimation, tracking and crops. Peak RSS should
+stay flat as the clip grows.
+"""
+
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import numpy as np
+import cv2
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service')))
+
+from ai_engine import AIEngine
+from video_inventory import VideoInventory, video_frames
+
+
+def rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def shelf(rng, width=2400, height=480):
+    img = cv2.GaussianBlur((rng.random((height, width, 3)) * 120 + 60).astype(np.uint8), (0, 0), 4)
+    for x in range(150, width - 200, 300):
+        colour = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.rectangle(img, (x, int(rng.integers(60, 200))), (x + int(rng.integers(80, 180)), 400), colour, -1)
+    return img
+
+
+def write_clip(path, canvas, passes, step=16, fps=30):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (640, 480))
+    positions = list(range(0, canvas.shape[1] - 640, step))
+    frames = 0
+    for k in range(passes):
+        for x in positions if k % 2 == 0 else positions[::-1]:
+            writer.write(canvas[:, x:x + 640])
+            frames += 1
+    writer.release()
+    return frames / fps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the multi-frame inventory pipeline')
+    parser.add_argument('--passes', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--sample-fps', type=float, default=6)
+    parser.add_argument('--max-frames', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    engine = AIEngine(model_path=os.path.join(tempfile.gettempdir(), 'no-weights.pt'))
+    canvas = shelf(np.random.default_rng(args.seed))
+    for passes in args.passes:
+        with tempfile.NamedTemporaryFile(suffix='.mp4') as f:
+            seconds = write_clip(f.name, canvas, passes)
+            before = rss_mb()
+            started = time.perf_counter()
+            tracker = VideoInventory(engine, max_frames=args.max_frames)
+            tracker.consume(video_frames(f.name, args.sample_fps))
+            body = tracker.result()
+            elapsed = time.perf_counter() - started
+        frames = body['frames']
+        print(f"{seconds:6.1f}s of video: {elapsed:5.2f}s ({seconds / elapsed:5.1f}x real time), "
+              f"{frames['sampled']} sampled, {frames['skipped']} gated, {frames['keyframes']} keyframes, "
+              f"{body['count']} items, peak RSS {before:.0f} -> {rss_mb():.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Check that scripts/dataset_cache.py's ultralytics hook serves training batches like the normal loader.
+
+    python tests/dataset_cache_hook.py
+
+Builds a small cache from synthetic images, then runs augmented (mosaic) __getitem__ calls on an
+ultralytics training dataset with the hook installed: the cached images must land in the mosaic
+buffer and have the same shape and pixels as ultralytics' own load_image(). A 'val' split, cached
+without augmentation (INTER_AREA when shrinking), must match a non-augmented dataset the same way.
+Needs ultralytics.
+"""
+
+import os
+import sys
+import tempfile
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+import dataset_cache
+
+IMGSZ = 320
+# Odd aspect ratios, where rounding and ceil'ing the resized side differ
+SHAPES = [(480, 640), (333, 1000), (1001, 333), (320, 320), (77, 91), (600, 397)]
+
+
+def write_dataset(folder, rng):
+    os.makedirs(os.path.join(folder, 'images'))
+    os.makedirs(os.path.join(folder, 'labels'))
+    for k, (h, w) in enumerate(SHAPES):
+        img = cv2.GaussianBlur(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), (0, 0), 2)
+        cv2.imwrite(os.path.join(folder, 'images', f'{k}.png'), img)
+        with open(os.path.join(folder, 'labels', f'{k}.txt'), 'w') as f:
+            f.write('0 0.5 0.5 0.25 0.25\n')
+
+
+def training_dataset(images_dir, mode='train'):
+    from ultralytics.cfg import get_cfg
+    from ultralytics.data import build_yolo_dataset
+    cfg = get_cfg(overrides={'imgsz': IMGSZ, 'mosaic': 1.0})
+    return build_yolo_dataset(cfg, images_dir, batch=2, data={'names': {0: 'item'}, 'nc': 1}, mode=mode)
+
+
+def assert_same_images(dataset, expected):
+    for i, f in enumerate(dataset.im_files):
+        im, hw0, hw = dataset.load_image(i)
+        ref_im, ref_hw0, ref_hw = expected[os.path.abspath(f)]
+        assert (hw0, hw) == (ref_hw0, ref_hw), (f, hw0, hw, ref_hw0, ref_hw)
+        assert np.array_equal(im, ref_im), f
+
+
+def main():
+    from ultralytics.data.base import BaseDataset
+
+    scratch = tempfile.mkdtemp(prefix='dataset-cache-hook-')
+    write_dataset(os.path.join(scratch, 'raw'), np.random.default_rng(0))
+    images_dir = os.path.join(scratch, 'raw', 'images')
+    cache_dir = os.path.join(scratch, 'cache')
+    files = dataset_cache.image_files(images_dir)
+    dataset_cache.build_split(files, os.path.join(cache_dir, 'train'), IMGSZ, workers=2)
+    dataset_cache.build_split(files, os.path.join(cache_dir, 'val'), IMGSZ, workers=2, augment=False)
+
+    # Reference: ultralytics' own loader, before the hook replaces it
+    expected = {}
+    for mode in ('train', 'val'):
+        plain = training_dataset(images_dir, mode)
+        expected[mode] = {os.path.abspath(f): plain.load_image(i) for i, f in enumerate(plain.im_files)}
+
+    original = BaseDataset.load_image
+    dataset_cache.install_ultralytics_hook(cache_dir)
+    try:
+        dataset = training_dataset(images_dir)
+        assert dataset.augment and not dataset.buffer
+        sample = dataset[0]  # Mosaic draws its other three images from dataset.buffer
+        assert sample['img'].shape[-2:] == (IMGSZ, IMGSZ), sample['img'].shape
+        assert 0 in dataset.buffer, dataset.buffer
+        assert_same_images(dataset, expected['train'])
+        assert len(dataset.buffer) < dataset.max_buffer_length
+
+        # Validation images are resized without augmentation: INTER_AREA when shrinking
+        validation = training_dataset(images_dir, 'val')
+        assert not validation.augment
+        assert_same_images(validation, expected['val'])
+        assert not validation.buffer, validation.buffer
+    finally:
+        BaseDataset.load_image = original
+    print(f"✓ {len(SHAPES)} cached images match ultralytics' loader (train and val); mosaic buffer {dataset.buffer}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
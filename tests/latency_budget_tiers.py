@@ -0,0 +1,79 @@
+"""
+Tier choice of ai_service/latency_budget.plan() when the cheaper model is unavailable.
+
+    python tests/latency_budget_tiers.py
+
+A fast ('n') model that failed to load would answer with mock detections, so a tight budget
+must stay on the full tier (or be shed when requests are queueing), never pick 'fast' or 'preview'.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service')))
+
+from latency_budget import plan, Overloaded
+
+
+class FixedBatcher:
+    def __init__(self, batch_ms, depth=0):
+        self.batch_ms = batch_ms
+        self.depth = depth
+
+    def estimate_wait_ms(self, default_batch_ms):
+        return (self.depth + 1) * self.batch_ms
+
+    def queue_depth(self):
+        return self.depth
+
+
+class Engine:
+    def __init__(self, state, batch_ms, depth=0):
+        self.state = state
+        self._batcher = FixedBatcher(batch_ms, depth)
+
+    def batcher_for(self, imgsz):
+        return self._batcher
+
+
+class Registry:
+    """The two model versions plan() resolves: the active 'm' model and the fast 'n' one"""
+
+    def __init__(self, full, fast):
+        self.engines = {'yolov8m': full, 'yolov8n': fast}
+
+    def resolve(self, name=None):
+        return 'yolov8n' if name == 'n' else 'yolov8m'
+
+    def get(self, version):
+        return self.engines[version]
+
+
+def main():
+    # Sanity: with a ready fast model a tight budget is served by a cheaper tier
+    choice = plan(Registry(Engine('ready', 400), Engine('ready', 60)), budget_ms=200)
+    assert choice.tier == 'fast' and choice.version == 'yolov8n', choice
+
+    for state in ('failed', 'loading'):
+        # Idle service: the full tier, even though it misses the budget
+        choice = plan(Registry(Engine('ready', 400), Engine(state, 60)), budget_ms=200)
+        assert choice.tier == 'full' and choice.version == 'yolov8m', (state, choice)
+
+        # Requests queueing: shed rather than fall through to the unavailable model
+        try:
+            choice = plan(Registry(Engine('ready', 400, depth=3), Engine(state, 60)), budget_ms=200)
+        except Overloaded:
+            pass
+        else:
+            raise AssertionError(f'fast model {state}: expected Overloaded, got {choice}')
+
+    # A failed full model is still the service's fallback mode, never skipped
+    choice = plan(Registry(Engine('failed', 400), Engine('failed', 60)), budget_ms=5000)
+    assert choice.tier == 'full', choice
+
+    print("✓ latency budget never picks a fast or preview tier whose model is not ready")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
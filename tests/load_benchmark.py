@@ -0,0 +1,336 @@
+"""
+Offline load / latency benchmark for the AI service, on a synthetic image corpus.
+
+    python tests/load_benchmark.py --in-process --fallback                     # no server, no weights
+    python tests/load_benchmark.py --url http://localhost:5000 --concurrency 8 --requests 200
+    python tests/load_benchmark.py --url http://localhost:5000 --rate 20 --duration 30
+    python tests/load_benchmark.py --in-process --fallback --output results.json --baseline baseline.json
+
+Each endpoint (/detect, /analyze-hybrid, /extract by default) is a stage, run one after another.
+Closed loop (--concurrency clients sending back to back) unless --rate is given; then requests
+arrive open loop at --rate per second (Poisson, or evenly spaced with --arrival fixed) and latency
+is measured from the scheduled send time, so a backed-up service is not hidden by a slow client.
+
+Images are synthesised (phone-camera to web sizes), so nothing is downloaded. Every upload gets a
+unique trailing suffix, which defeats the exact result cache without changing the pixels.
+--in-process drives main.app through Flask's test client; --fallback also points it at missing
+weights, so the model-unavailable path is measured and the run needs neither a server nor a GPU.
+
+--output writes the results as JSON. --baseline compares them with an earlier --output file
+(same machine and settings) and exits 1 when a stage is slower or has lower throughput than
+--tolerance allows.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+AI_SERVICE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service'))
+
+DEFAULT_ENDPOINTS = ['/detect', '/analyze-hybrid', '/extract']
+
+# (name, width, height, share of the corpus): phone photos dominate real uploads
+IMAGE_SIZES = [
+    ('phone-landscape', 4032, 3024, 0.3),
+    ('phone-portrait', 3024, 4032, 0.2),
+    ('full-hd', 1920, 1080, 0.2),
+    ('web', 1280, 960, 0.2),
+    ('small', 800, 600, 0.1)
+]
+
+# Compared against the baseline; latency may not grow, throughput may not shrink beyond the tolerance
+LATENCY_KEYS = ('p50_ms', 'p95_ms', 'p99_ms')
+THROUGHPUT_KEY = 'throughput_rps'
+
+
+def synthetic_image(rng, width, height, quality=90):
+    """
+    JPEG bytes of a photo-like image: a smooth background, a few solid objects and sensor noise,
+    so it decodes (and compresses) like a camera photo rather than a flat or white-noise frame
+    """
+    background = rng.integers(0, 256, (max(2, height // 256), max(2, width // 256), 3), dtype=np.uint8)
+    img = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(rng.integers(2, 6)):
+        colour = tuple(int(c) for c in rng.integers(0, 256, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        w, h = int(rng.integers(width // 10, width // 3)), int(rng.integers(height // 10, height // 3))
+        if rng.random() < 0.5:
+            cv2.rectangle(img, (x, y), (x + w, y + h), colour, -1)
+        else:
+            cv2.ellipse(img, (x, y), (w // 2, h // 2), float(rng.integers(0, 180)), 0, 360, colour, -1)
+    noise = rng.normal(0, 4, img.shape).astype(np.int16)
+    img = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes()
+
+
+def build_corpus(size, seed=0):
+    """[(size name, JPEG bytes)], sizes drawn with the IMAGE_SIZES shares"""
+    rng = np.random.default_rng(seed)
+    shares = np.array([share for *_, share in IMAGE_SIZES])
+    picks = rng.choice(len(IMAGE_SIZES), size, p=shares / shares.sum())
+    return [(IMAGE_SIZES[i][0], synthetic_image(rng, IMAGE_SIZES[i][1], IMAGE_SIZES[i][2])) for i in picks]
+
+
+class HTTPTarget:
+    """A running service"""
+
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip('/')
+        self._requests = requests
+        self._local = threading.local()
+
+    def post(self, endpoint, body):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        try:
+            response = session.post(f'{self.url}{endpoint}', files={'image': ('image.jpg', body, 'image/jpeg')})
+            return response.status_code
+        except self._requests.RequestException:
+            return 'connection-error'
+
+    def health(self):
+        return self._requests.get(f'{self.url}/health').json()
+
+
+class InProcessTarget:
+    """main.app through Flask's test client: no server, same request path"""
+
+    def __init__(self, fallback=False):
+        scratch = tempfile.mkdtemp(prefix='load-benchmark-')
+        os.environ.setdefault('AI_BATCH_JOBS_DIR', os.path.join(scratch, 'batch_jobs'))
+        os.environ.setdefault('AI_MODEL_REGISTRY_DIR', os.path.join(scratch, 'models'))
+        if fallback:
+            # No registry entries and no weights: the engine fails over to mock detections
+            os.environ['AI_MODEL_PATH'] = os.path.join(scratch, 'missing.pt')
+            os.environ['AI_MODEL_SCAN_DIRS'] = ''
+        sys.path.append(AI_SERVICE_DIR)
+        import main
+        self.app = main.app
+        main.registry.get().wait_until_ready()
+        self._local = threading.local()
+
+    def post(self, endpoint, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(endpoint, data={'image': (io.BytesIO(body), 'image.jpg')},
+                               content_type='multipart/form-data')
+        return response.status_code
+
+    def health(self):
+        return self.app.test_client().get('/health').get_json()
+
+
+def summarize(latencies, statuses, wall):
+    ok = np.asarray([ms for ms, status in zip(latencies, statuses) if status == 200])
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    result = {
+        'requests': len(statuses),
+        'ok': int(ok.size),
+        'errors': len(statuses) - int(ok.size),
+        'status_codes': counts,
+        'seconds': round(wall, 3),
+        'throughput_rps': round(ok.size / wall, 2) if wall else 0.0
+    }
+    if ok.size:
+        result.update({
+            'mean_ms': round(float(ok.mean()), 2),
+            'p50_ms': round(float(np.percentile(ok, 50)), 2),
+            'p95_ms': round(float(np.percentile(ok, 95)), 2),
+            'p99_ms': round(float(np.percentile(ok, 99)), 2),
+            'max_ms': round(float(ok.max()), 2)
+        })
+    return result
+
+
+def upload_body(corpus, n):
+    # Trailing bytes after the JPEG end marker change the hash but not the pixels
+    return corpus[n % len(corpus)][1] + f'{time.time_ns()}-{n}'.encode()
+
+
+def run_closed(target, endpoint, corpus, concurrency, total):
+    """concurrency clients, each sending its next request as soon as the previous one returns"""
+    latencies, statuses = [], []
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            body = upload_body(corpus, n)
+            start = time.perf_counter()
+            status = target.post(endpoint, body)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(status)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def run_open(target, endpoint, corpus, rate, duration, arrival='poisson', max_inflight=256, seed=0):
+    """
+    Requests scheduled at rate per second for duration seconds, independent of responses.
+    Latency counts from the scheduled time, including any wait for a free sender.
+    """
+    rng = np.random.default_rng(seed)
+    total = max(1, int(rate * duration))
+    gaps = rng.exponential(1.0 / rate, total) if arrival == 'poisson' else np.full(total, 1.0 / rate)
+    offsets = np.cumsum(gaps) - gaps[0]
+    latencies, statuses = [None] * total, [None] * total
+
+    def send(n, scheduled):
+        status = target.post(endpoint, upload_body(corpus, n))
+        latencies[n] = (time.perf_counter() - scheduled) * 1000
+        statuses[n] = status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        for n, offset in enumerate(offsets.tolist()):
+            scheduled = started + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, n, scheduled)
+    result = summarize(latencies, statuses, time.perf_counter() - started)
+    result['offered_rps'] = rate
+    return result
+
+
+def server_snapshot(health):
+    """The parts of /health that break a stage down on the server side"""
+    batching = health.get('batching') or {}
+    cache = health.get('cache') or {}
+    return {
+        'batches': batching.get('batches'),
+        'avg_batch_size': batching.get('avg_batch_size'),
+        'queue_wait_ms': batching.get('queue_wait_ms'),
+        'batch_ms_ewma': batching.get('batch_ms_ewma'),
+        'cache': {key: cache.get(key) for key in ('hits', 'phash_hits', 'misses', 'hit_rate') if key in cache}
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against baseline, as printable lines"""
+    regressions = []
+    for endpoint, stage in results['stages'].items():
+        before = baseline.get('stages', {}).get(endpoint)
+        if not before:
+            continue
+        for key in LATENCY_KEYS:
+            if key in stage and before.get(key) and stage[key] > before[key] * (1 + tolerance):
+                regressions.append(f'{endpoint} {key}: {before[key]} -> {stage[key]}')
+        if before.get(THROUGHPUT_KEY) and stage[THROUGHPUT_KEY] < before[THROUGHPUT_KEY] * (1 - tolerance):
+            regressions.append(f'{endpoint} {THROUGHPUT_KEY}: {before[THROUGHPUT_KEY]} -> {stage[THROUGHPUT_KEY]}')
+        if stage['errors'] > before.get('errors', 0):
+            regressions.append(f"{endpoint} errors: {before.get('errors', 0)} -> {stage['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load / latency benchmark on a synthetic corpus')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--in-process', action='store_true', help='drive main.app directly instead of --url')
+    parser.add_argument('--fallback', action='store_true', help='with --in-process, run without model weights')
+    parser.add_argument('--endpoints', nargs='+', default=DEFAULT_ENDPOINTS)
+    parser.add_argument('--corpus', type=int, default=16, help='distinct synthetic images')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100, help='per stage, closed loop')
+    parser.add_argument('--rate', type=float, help='requests per second; switches to open loop')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per stage, open loop')
+    parser.add_argument('--arrival', choices=['poisson', 'fixed'], default='poisson')
+    parser.add_argument('--max-inflight', type=int, default=256, help='open-loop sender threads')
+    parser.add_argument('--warmup', type=int, default=4, help='unmeasured requests per stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    corpus = build_corpus(args.corpus, args.seed)
+    sizes = [len(body) for _, body in corpus]
+    print(f"Corpus: {len(corpus)} images, {np.mean(sizes) / 1e6:.2f} MB mean, "
+          f"built in {time.perf_counter() - started:.1f}s")
+
+    target = InProcessTarget(args.fallback) if args.in_process else HTTPTarget(args.url)
+    health = target.health()
+    print(f"Service: model_state={health.get('model_state')} version={health.get('model_version')} "
+          f"backend={health.get('backend')}")
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'target': 'in-process' if args.in_process else args.url,
+        'model_state': health.get('model_state'),
+        'model_version': health.get('model_version'),
+        'backend': health.get('backend'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'load': ({'mode': 'open', 'rate': args.rate, 'duration': args.duration, 'arrival': args.arrival}
+                 if args.rate else {'mode': 'closed', 'concurrency': args.concurrency, 'requests': args.requests}),
+        'corpus': {'images': len(corpus), 'mean_bytes': int(np.mean(sizes)), 'seed': args.seed,
+                   'sizes': {name: sum(1 for n, _ in corpus if n == name) for name, *_ in IMAGE_SIZES}},
+        'stages': {},
+        'server': {}
+    }
+
+    for endpoint in args.endpoints:
+        if args.warmup:
+            run_closed(target, endpoint, corpus, min(args.concurrency, args.warmup), args.warmup)
+        if args.rate:
+            stage = run_open(target, endpoint, corpus, args.rate, args.duration, args.arrival,
+                             args.max_inflight, args.seed)
+        else:
+            stage = run_closed(target, endpoint, corpus, args.concurrency, args.requests)
+        results['stages'][endpoint] = stage
+        results['server'][endpoint] = server_snapshot(target.health())
+
+        print(f"\n{endpoint}")
+        for key in ('requests', 'errors', 'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'):
+            if key in stage:
+                print(f'{key:>16}: {stage[key]}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    failed = any(stage['errors'] for stage in results['stages'].values())
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('load') != results['load'] or baseline.get('model_state') != results['model_state']:
+            print('⚠ Baseline was recorded with different load settings or model state')
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"\nBaseline {args.baseline} (tolerance {args.tolerance:.0%}): "
+              f"{len(regressions)} regression(s)")
+        for line in regressions:
+            print(f'  {line}')
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
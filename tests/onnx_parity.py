@@ -0,0 +1,174 @@
+"""
+Parity and latency check between the ultralytics (PyTorch) backend and ONNX exports.
+
+    python tests/onnx_parity.py --onnx yolov8m.onnx yolov8m.int8-static.onnx --images test_images
+    python tests/onnx_parity.py --onnx best.onnx --pt best.pt --images data/val/images --labels data/val/labels
+
+Detections are serialized through AIEngine.detections(), i.e. exactly as the API returns them.
+Without --labels, the PyTorch detections are the reference for the mAP50 delta.
+Each export is also run on the images with red and blue swapped; if those agree better with the
+reference, the two backends feed their models different channel orders and the check fails.
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service')))
+
+from ai_engine import AIEngine, HYBRID_CONFIDENCE
+from backends import create_backend
+from image_io import decode_image
+
+IMAGE_EXTENSIONS = ('*.jpg', '*.jpeg', '*.png', '*.webp', '*.bmp')
+MATCH_IOU = 0.9
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def load_labels(labels_dir, image_path, shape):
+    """YOLO txt labels (class cx cy w h, normalized) -> [(class_id, bbox)] in pixels"""
+    path = os.path.join(labels_dir, os.path.splitext(os.path.basename(image_path))[0] + '.txt')
+    if not os.path.exists(path):
+        return []
+    h, w = shape
+    boxes = []
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 5:
+                cls, cx, cy, bw, bh = int(parts[0]), *map(float, parts[1:5])
+                boxes.append((cls, [(cx - bw / 2) * w, (cy - bh / 2) * h, (cx + bw / 2) * w, (cy + bh / 2) * h]))
+    return boxes
+
+
+def average_precision(predictions, truths, iou_threshold=0.5):
+    """mAP over classes; predictions/truths are per-image lists of (class, bbox[, score])"""
+    classes = {c for image in truths for c, _ in image}
+    aps = []
+    for cls in classes:
+        scored = [(p[2], i, p[1]) for i, image in enumerate(predictions) for p in image if p[0] == cls]
+        scored.sort(key=lambda s: -s[0])
+        gt = {i: [b for c, b in image if c == cls] for i, image in enumerate(truths)}
+        n_gt = sum(len(v) for v in gt.values())
+        used = {i: [False] * len(v) for i, v in gt.items()}
+        tp = []
+        for _, i, box in scored:
+            overlaps = [iou(box, g) for g in gt[i]]
+            best = int(np.argmax(overlaps)) if overlaps else -1
+            hit = best >= 0 and overlaps[best] >= iou_threshold and not used[i][best]
+            if hit:
+                used[i][best] = True
+            tp.append(hit)
+        if not n_gt:
+            continue
+        tp = np.array(tp, dtype=np.float64)
+        recall = np.concatenate([[0], np.cumsum(tp) / n_gt, [1]])
+        precision = np.concatenate([[1], np.cumsum(tp) / np.maximum(np.arange(1, len(tp) + 1), 1), [0]])
+        precision = np.maximum.accumulate(precision[::-1])[::-1]
+        aps.append(float(np.sum(np.diff(recall) * precision[1:])))
+    return float(np.mean(aps)) if aps else 0.0
+
+
+def run_backend(path, images, runs):
+    backend = create_backend(path)
+    engine = AIEngine(load=False)
+    engine.names = backend.names
+    backend.predict([images[0][0]], 0.25)  # warm-up
+
+    latencies, outputs = [], []
+    for img, scale in images:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            raw = backend.predict([img], 0.25)[0]
+            times.append((time.perf_counter() - start) * 1000)
+        latencies.append(min(times))
+        raw.update(fallback=False, scale=scale)
+        outputs.append(engine.detections(raw, HYBRID_CONFIDENCE))
+    return backend, outputs, latencies
+
+
+def compare(reference, outputs):
+    """(match rate, max and mean confidence delta of matched detections) of outputs against reference"""
+    matched, total, deltas = 0, 0, []
+    for ref, out in zip(reference, outputs):
+        total += max(len(ref), len(out))
+        for d in out:
+            same = [r for r in ref if r['class'] == d['class'] and iou(r['bbox'], d['bbox']) >= MATCH_IOU]
+            if same:
+                matched += 1
+                deltas.append(abs(same[0]['confidence'] - d['confidence']))
+    return (matched / total if total else 1.0), max(deltas, default=0.0), float(np.mean(deltas)) if deltas else 0.0
+
+
+def as_tuples(detections, names):
+    ids = {name: cls for cls, name in names.items()}
+    return [(ids[d['class']], d['bbox'], d['confidence']) for d in detections]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare ONNX exports against the PyTorch backend')
+    parser.add_argument('--pt', default='yolov8m.pt')
+    parser.add_argument('--onnx', nargs='+', required=True)
+    parser.add_argument('--images', default='test_images')
+    parser.add_argument('--labels', help='YOLO-format label folder for true mAP50')
+    parser.add_argument('--runs', type=int, default=3, help='timed runs per image (min is kept)')
+    parser.add_argument('--min-match', type=float, default=0.95, help='fail below this detection match rate')
+    args = parser.parse_args()
+
+    paths = sorted(p for pattern in IMAGE_EXTENSIONS for p in glob.glob(os.path.join(args.images, pattern)))
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(decode_image(f))
+    print(f"{len(images)} images from {args.images}")
+
+    reference_backend, reference, reference_latency = run_backend(args.pt, images, args.runs)
+    names = reference_backend.names
+    if args.labels:
+        # Detections are reported in original pixels, so scale labels to the original size
+        truths = [[(c, b) for c, b in load_labels(args.labels, p, tuple(round(d * s) for d in img.shape[:2]))]
+                  for p, (img, s) in zip(paths, images)]
+    else:
+        truths = [[(c, b) for c, b, _ in as_tuples(d, names)] for d in reference]
+
+    reference_map = average_precision([as_tuples(d, names) for d in reference], truths)
+    print(f"\n{'backend':<40}{'p50 ms':>10}{'speedup':>10}{'mAP50':>10}{'Δ mAP50':>10}{'matched':>10}{'max Δconf':>11}")
+    print(f"{os.path.basename(args.pt):<40}{np.median(reference_latency):>10.1f}{1.0:>10.2f}{reference_map:>10.3f}{0.0:>10.3f}")
+
+    # The same images with red and blue swapped: if a backend fed its model the other channel
+    # order, its detections agree better with the reference on these than on the real ones
+    swapped = [(np.ascontiguousarray(img[..., ::-1]), scale) for img, scale in images]
+
+    failures = 0
+    for path in args.onnx:
+        _, outputs, latency = run_backend(path, images, args.runs)
+        match_rate, max_delta, mean_delta = compare(reference, outputs)
+        onnx_map = average_precision([as_tuples(d, names) for d in outputs], truths)
+        print(f"{os.path.basename(path):<40}{np.median(latency):>10.1f}"
+              f"{np.median(reference_latency) / np.median(latency):>10.2f}{onnx_map:>10.3f}"
+              f"{onnx_map - reference_map:>10.3f}{match_rate:>10.1%}{max_delta:>11.2f}")
+        if match_rate < args.min_match:
+            failures += 1
+
+        _, swapped_outputs, _ = run_backend(path, swapped, 1)
+        swapped_rate, _, swapped_delta = compare(reference, swapped_outputs)
+        if (swapped_rate, -swapped_delta) > (match_rate, -mean_delta):
+            print(f"  ⚠ channel order differs from {os.path.basename(args.pt)}: with red and blue swapped "
+                  f"{swapped_rate:.1%} match (mean Δconf {swapped_delta:.3f}) vs {match_rate:.1%} ({mean_delta:.3f})")
+            failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
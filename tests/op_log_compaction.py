@@ -0,0 +1,86 @@
+"""
+Compaction of the shared op logs (ai_service/op_log.py) while another worker process writes.
+
+    python tests/op_log_compaction.py
+
+One process appends items to a DuplicateIndex / MatchEngine log while a second process keeps
+compacting the same log, as two gunicorn workers would. Every appended item must survive:
+a compaction that read the log outside the writer lock would rewrite the file without the
+items appended in between.
+"""
+
+import os
+import sys
+import random
+import tempfile
+import multiprocessing
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_service')))
+
+from duplicate_index import DuplicateIndex
+from match_engine import MatchEngine
+
+ITEMS = 1500
+
+
+def open_index(kind, path):
+    return DuplicateIndex(path) if kind == 'duplicates' else MatchEngine(None, log_path=path)
+
+
+def add(index, kind, item_id):
+    if kind == 'duplicates':
+        index.add(item_id, random.getrandbits(64))
+    else:
+        index.add(item_id, 'lost', category='electronics', title=item_id, match=False)
+
+
+def writer(kind, path, ready, done):
+    index = open_index(kind, path)
+    ready.wait()
+    for i in range(ITEMS):
+        add(index, kind, f'w{i}')
+    done.set()
+
+
+def compactor(kind, path, ready, done, rounds):
+    index = open_index(kind, path)
+    ready.set()
+    n = 0
+    while not done.is_set():
+        index.compact()
+        n += 1
+    rounds.value = n
+
+
+def check(kind):
+    path = os.path.join(tempfile.mkdtemp(prefix='op-log-compaction-'), f'{kind}.log')
+    seed = open_index(kind, path)
+    for i in range(200):
+        add(seed, kind, f's{i}')
+
+    ready, done = multiprocessing.Event(), multiprocessing.Event()
+    rounds = multiprocessing.Value('i', 0)
+    processes = [multiprocessing.Process(target=writer, args=(kind, path, ready, done)),
+                 multiprocessing.Process(target=compactor, args=(kind, path, ready, done, rounds))]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+        assert p.exitcode == 0, f'{kind}: worker exited with {p.exitcode}'
+
+    fresh = open_index(kind, path)
+    expected = {f's{i}' for i in range(200)} | {f'w{i}' for i in range(ITEMS)}
+    stored = set(fresh._hashes) if kind == 'duplicates' else set(fresh._items)
+    lost = expected - stored
+    assert not lost, f'{kind}: {len(lost)} items lost by {rounds.value} concurrent compactions, e.g. {sorted(lost)[:5]}'
+    print(f"✓ {kind}: {len(expected)} items kept through {rounds.value} concurrent compactions")
+
+
+def main():
+    for kind in ('duplicates', 'matches'):
+        check(kind)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -70,7 +70,7 @@ def run_test():
         ai_result = None
         try:
             with open(img_path, 'rb') as f:
-                response = requests.post(f"{AI_URL}/detect", files={'file': f})
+                response = requests.post(f"{AI_URL}/detect", files={'image': f})
             
             if response.status_code == 200:
                 ai_result = response.json()